@@ -1,10 +1,23 @@
 from fastapi import FastAPI, HTTPException, responses, status, Request
 from pydantic import BaseModel
-from typing import Union, Dict, Optional
+from typing import Union, Dict, List, Optional
 
 import submodules.model.business_objects.general as general
+from controller import admission
+from controller import batch
+from controller import cache
 from controller import stats
 from controller import integration
+from controller import snapshot
+from controller import instrument
+from controller import jobs
+from controller import metadata
+from controller import notify
+from controller import profiling
+from controller import coalesce
+from controller import compute
+from controller import incremental
+from controller import weighted_vote
 
 # API creation and description
 app = FastAPI()
@@ -16,6 +29,7 @@ class WeakSupervisionRequest(BaseModel):
     user_id: str
     weak_supervision_task_id: str
     overwrite_weak_supervision: Optional[Union[float, Dict[str, float]]]
+    engine: Optional[str]
 
 
 class TaskStatsRequest(BaseModel):
@@ -36,6 +50,29 @@ class ExportWsStatsRequest(BaseModel):
     overwrite_weak_supervision: Optional[Union[float, Dict[str, float]]]
 
 
+class BatchRequest(BaseModel):
+    project_id: str
+    user_id: str
+    operation: str
+    labeling_task_ids: Optional[List[str]]
+    # fit_predict: payload id per labeling task
+    weak_supervision_task_ids: Optional[Dict[str, str]]
+    overwrite_weak_supervision: Optional[Union[float, Dict[str, float]]]
+    engine: Optional[str]
+
+
+class ProfilingRequest(BaseModel):
+    project_id: Optional[str]
+    requests: int = 1
+
+
+class InvalidateMetadataRequest(BaseModel):
+    project_id: Optional[str]
+    labeling_task_id: Optional[str]
+    source_id: Optional[str]
+    user_id: Optional[str]
+
+
 @app.middleware("http")
 async def handle_db_session(request: Request, call_next):
     session_token = general.get_ctx_token()
@@ -47,27 +84,89 @@ async def handle_db_session(request: Request, call_next):
     return response
 
 
+@app.middleware("http")
+async def handle_profiling(request: Request, call_next):
+    # only marks the request, endpoints and jobs capture the profile in the
+    # thread doing the work
+    token = profiling.request_started(request.headers.get(profiling.PROFILE_HEADER))
+    try:
+        return await call_next(request)
+    finally:
+        profiling.request_finished(token)
+
+
+@app.exception_handler(admission.AdmissionTimeout)
+async def handle_admission_timeout(
+    request: Request, exc: admission.AdmissionTimeout
+) -> responses.PlainTextResponse:
+    return responses.PlainTextResponse(
+        str(exc), status_code=status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+
+
+@app.on_event("shutdown")
+def finish_jobs() -> None:
+    batch.shutdown()
+    jobs.shutdown()
+    compute.shutdown()
+    notify.dispatcher.shutdown(notify.NOTIFY_TIMEOUT_SECONDS)
+
+
 @app.post("/fit_predict")
 def weakly_supervise(
     request: WeakSupervisionRequest,
 ) -> responses.PlainTextResponse:
-    integration.fit_predict(
+    if request.engine is not None and request.engine not in weighted_vote.ENGINES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown engine {request.engine}",
+        )
+    accepted = integration.submit_fit_predict(
         request.project_id,
         request.labeling_task_id,
         request.user_id,
         request.weak_supervision_task_id,
         request.overwrite_weak_supervision,
+        request.engine,
+    )
+    if not accepted:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many weak supervision jobs queued",
+        )
+    return responses.PlainTextResponse(
+        request.weak_supervision_task_id, status_code=status.HTTP_202_ACCEPTED
     )
-    return responses.PlainTextResponse(status_code=status.HTTP_200_OK)
+
+
+@app.get("/fit_predict/{weak_supervision_task_id}")
+def weakly_supervise_status(weak_supervision_task_id: str) -> responses.JSONResponse:
+    job = jobs.get_status(weak_supervision_task_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Unknown job"
+        )
+    return responses.JSONResponse(job)
 
 
 @app.post("/labeling_task_statistics")
 def calculate_task_stats(
     request: TaskStatsRequest,
 ) -> responses.PlainTextResponse:
-    stats.calculate_quality_statistics_for_labeling_task(
-        request.project_id, request.labeling_task_id, request.user_id
-    )
+    with instrument.request("labeling_task_statistics"), profiling.capture(
+        request.project_id, request.labeling_task_id, "labeling_task_statistics"
+    ):
+        # only the run that does the work waits for memory, not attached callers
+        coalesce.flights.do(
+            (request.project_id, request.labeling_task_id, "labeling_task_statistics"),
+            admission.run_for_task,
+            request.project_id,
+            request.labeling_task_id,
+            stats.calculate_quality_statistics_for_labeling_task,
+            request.project_id,
+            request.labeling_task_id,
+            request.user_id,
+        )
     return responses.PlainTextResponse(status_code=status.HTTP_200_OK)
 
 
@@ -75,27 +174,127 @@ def calculate_task_stats(
 def calculate_source_stats(
     request: SourceStatsRequest,
 ) -> responses.PlainTextResponse:
-    has_coverage = stats.calculate_quantity_statistics_for_labeling_task_from_source(
-        request.project_id, request.source_id, request.user_id
-    )
-    if has_coverage:
-        stats.calculate_quality_statistics_for_source(
-            request.project_id, request.source_id, request.user_id
-        )
+    with instrument.request("source_statistics"):
+        # profiles are filed under the labeling task of the source
+        task_info = metadata.get_task_by_source(request.source_id)
+        with profiling.capture(
+            request.project_id, task_info.id, "source_statistics"
+        ), admission.admit_task(task_info.project_id, task_info.id):
+            task_snapshot = snapshot.load(
+                task_info.project_id, task_info.id, with_versions=True
+            )
+            has_coverage = (
+                stats.calculate_quantity_statistics_for_labeling_task_from_source(
+                    request.project_id,
+                    request.source_id,
+                    request.user_id,
+                    task_snapshot,
+                )
+            )
+            if has_coverage:
+                stats.calculate_quality_statistics_for_source(
+                    request.project_id,
+                    request.source_id,
+                    request.user_id,
+                    task_snapshot,
+                )
     return responses.PlainTextResponse(status_code=status.HTTP_200_OK)
 
 
 @app.post("/export_ws_stats")
 def export_ws_stats(request: ExportWsStatsRequest) -> responses.PlainTextResponse:
-    status_code, message = integration.export_weak_supervision_stats(
-        request.project_id, request.labeling_task_id, request.overwrite_weak_supervision
-    )
+    with instrument.request("export_ws_stats"), profiling.capture(
+        request.project_id, request.labeling_task_id, "export_ws_stats"
+    ), admission.admit_task(request.project_id, request.labeling_task_id):
+        status_code, message = integration.export_weak_supervision_stats(
+            request.project_id,
+            request.labeling_task_id,
+            request.overwrite_weak_supervision,
+        )
 
     if status_code != 200:
         raise HTTPException(status_code=status_code, detail=message)
     return responses.PlainTextResponse(status_code=status_code)
 
 
+@app.post("/batch")
+def run_batch(request: BatchRequest) -> responses.JSONResponse:
+    # fit_predict only queues the jobs, statistics are done once this returns
+    if request.operation not in batch.OPERATIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown operation {request.operation}",
+        )
+    if request.engine is not None and request.engine not in weighted_vote.ENGINES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown engine {request.engine}",
+        )
+    with instrument.request("batch"):
+        results = batch.run(
+            request.project_id,
+            request.user_id,
+            request.operation,
+            request.labeling_task_ids,
+            request.weak_supervision_task_ids,
+            request.overwrite_weak_supervision,
+            request.engine,
+        )
+    return responses.JSONResponse(results)
+
+
+@app.post("/profiling")
+def arm_profiling(request: ProfilingRequest) -> responses.JSONResponse:
+    # profiles the next requests of a project (or of any project)
+    return responses.JSONResponse(
+        profiling.arm(request.project_id, request.requests)
+    )
+
+
+@app.get("/profiling")
+def armed_profiling() -> responses.JSONResponse:
+    return responses.JSONResponse(profiling.get_armed())
+
+
+@app.get("/metrics")
+def prometheus_metrics() -> responses.PlainTextResponse:
+    return responses.PlainTextResponse(
+        instrument.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+@app.get("/coalescing")
+def coalescing_counters() -> responses.JSONResponse:
+    return responses.JSONResponse(coalesce.flights.get_counters())
+
+
+@app.get("/admission")
+def admission_counters() -> responses.JSONResponse:
+    return responses.JSONResponse(admission.scheduler.get_counters())
+
+
+@app.get("/notifications")
+def notification_counters() -> responses.JSONResponse:
+    return responses.JSONResponse(notify.dispatcher.get_counters())
+
+
+@app.post("/metadata/invalidate")
+def invalidate_metadata(request: InvalidateMetadataRequest) -> responses.JSONResponse:
+    invalidated = metadata.invalidate(
+        request.project_id, request.labeling_task_id, request.source_id, request.user_id
+    )
+    # a re-run source is already caught by its version, deleted tasks aren't
+    if request.labeling_task_id or not (request.source_id or request.user_id):
+        incremental.forget(request.project_id, request.labeling_task_id)
+        cache.invalidate(request.project_id, request.labeling_task_id)
+    return responses.JSONResponse({"invalidated": invalidated})
+
+
+@app.get("/metadata")
+def metadata_counters() -> responses.JSONResponse:
+    return responses.JSONResponse(metadata.get_counters())
+
+
 @app.get("/healthcheck")
 def healthcheck() -> responses.PlainTextResponse:
     text = ""
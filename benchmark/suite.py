@@ -0,0 +1,334 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import uuid
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from controller import (  # noqa: E402
+    compute,
+    loader,
+    metrics,
+    results,
+    span_vote,
+    stats,
+    weighted_vote,
+)
+
+# Runs the weak supervision pipeline phase by phase on a synthetic task and
+# writes the timings and peak memory per phase as JSON. The database is
+# replaced by a stand-in that yields the generated rows in fetch sized chunks,
+# the inserts of weak_supervision.store_data and the statistics writers aren't
+# run. With --baseline the run is compared with an earlier JSON output.
+
+PHASES = ["load", "frame", "model", "integrate", "stats", "serialize"]
+
+
+def generate_columns(args: argparse.Namespace) -> List[list]:
+    # columns of the rows the association queries return. Every record has a true
+    # label, heuristics hit it with hit_rate and vote for another label with
+    # conflict_rate, manual_rate of the records are labeled manually
+    rng = np.random.default_rng(args.seed)
+    record_ids = np.array([str(uuid.UUID(int=i)) for i in range(args.records)])
+    source_ids = np.array(
+        [str(uuid.UUID(int=(1 << 64) + i)) for i in range(args.heuristics)]
+    )
+    label_ids = np.array(
+        [str(uuid.UUID(int=(2 << 64) + i)) for i in range(args.labels)]
+    )
+    last_start = max(args.tokens - args.span_length, 0)
+    true_labels = rng.integers(0, args.labels, args.records)
+    true_starts = rng.integers(0, last_start + 1, args.records)
+    true_lengths = rng.integers(1, args.span_length + 1, args.records)
+
+    hits = rng.random((args.heuristics, args.records)) < args.hit_rate
+    hit_sources, hit_records = np.nonzero(hits)
+    hit_labels = true_labels[hit_records]
+    conflicts = rng.random(len(hit_records)) < args.conflict_rate
+    hit_labels[conflicts] = (
+        hit_labels[conflicts] + rng.integers(1, max(args.labels, 2), conflicts.sum())
+    ) % args.labels
+    manual_records = np.nonzero(rng.random(args.records) < args.manual_rate)[0]
+
+    record_codes = np.concatenate([hit_records, manual_records])
+    source_values = np.concatenate(
+        [source_ids[hit_sources], np.full(len(manual_records), None, dtype=object)]
+    )
+    source_types = np.array(["INFORMATION_SOURCE", "MANUAL"], dtype=object)[
+        np.repeat([0, 1], [len(hit_records), len(manual_records)])
+    ]
+    confidences = np.concatenate(
+        [rng.uniform(0.1, 1, len(hit_records)), np.ones(len(manual_records))]
+    )
+    label_codes = np.concatenate([hit_labels, true_labels[manual_records]])
+    columns = [
+        record_ids[record_codes],
+        source_values,
+        source_types,
+        confidences,
+        label_ids[label_codes],
+    ]
+    if not args.extraction:
+        return [column.tolist() for column in columns]
+
+    # conflicting hits also get a random position, all others the true span
+    starts = true_starts[record_codes]
+    lengths = true_lengths[record_codes]
+    moved = np.concatenate([conflicts, np.zeros(len(manual_records), dtype=bool)])
+    starts[moved] = rng.integers(0, last_start + 1, moved.sum())
+    span_positions = np.repeat(np.arange(len(record_codes)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(
+        np.cumsum(lengths) - lengths, lengths
+    )
+    return [column[span_positions].tolist() for column in columns] + [
+        (starts[span_positions] + offsets).tolist(),
+        (offsets == 0).tolist(),
+    ]
+
+
+def stand_in_fetch(columns: List[list]) -> Iterator[List[tuple]]:
+    # row tuples in fetch sized chunks, like the server-side cursor
+    for start in range(0, len(columns[0]), loader.FETCH_CHUNK_SIZE):
+        end = start + loader.FETCH_CHUNK_SIZE
+        yield list(zip(*[column[start:end] for column in columns]))
+
+
+def run_pipeline(
+    args: argparse.Namespace,
+    columns: List[list],
+    measure: Callable[[str, Callable, Any], Any],
+) -> Dict[str, Any]:
+    model_type = compute.EXTRACTION if args.extraction else compute.CLASSIFICATION
+    frame_columns = (
+        loader.EXTRACTION_COLUMNS if args.extraction else loader.CLASSIFICATION_COLUMNS
+    )
+    chunks = measure("load", lambda: list(stand_in_fetch(columns)))
+    df = measure("frame", loader.build_frame, iter(chunks), frame_columns)
+
+    if args.engine == weighted_vote.NUMPY:
+        model = None
+        integration_results = measure(
+            "integrate", __integrate_numpy, df, args.extraction
+        )
+        stats_result = measure("stats", __statistics_numpy, df, model_type)
+    else:
+        model = measure("model", compute.build_model, df, model_type)
+        integration_results = measure(
+            "integrate", compute.apply, model, compute.WEAKLY_SUPERVISE
+        )
+        stats_result = measure("stats", __statistics_weak_nlp, df, model, model_type)
+    results_by_record = measure(
+        "serialize", __serialize, integration_results, args.extraction
+    )
+    return {
+        "rows": len(columns[0]),
+        "frame_rows": len(df),
+        "results": sum(len(predictions) for predictions in results_by_record.values()),
+        "statistics": sum(
+            len(labels) for rows in stats_result for labels in rows.values()
+        ),
+        "has_model": model is not None,
+    }
+
+
+def __integrate_numpy(df: pd.DataFrame, extraction: bool) -> results.IntegrationResults:
+    if extraction:
+        return span_vote.weakly_supervise(df)
+    return weighted_vote.weakly_supervise(df)
+
+
+def __statistics_weak_nlp(
+    df: pd.DataFrame, model: Any, model_type: str
+) -> Tuple[Dict[str, Dict[str, Dict[str, int]]], ...]:
+    return __statistics(
+        df,
+        compute.apply(model, compute.QUALITY_METRICS),
+        compute.apply(model, compute.QUANTITY_METRICS),
+        model_type,
+    )
+
+
+def __statistics_numpy(
+    df: pd.DataFrame, model_type: str
+) -> Tuple[Dict[str, Dict[str, Dict[str, int]]], ...]:
+    return __statistics(
+        df,
+        metrics.run(df, model_type, compute.QUALITY_METRICS),
+        metrics.run(df, model_type, compute.QUANTITY_METRICS),
+        model_type,
+    )
+
+
+def __statistics(
+    df: pd.DataFrame,
+    quality_df: pd.DataFrame,
+    quantity_df: pd.DataFrame,
+    model_type: str,
+) -> Tuple[Dict[str, Dict[str, Dict[str, int]]], ...]:
+    # the reshaping into statistics rows, without the database writes
+    if model_type == compute.CLASSIFICATION:
+        return (
+            stats.classification_quality(df, quality_df),
+            stats.classification_quantity(df, quantity_df),
+        )
+    return (
+        stats.extraction_quality(df, quality_df),
+        stats.extraction_quantity(df, quantity_df),
+    )
+
+
+def __serialize(
+    integration_results: Union[results.IntegrationResults, pd.Series, Dict],
+    extraction: bool,
+) -> Dict[str, List[Dict[str, Any]]]:
+    # the per-record dicts integration hands to weak_supervision.store_data,
+    # built the way the engine's production path builds them
+    if isinstance(integration_results, results.IntegrationResults):
+        return integration_results.to_dict()
+    if extraction:
+        return results.extraction_to_dict(integration_results)
+    return results.classification_to_dict(integration_results)
+
+
+def time_phases(
+    args: argparse.Namespace, columns: List[list]
+) -> Tuple[Dict[str, List[float]], Dict[str, Any]]:
+    durations = {phase: [] for phase in PHASES}
+
+    def measure(phase: str, fn: Callable, *fn_args: Any) -> Any:
+        start = time.perf_counter()
+        value = fn(*fn_args)
+        durations[phase].append(time.perf_counter() - start)
+        return value
+
+    for _ in range(args.repeat):
+        summary = run_pipeline(args, columns, measure)
+    return durations, summary
+
+
+def memory_phases(args: argparse.Namespace, columns: List[list]) -> Dict[str, int]:
+    # separate run, tracemalloc slows everything down. numpy and pandas
+    # buffers are traced as well
+    peaks = {}
+
+    def measure(phase: str, fn: Callable, *fn_args: Any) -> Any:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        value = fn(*fn_args)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks[phase] = peak - base
+        return value
+
+    tracemalloc.start()
+    try:
+        run_pipeline(args, columns, measure)
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    # to stderr, stdout stays JSON
+    print(
+        f"{'phase':<10} {'baseline':>10} {'current':>10} {'ratio':>7}",
+        file=sys.stderr,
+        flush=True,
+    )
+    for phase, current in report["phases"].items():
+        previous = baseline.get("phases", {}).get(phase)
+        if previous is None or current["seconds"] is None or not previous["seconds"]:
+            continue
+        print(
+            f"{phase:<10} {previous['seconds']:10.4f} {current['seconds']:10.4f} "
+            f"{current['seconds'] / previous['seconds']:7.2f}",
+            file=sys.stderr,
+            flush=True,
+        )
+
+
+def __commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=100_000)
+    parser.add_argument("--heuristics", type=int, default=10)
+    parser.add_argument("--labels", type=int, default=5)
+    parser.add_argument("--hit-rate", type=float, default=0.3)
+    parser.add_argument("--conflict-rate", type=float, default=0.2)
+    parser.add_argument("--manual-rate", type=float, default=0.05)
+    parser.add_argument("--extraction", action="store_true")
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--span-length", type=int, default=3)
+    parser.add_argument(
+        "--engine", choices=weighted_vote.ENGINES, default=weighted_vote.WEAK_NLP
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true")
+    parser.add_argument("--output", help="JSON file, stdout if not given")
+    parser.add_argument("--baseline", help="earlier JSON output to compare with")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    columns = generate_columns(args)
+    generate_seconds = time.perf_counter() - start
+
+    durations, summary = time_phases(args, columns)
+    peaks = {} if args.no_memory else memory_phases(args, columns)
+    report = {
+        "commit": __commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "parameters": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("output", "baseline")
+        },
+        "generate_seconds": generate_seconds,
+        "summary": summary,
+        "phases": {
+            phase: {
+                "seconds": statistics.median(durations[phase])
+                if durations[phase]
+                else None,
+                "runs": durations[phase],
+                "peak_bytes": peaks.get(phase),
+            }
+            for phase in PHASES
+        },
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output, flush=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
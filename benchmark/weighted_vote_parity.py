@@ -0,0 +1,96 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from controller import compute, metrics, weighted_vote  # noqa: E402
+from tests.tasks import (  # noqa: E402
+    compare,
+    overwrite_for,
+    random_extraction_task,
+    random_task,
+    run_numpy,
+    run_weak_nlp,
+)
+
+# Compares the numpy engines with weak_nlp's CNLM (or ENLM with --extraction)
+# on randomized tasks, with and without a quality metrics overwrite. With
+# --metrics the quality and quantity statistics are compared instead.
+# Exits with 1 if any task differs.
+
+
+def compare_metrics(df: pd.DataFrame, extraction: bool) -> int:
+    # number of (source, label) statistics that differ
+    model_type = compute.EXTRACTION if extraction else compute.CLASSIFICATION
+    mismatches = 0
+    for operation in (compute.QUALITY_METRICS, compute.QUANTITY_METRICS):
+        expected_df = compute.run(df, model_type, operation)
+        actual_df = metrics.run(df, model_type, operation)
+        keys = [
+            key
+            for key in metrics.QUALITY_KEYS + metrics.QUANTITY_KEYS
+            if key in expected_df.columns
+        ]
+        columns = {key: key for key in keys}
+        expected = metrics.to_statistics(expected_df, columns)
+        actual = metrics.to_statistics(actual_df, columns)
+        for source_id in set(expected) | set(actual):
+            left, right = expected.get(source_id, {}), actual.get(source_id, {})
+            mismatches += sum(
+                left.get(label_id) != right.get(label_id)
+                for label_id in set(left) | set(right)
+            )
+    return mismatches
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=50)
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tolerance", type=float, default=1e-6)
+    parser.add_argument("--extraction", action="store_true")
+    parser.add_argument("--metrics", action="store_true")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    failed = 0
+    durations = {weighted_vote.WEAK_NLP: 0.0, weighted_vote.NUMPY: 0.0}
+    for task in range(args.tasks):
+        if args.extraction:
+            df = random_extraction_task(rng, args.records)
+        else:
+            df = random_task(rng, args.records)
+        if args.metrics:
+            mismatches = compare_metrics(df, args.extraction)
+            if mismatches:
+                failed += 1
+                print(f"task {task}: {mismatches} statistics differ", flush=True)
+            continue
+        for overwrite in (None, overwrite_for(rng, df)):
+            start = time.perf_counter()
+            expected = run_weak_nlp(df, overwrite, args.extraction)
+            durations[weighted_vote.WEAK_NLP] += time.perf_counter() - start
+            start = time.perf_counter()
+            actual = run_numpy(df, overwrite, args.extraction)
+            durations[weighted_vote.NUMPY] += time.perf_counter() - start
+
+            mismatches = compare(expected, actual, args.tolerance)
+            if mismatches:
+                failed += 1
+                mode = "overwrite" if overwrite else "quality metrics"
+                print(f"task {task} ({mode}): {mismatches} records differ", flush=True)
+
+    for engine, duration in durations.items():
+        print(f"{engine:<10} {duration:8.3f}s", flush=True)
+    runs = args.tasks if args.metrics else 2 * args.tasks
+    print(f"{failed} of {runs} runs differ", flush=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+from . import instrument, loader, metadata
+from submodules.model import enums
+
+# Memory budget for the DataFrames and weak_nlp models of concurrently running
+# loads. 0 derives it from the container memory limit, below 0 disables it
+MEMORY_BUDGET_BYTES = int(os.getenv("WS_MEMORY_BUDGET_BYTES", "0"))
+MEMORY_BUDGET_FRACTION = float(os.getenv("WS_MEMORY_BUDGET_FRACTION", "0.6"))
+# rough footprint of one loaded row including the models built from it
+BYTES_PER_ROW = int(os.getenv("WS_ADMISSION_BYTES_PER_ROW", "600"))
+BYTES_PER_TOKEN_ROW = int(os.getenv("WS_ADMISSION_BYTES_PER_TOKEN_ROW", "400"))
+BASE_BYTES = int(os.getenv("WS_ADMISSION_BASE_BYTES", str(16 * 1024**2)))
+# a waiting request is passed over by smaller ones at most this often, then
+# nothing else is admitted until it fits
+MAX_BYPASSES = int(os.getenv("WS_ADMISSION_MAX_BYPASSES", "8"))
+ADMISSION_TIMEOUT_SECONDS = float(os.getenv("WS_ADMISSION_TIMEOUT_SECONDS", "600"))
+
+__CGROUP_LIMIT_FILES = [
+    "/sys/fs/cgroup/memory.max",
+    "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+]
+# cgroup v1 reports "no limit" as a huge number
+__UNLIMITED_BYTES = 1 << 60
+
+wait_seconds = instrument.Histogram(
+    "ws_admission_wait_seconds",
+    "Time between a request being queued and admitted",
+    instrument.DURATION_BUCKETS,
+)
+
+
+class AdmissionTimeout(Exception):
+    pass
+
+
+class Ticket:
+    def __init__(
+        self, project_id: str, estimate: int, start: Callable[["Ticket"], None]
+    ):
+        self.project_id = project_id
+        self.estimate = estimate
+        self.start = start
+        self.queued_at = time.monotonic()
+        self.bypassed = 0
+        self.cancelled = False
+
+
+class Scheduler:
+    # Admits work against a memory budget. Waiting work is queued per project
+    # and the projects take turns, the first waiting ticket that fits is
+    # admitted so small tasks don't wait behind a big one of another project.
+    # Work that exceeds the whole budget runs once nothing else is running
+    def __init__(self, budget: int, max_bypasses: int = MAX_BYPASSES):
+        self.budget = budget
+        self.__max_bypasses = max_bypasses
+        self.__lock = threading.Lock()
+        self.__queues: "OrderedDict[str, Deque[Ticket]]" = OrderedDict()
+        self.__running: Dict[int, Ticket] = {}
+        self.__in_use = 0
+        self.__counters: Dict[str, float] = {
+            "admitted": 0,
+            "queued": 0,
+            "timed_out": 0,
+            "wait_seconds_sum": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget > 0
+
+    def enqueue(
+        self, project_id: str, estimate: int, start: Callable[[Ticket], None]
+    ) -> Ticket:
+        # start is called with the ticket once it is admitted, possibly right
+        # away in this thread. The work has to call release when done
+        ticket = Ticket(project_id, estimate, start)
+        with self.__lock:
+            self.__queues.setdefault(project_id, deque()).append(ticket)
+            admitted = self.__dispatch()
+            if ticket not in admitted:
+                self.__counters["queued"] += 1
+        self.__start(admitted)
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        with self.__lock:
+            if self.__running.pop(id(ticket), None) is not None:
+                self.__in_use -= ticket.estimate
+            admitted = self.__dispatch()
+        self.__start(admitted)
+
+    def cancel(self, ticket: Ticket) -> bool:
+        # False if the ticket was admitted in the meantime
+        with self.__lock:
+            waiting = self.__queues.get(ticket.project_id)
+            if waiting is None or ticket not in waiting:
+                return False
+            waiting.remove(ticket)
+            if not waiting:
+                del self.__queues[ticket.project_id]
+            ticket.cancelled = True
+            admitted = self.__dispatch()
+        self.__start(admitted)
+        return True
+
+    @contextmanager
+    def admit(
+        self,
+        project_id: str,
+        estimate: int,
+        timeout: Optional[float] = ADMISSION_TIMEOUT_SECONDS,
+    ) -> Iterator[None]:
+        # blocking variant for work done in the calling thread
+        admitted = threading.Event()
+        ticket = self.enqueue(project_id, estimate, lambda _: admitted.set())
+        if not admitted.wait(timeout) and self.cancel(ticket):
+            with self.__lock:
+                self.__counters["timed_out"] += 1
+            raise AdmissionTimeout(
+                f"No memory for project {project_id} within {timeout}s"
+            )
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    def get_counters(self) -> Dict[str, Any]:
+        with self.__lock:
+            counters: Dict[str, Any] = {
+                key: value if key.startswith("wait_") else int(value)
+                for key, value in self.__counters.items()
+            }
+            counters.update(
+                budget_bytes=self.budget,
+                in_use_bytes=self.__in_use,
+                running=len(self.__running),
+                waiting={
+                    project_id: len(waiting)
+                    for project_id, waiting in self.__queues.items()
+                },
+                oldest_wait_seconds=max(
+                    (
+                        time.monotonic() - waiting[0].queued_at
+                        for waiting in self.__queues.values()
+                    ),
+                    default=0.0,
+                ),
+            )
+            return counters
+
+    def __dispatch(self) -> List[Ticket]:
+        # admits what fits, the caller starts the returned tickets outside of
+        # the lock
+        admitted = []
+        while self.__queues:
+            ticket = self.__next()
+            if ticket is None:
+                break
+            waiting = self.__queues.pop(ticket.project_id)
+            waiting.popleft()
+            if waiting:
+                # the project goes to the back of the turn order
+                self.__queues[ticket.project_id] = waiting
+            self.__running[id(ticket)] = ticket
+            self.__in_use += ticket.estimate
+            admitted.append(ticket)
+        return admitted
+
+    def __next(self) -> Optional[Ticket]:
+        heads = [waiting[0] for waiting in self.__queues.values()]
+        oldest = min(heads, key=lambda ticket: ticket.queued_at)
+        if oldest.bypassed >= self.__max_bypasses:
+            candidates = [oldest]
+        else:
+            candidates = heads
+        for ticket in candidates:
+            if self.__fits(ticket):
+                for older in heads:
+                    if older.queued_at < ticket.queued_at:
+                        older.bypassed += 1
+                return ticket
+        return None
+
+    def __fits(self, ticket: Ticket) -> bool:
+        if not self.enabled or not self.__running:
+            return True
+        return self.__in_use + ticket.estimate <= self.budget
+
+    def __start(self, admitted: List[Ticket]) -> None:
+        now = time.monotonic()
+        for ticket in admitted:
+            waited = now - ticket.queued_at
+            with self.__lock:
+                self.__counters["admitted"] += 1
+                self.__counters["wait_seconds_sum"] += waited
+                self.__counters["wait_seconds_max"] = max(
+                    self.__counters["wait_seconds_max"], waited
+                )
+            if instrument.INSTRUMENTATION_ENABLED:
+                wait_seconds.observe({}, waited)
+            ticket.start(ticket)
+
+
+class SchedulerGauges:
+    # current state of the scheduler, read when the metrics are rendered
+    GAUGES = [
+        ("budget_bytes", "Memory budget of the scheduler"),
+        ("in_use_bytes", "Estimated memory of the admitted work"),
+        ("running", "Admitted requests and jobs"),
+        ("waiting", "Requests and jobs waiting for memory"),
+        ("oldest_wait_seconds", "Wait time of the oldest waiting request"),
+    ]
+
+    def __init__(self, scheduler: Scheduler):
+        self.scheduler = scheduler
+
+    def render(self) -> List[str]:
+        counters = self.scheduler.get_counters()
+        counters["waiting"] = sum(counters["waiting"].values())
+        lines = []
+        for name, help_text in self.GAUGES:
+            lines.append(f"# HELP ws_admission_{name} {help_text}")
+            lines.append(f"# TYPE ws_admission_{name} gauge")
+            lines.append(f"ws_admission_{name} {counters[name]}")
+        return lines
+
+
+def estimate_bytes(rows: int, task_type: str) -> int:
+    if task_type == enums.LabelingTaskType.INFORMATION_EXTRACTION.value:
+        return BASE_BYTES + rows * BYTES_PER_TOKEN_ROW
+    return BASE_BYTES + rows * BYTES_PER_ROW
+
+
+def estimate_task(project_id: str, labeling_task_id: str) -> int:
+    # 0 if admission is disabled, the count isn't worth the query then
+    if not scheduler.enabled:
+        return 0
+    task_info = metadata.get_task(project_id, labeling_task_id)
+    # the cached load reads all sources of the task, also for fit_predict
+    rows = loader.count_rows(
+        project_id, labeling_task_id, task_info.task_type, task_info.source_ids
+    )
+    return estimate_bytes(rows, task_info.task_type)
+
+
+@contextmanager
+def admit_task(project_id: str, labeling_task_id: str) -> Iterator[None]:
+    with scheduler.admit(project_id, estimate_task(project_id, labeling_task_id)):
+        yield
+
+
+def run_for_task(
+    project_id: str, labeling_task_id: str, fn: Callable, *args: Any
+) -> Any:
+    with admit_task(project_id, labeling_task_id):
+        return fn(*args)
+
+
+def get_budget() -> int:
+    if MEMORY_BUDGET_BYTES != 0:
+        return max(MEMORY_BUDGET_BYTES, 0)
+    for path in __CGROUP_LIMIT_FILES:
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < __UNLIMITED_BYTES:
+            return int(int(value) * MEMORY_BUDGET_FRACTION)
+    # no limit known, nothing to protect
+    return 0
+
+
+scheduler = Scheduler(get_budget())
+instrument.METRICS.extend([wait_seconds, SchedulerGauges(scheduler)])
@@ -0,0 +1,226 @@
+import contextvars
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Union
+import pandas as pd
+
+from . import (
+    admission,
+    cache,
+    coalesce,
+    instrument,
+    integration,
+    jobs,
+    loader,
+    metadata,
+    profiling,
+    stats,
+)
+from submodules.model import enums
+from submodules.model.business_objects import general, weak_supervision
+
+BATCH_WORKERS = int(os.getenv("WS_BATCH_WORKERS", "2"))
+
+FIT_PREDICT = "fit_predict"
+STATISTICS = "labeling_task_statistics"
+OPERATIONS = [FIT_PREDICT, STATISTICS]
+
+__executor = ThreadPoolExecutor(
+    max_workers=BATCH_WORKERS, thread_name_prefix="ws-batch"
+)
+
+
+def run(
+    project_id: str,
+    user_id: str,
+    operation: str,
+    labeling_task_ids: Optional[List[str]] = None,
+    weak_supervision_task_ids: Optional[Dict[str, str]] = None,
+    overwrite_weak_supervision: Optional[Union[float, Dict[str, float]]] = None,
+    engine: Optional[str] = None,
+) -> Dict[str, Dict[str, Any]]:
+    # result per labeling task. Without labeling_task_ids statistics run for
+    # all tasks of the project and fit_predict for all tasks with a weak
+    # supervision task id (the payload created by the caller)
+    weak_supervision_task_ids = weak_supervision_task_ids or {}
+    # one query for the whole project, the per task lookups of the runs are
+    # answered from the metadata cache
+    project_task_ids = {task_info.id for task_info in metadata.get_tasks(project_id)}
+    if labeling_task_ids is None:
+        if operation == FIT_PREDICT:
+            labeling_task_ids = list(weak_supervision_task_ids)
+        else:
+            labeling_task_ids = sorted(project_task_ids)
+    labeling_task_ids = list(dict.fromkeys(labeling_task_ids))
+
+    results = {}
+    runnable = []
+    for labeling_task_id in labeling_task_ids:
+        if labeling_task_id not in project_task_ids:
+            results[labeling_task_id] = {
+                "state": jobs.ERROR,
+                "error": "Unknown labeling task",
+            }
+            if labeling_task_id in weak_supervision_task_ids:
+                __fail(project_id, weak_supervision_task_ids[labeling_task_id])
+        elif (
+            operation == FIT_PREDICT
+            and labeling_task_id not in weak_supervision_task_ids
+        ):
+            results[labeling_task_id] = {
+                "state": jobs.ERROR,
+                "error": "No weak supervision task id",
+            }
+        else:
+            runnable.append(labeling_task_id)
+
+    if operation == FIT_PREDICT:
+        results.update(
+            submit_fit_predict(
+                project_id,
+                user_id,
+                {
+                    labeling_task_id: weak_supervision_task_ids[labeling_task_id]
+                    for labeling_task_id in runnable
+                },
+                overwrite_weak_supervision,
+                engine,
+            )
+        )
+    else:
+        results.update(run_statistics(project_id, user_id, runnable))
+    # in the requested order
+    return {
+        labeling_task_id: results[labeling_task_id]
+        for labeling_task_id in labeling_task_ids
+    }
+
+
+def run_statistics(
+    project_id: str, user_id: str, labeling_task_ids: List[str]
+) -> Dict[str, Dict[str, Any]]:
+    # quality statistics of every task on the batch pool, a failing task
+    # doesn't stop the others. The manual labels of all tasks are read upfront
+    # with one query per task type, the cache has its own copy of them
+    manual_dfs = {}
+    if labeling_task_ids and not cache.CACHE_ENABLED:
+        try:
+            manual_dfs = loader.load_manual_labels(
+                project_id,
+                {
+                    labeling_task_id: metadata.get_task(
+                        project_id, labeling_task_id
+                    ).task_type
+                    for labeling_task_id in labeling_task_ids
+                },
+            )
+        except Exception:
+            # every task loads its own manual labels then
+            print(traceback.format_exc(), flush=True)
+            general.rollback()
+    futures = {
+        labeling_task_id: __executor.submit(
+            contextvars.copy_context().run,
+            __statistics,
+            project_id,
+            labeling_task_id,
+            user_id,
+            manual_dfs.get(labeling_task_id),
+        )
+        for labeling_task_id in labeling_task_ids
+    }
+    results = {}
+    for labeling_task_id, future in futures.items():
+        try:
+            future.result()
+            results[labeling_task_id] = {"state": jobs.DONE}
+        except Exception as e:
+            results[labeling_task_id] = {"state": jobs.ERROR, "error": str(e)}
+    return results
+
+
+def submit_fit_predict(
+    project_id: str,
+    user_id: str,
+    weak_supervision_task_ids: Dict[str, str],
+    overwrite_weak_supervision: Optional[Union[float, Dict[str, float]]] = None,
+    engine: Optional[str] = None,
+) -> Dict[str, Dict[str, Any]]:
+    # {labeling_task_id: weak_supervision_task_id}, every task becomes a job of
+    # the job pool. Its state is followed with GET /fit_predict/{id}. The jobs
+    # load their data when they run, nothing is read upfront for them
+    results = {}
+    for (
+        labeling_task_id,
+        weak_supervision_task_id,
+    ) in weak_supervision_task_ids.items():
+        result = {"weak_supervision_task_id": weak_supervision_task_id}
+        try:
+            accepted = integration.submit_fit_predict(
+                project_id,
+                labeling_task_id,
+                user_id,
+                weak_supervision_task_id,
+                overwrite_weak_supervision,
+                engine,
+            )
+            if accepted:
+                result["state"] = jobs.QUEUED
+            else:
+                result.update(
+                    state=jobs.ERROR, error="Too many weak supervision jobs queued"
+                )
+        except Exception as e:
+            print(traceback.format_exc(), flush=True)
+            general.rollback()
+            __fail(project_id, weak_supervision_task_id)
+            result.update(state=jobs.ERROR, error=str(e))
+        results[labeling_task_id] = result
+    return results
+
+
+def shutdown() -> None:
+    __executor.shutdown(wait=True)
+
+
+def __fail(project_id: str, weak_supervision_task_id: str) -> None:
+    weak_supervision.update_state(
+        project_id,
+        weak_supervision_task_id,
+        enums.PayloadState.FAILED.value,
+        with_commit=True,
+    )
+    jobs.register(weak_supervision_task_id)
+    jobs.set_state(weak_supervision_task_id, jobs.ERROR)
+
+
+def __statistics(
+    project_id: str,
+    labeling_task_id: str,
+    user_id: str,
+    manual_df: Optional[pd.DataFrame] = None,
+) -> None:
+    session_token = general.get_ctx_token()
+    try:
+        with instrument.request(STATISTICS), profiling.capture(
+            project_id, labeling_task_id, STATISTICS
+        ):
+            coalesce.flights.do(
+                (project_id, labeling_task_id, STATISTICS),
+                admission.run_for_task,
+                project_id,
+                labeling_task_id,
+                stats.calculate_quality_statistics_for_labeling_task,
+                project_id,
+                labeling_task_id,
+                user_id,
+                None,
+                manual_df,
+            )
+    except Exception:
+        print(traceback.format_exc(), flush=True)
+        general.rollback()
+        raise
+    finally:
+        general.remove_and_refresh_session(session_token)
@@ -0,0 +1,264 @@
+import glob
+import json
+import os
+import shutil
+import threading
+import traceback
+import uuid
+from typing import Any, Dict, List, Optional, Sequence
+import numpy as np
+import pandas as pd
+
+from . import loader, util
+
+# opt-in, the directory belongs to this service alone and every entry below it
+# may be evicted or removed on invalidation
+CACHE_ENABLED = os.getenv("WS_CACHE_ENABLED", "false").lower() == "true"
+CACHE_DIR = os.getenv("WS_CACHE_DIR", "/tmp/ws-cache")
+CACHE_MAX_BYTES = int(os.getenv("WS_CACHE_MAX_BYTES", str(512 * 1024**2)))
+FORMAT_VERSION = 1
+
+__lock = threading.Lock()
+
+
+def load_associations(
+    project_id: str,
+    labeling_task_id: str,
+    task_type: str,
+    source_ids: Sequence[str],
+    selected_source_ids: Sequence[str],
+    exclusion_ids: Optional[Sequence[str]] = None,
+) -> pd.DataFrame:
+    if not CACHE_ENABLED:
+        return loader.load_associations(
+            project_id,
+            labeling_task_id,
+            task_type,
+            selected_source_ids,
+            exclusion_ids=exclusion_ids,
+        )
+
+    versions = {
+        source_id or util.MANUAL_SOURCE_ID: version
+        for source_id, version in loader.get_source_versions(
+            project_id, labeling_task_id, source_ids
+        ).items()
+    }
+    meta, df_cached = __read_cached(project_id, labeling_task_id, task_type)
+    cached_versions = meta["versions"] if meta is not None else {}
+    stale_keys = {
+        key for key, version in versions.items() if cached_versions.get(key) != version
+    }
+    dropped_keys = stale_keys | (set(cached_versions) - set(versions))
+
+    if df_cached is not None and not dropped_keys:
+        df = df_cached
+    else:
+        frames = []
+        if df_cached is not None:
+            keep = ~__source_keys(df_cached).isin(dropped_keys)
+            frames.append(df_cached.loc[keep])
+        reload_source_ids = [
+            key for key in stale_keys if key != util.MANUAL_SOURCE_ID
+        ]
+        if reload_source_ids or util.MANUAL_SOURCE_ID in stale_keys or not frames:
+            frames.append(
+                loader.load_associations(
+                    project_id,
+                    labeling_task_id,
+                    task_type,
+                    reload_source_ids,
+                    include_manual=util.MANUAL_SOURCE_ID in stale_keys,
+                )
+            )
+        df = loader.concat_frames(frames)
+        __write(project_id, labeling_task_id, task_type, versions, df)
+
+    if len(selected_source_ids) != len(source_ids):
+        df = df.loc[
+            df["source_id"].isna() | df["source_id"].isin(selected_source_ids)
+        ]
+    # the cached frame holds all records of the task
+    return loader.exclude_records(df, exclusion_ids)
+
+
+def invalidate(
+    project_id: Optional[str] = None, labeling_task_id: Optional[str] = None
+) -> int:
+    # removes the entries of the given task or project, all without ids
+    if not CACHE_ENABLED:
+        return 0
+    meta_paths = glob.glob(
+        os.path.join(
+            __cache_dir(project_id or "*"), f"{labeling_task_id or '*'}.json"
+        )
+    )
+    with __lock:
+        for meta_path in meta_paths:
+            try:
+                with open(meta_path, "r") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = {}
+            __remove_files(meta_path, meta)
+        if labeling_task_id is None:
+            # leftovers of interrupted writes
+            shutil.rmtree(
+                __cache_dir(project_id) if project_id else CACHE_DIR,
+                ignore_errors=True,
+            )
+    return len(meta_paths)
+
+
+def get_source_versions(
+    project_id: str, labeling_task_id: str
+) -> Optional[Dict[str, str]]:
+    # versions of the currently cached frame, None if nothing is cached
+    if not CACHE_ENABLED:
+        return None
+    meta = __read_meta(project_id, labeling_task_id)
+    if meta is None:
+        return None
+    return meta["versions"]
+
+
+def __read_cached(project_id: str, labeling_task_id: str, task_type: str):
+    meta = __read_meta(project_id, labeling_task_id)
+    if meta is None or meta["task_type"] != task_type:
+        return None, None
+    try:
+        return meta, __read_frame(project_id, meta)
+    except (OSError, ValueError):
+        # entry replaced or evicted by a concurrent request
+        return None, None
+
+
+def __source_keys(df: pd.DataFrame) -> pd.Series:
+    return df["source_id"].astype(object).fillna(util.MANUAL_SOURCE_ID)
+
+
+def __cache_dir(project_id: str) -> str:
+    return os.path.join(CACHE_DIR, project_id)
+
+
+def __meta_path(project_id: str, labeling_task_id: str) -> str:
+    return os.path.join(__cache_dir(project_id), f"{labeling_task_id}.json")
+
+
+def __read_meta(project_id: str, labeling_task_id: str) -> Optional[Dict[str, Any]]:
+    path = __meta_path(project_id, labeling_task_id)
+    try:
+        with open(path, "r") as f:
+            meta = json.load(f)
+        # access time for the lru eviction
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    if meta.get("format_version") != FORMAT_VERSION:
+        return None
+    return meta
+
+
+def __read_frame(project_id: str, meta: Dict[str, Any]) -> pd.DataFrame:
+    entry_dir = os.path.join(__cache_dir(project_id), meta["entry"])
+    data = {}
+    for column in meta["columns"]:
+        values = np.load(os.path.join(entry_dir, f"{column}.npy"), mmap_mode="r")
+        if column in loader.ENCODED_COLUMNS:
+            categories = np.load(os.path.join(entry_dir, f"{column}.categories.npy"))
+            data[column] = pd.Categorical.from_codes(
+                values, categories=pd.Index(categories, dtype=object)
+            )
+        else:
+            data[column] = values
+    return pd.DataFrame(data, columns=meta["columns"])
+
+
+def __write(
+    project_id: str,
+    labeling_task_id: str,
+    task_type: str,
+    versions: Dict[str, str],
+    df: pd.DataFrame,
+) -> None:
+    cache_dir = __cache_dir(project_id)
+    entry = f"{labeling_task_id}-{uuid.uuid4().hex}"
+    entry_dir = os.path.join(cache_dir, entry)
+    try:
+        os.makedirs(entry_dir)
+        size = 0
+        for column in df.columns:
+            files = {}
+            if column in loader.ENCODED_COLUMNS:
+                values = df[column].cat.remove_unused_categories()
+                files[column] = values.cat.codes.to_numpy(dtype=np.int32)
+                files[f"{column}.categories"] = values.cat.categories.to_numpy(
+                    dtype=str
+                )
+            else:
+                files[column] = df[column].to_numpy()
+            for name, array in files.items():
+                np.save(os.path.join(entry_dir, f"{name}.npy"), array)
+                size += array.nbytes
+
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "entry": entry,
+            "task_type": task_type,
+            "columns": list(df.columns),
+            "versions": versions,
+            "bytes": size,
+        }
+        with __lock:
+            previous = __read_meta(project_id, labeling_task_id)
+            meta_path = __meta_path(project_id, labeling_task_id)
+            tmp_path = f"{meta_path}.{entry}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, meta_path)
+            if previous is not None and previous["entry"] != entry:
+                shutil.rmtree(
+                    os.path.join(cache_dir, previous["entry"]), ignore_errors=True
+                )
+            __evict()
+    except Exception:
+        # the cache is an optimization only, a failed write must not fail the request
+        print(traceback.format_exc(), flush=True)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+
+
+def __remove_files(meta_path: str, meta: Dict[str, Any]) -> None:
+    try:
+        os.remove(meta_path)
+    except OSError:
+        pass
+    if meta.get("entry"):
+        shutil.rmtree(
+            os.path.join(os.path.dirname(meta_path), meta["entry"]),
+            ignore_errors=True,
+        )
+
+
+def __evict() -> None:
+    entries: List[Dict[str, Any]] = []
+    for meta_path in glob.glob(os.path.join(CACHE_DIR, "*", "*.json")):
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            entries.append(
+                {
+                    "path": meta_path,
+                    "meta": meta,
+                    "accessed": os.path.getmtime(meta_path),
+                }
+            )
+        except (OSError, ValueError):
+            continue
+
+    total = sum(entry["meta"].get("bytes", 0) for entry in entries)
+    for entry in sorted(entries, key=lambda entry: entry["accessed"]):
+        if total <= CACHE_MAX_BYTES:
+            break
+        __remove_files(entry["path"], entry["meta"])
+        total -= entry["meta"].get("bytes", 0)
+
@@ -0,0 +1,107 @@
+import threading
+from collections import defaultdict
+from concurrent.futures import Future, wait
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class SingleFlight:
+    # Coalesces identical computations. Keys are (project_id, task_id, operation).
+    # While a computation for a key runs, new requests don't start another one:
+    # the first becomes a single "rerun after current", all later ones attach to it.
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__running: Dict[Hashable, Future] = {}
+        self.__pending: Dict[Hashable, Future] = {}
+        self.__busy: Dict[Hashable, Optional[Any]] = {}
+        self.__counters: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {"started": 0, "queued": 0, "coalesced": 0}
+        )
+
+    def do(self, key: Tuple[str, str, str], fn: Callable, *args: Any) -> Any:
+        # blocking variant, returns the result of the run the caller attached to
+        with self.__lock:
+            current = self.__running.get(key)
+            wait_for = None
+            if current is None:
+                future = Future()
+                self.__running[key] = future
+                self.__count(key, "started")
+            elif key not in self.__pending:
+                future = Future()
+                self.__pending[key] = future
+                wait_for = current
+                self.__count(key, "queued")
+            else:
+                self.__count(key, "coalesced")
+                attached = self.__pending[key]
+                future = None
+
+        if future is None:
+            return attached.result()
+        if wait_for is not None:
+            wait([wait_for])
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            self.__release(key, future)
+            future.set_exception(e)
+            raise
+        self.__release(key, future)
+        future.set_result(result)
+        return result
+
+    def enqueue(
+        self,
+        key: Tuple[str, str, str],
+        item: Any,
+        merge: Optional[Callable[[Any, Any], Any]] = None,
+    ) -> bool:
+        # non-blocking variant for background jobs. True if the caller has to
+        # start item now, False if it was queued as rerun of the running job
+        # (replacing an earlier queued item, optionally merged with it)
+        with self.__lock:
+            if key not in self.__busy:
+                self.__busy[key] = None
+                self.__count(key, "started")
+                return True
+            queued = self.__busy[key]
+            if queued is None:
+                self.__count(key, "queued")
+            else:
+                self.__count(key, "coalesced")
+                if merge is not None:
+                    item = merge(queued, item)
+            self.__busy[key] = item
+            return False
+
+    def complete(self, key: Tuple[str, str, str]) -> Optional[Any]:
+        # called by the job when it is done, returns the queued rerun (the key
+        # stays busy) or None if the key is free again
+        with self.__lock:
+            queued = self.__busy.get(key)
+            if queued is None:
+                self.__busy.pop(key, None)
+                return None
+            self.__busy[key] = None
+            return queued
+
+    def get_counters(self) -> Dict[str, Dict[str, int]]:
+        with self.__lock:
+            return {
+                operation: dict(counters)
+                for operation, counters in self.__counters.items()
+            }
+
+    def __release(self, key: Tuple[str, str, str], future: Future) -> None:
+        # hands the key over to the queued rerun before waiters are woken up
+        with self.__lock:
+            if key in self.__pending:
+                self.__running[key] = self.__pending.pop(key)
+            elif self.__running.get(key) is future:
+                del self.__running[key]
+
+    def __count(self, key: Tuple[str, str, str], event: str) -> None:
+        self.__counters[key[-1]][event] += 1
+
+
+flights = SingleFlight()
@@ -0,0 +1,170 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Tuple, Union
+import numpy as np
+import pandas as pd
+import weak_nlp
+
+from . import instrument, util
+
+# 0 keeps the weak_nlp computation in the calling thread
+PROCESS_POOL_SIZE = int(os.getenv("WS_PROCESS_POOL_SIZE", "0"))
+
+CLASSIFICATION = "classification"
+EXTRACTION = "extraction"
+
+WEAKLY_SUPERVISE = "weakly_supervise"
+QUALITY_METRICS = "quality_metrics"
+QUANTITY_METRICS = "quantity_metrics"
+
+__lock = threading.Lock()
+__pool: Optional[ProcessPoolExecutor] = None
+
+
+def uses_pool() -> bool:
+    return PROCESS_POOL_SIZE > 0
+
+
+def run(
+    df: pd.DataFrame,
+    model_type: str,
+    operation: str,
+    quality_metrics_overwrite: Optional[Dict[Tuple[str, str], Dict[str, float]]] = None,
+    model: Optional[Union[weak_nlp.CNLM, weak_nlp.ENLM]] = None,
+) -> Any:
+    if not uses_pool():
+        if model is None:
+            model = build_model(df, model_type)
+        with instrument.phase(f"weak_nlp_{operation}") as observed:
+            value = apply(model, operation, quality_metrics_overwrite)
+            instrument.observe_result(observed, value)
+            return value
+
+    block, layout = __share(df)
+    # model building and the operation both run in the pool worker
+    try:
+        with instrument.phase(f"weak_nlp_{operation}"):
+            return (
+                __get_pool()
+                .submit(
+                    __run_shared,
+                    block.name,
+                    layout,
+                    model_type,
+                    operation,
+                    quality_metrics_overwrite,
+                )
+                .result()
+            )
+    finally:
+        block.close()
+        block.unlink()
+
+
+@instrument.timed("weak_nlp_build_model")
+def build_model(
+    df: pd.DataFrame, model_type: str
+) -> Union[weak_nlp.CNLM, weak_nlp.ENLM]:
+    if model_type == CLASSIFICATION:
+        return util.get_cnlm_from_df(df)
+    return util.get_enlm_from_df(df)
+
+
+def apply(
+    model: Union[weak_nlp.CNLM, weak_nlp.ENLM],
+    operation: str,
+    quality_metrics_overwrite: Optional[Dict[Tuple[str, str], Dict[str, float]]] = None,
+) -> Any:
+    if operation == WEAKLY_SUPERVISE:
+        return model.weakly_supervise(quality_metrics_overwrite)
+    if operation == QUALITY_METRICS:
+        return model.quality_metrics()
+    if operation == QUANTITY_METRICS:
+        return model.quantity_metrics()
+    raise ValueError(f"Unknown operation {operation}")
+
+
+def shutdown() -> None:
+    global __pool
+    with __lock:
+        if __pool is not None:
+            __pool.shutdown(wait=True)
+            __pool = None
+
+
+def __get_pool() -> ProcessPoolExecutor:
+    global __pool
+    with __lock:
+        if __pool is None:
+            # spawn, forking a process with open db connections and threads isn't safe
+            __pool = ProcessPoolExecutor(
+                max_workers=PROCESS_POOL_SIZE,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return __pool
+
+
+def __share(df: pd.DataFrame) -> Tuple[shared_memory.SharedMemory, Dict[str, Any]]:
+    # copies the frame columns into one shared memory block, ids are handed
+    # over as int32 codes plus a fixed width string array of the categories
+    arrays: Dict[str, np.ndarray] = {}
+    encoded: List[str] = []
+    for column in df.columns:
+        if column in ("record_id", "source_id", "label_id", "source_type"):
+            values = pd.Categorical(df[column])
+            arrays[column] = np.asarray(values.codes, dtype=np.int32)
+            arrays[f"{column}.categories"] = values.categories.to_numpy(dtype=str)
+            encoded.append(column)
+        else:
+            arrays[column] = np.ascontiguousarray(df[column].to_numpy())
+
+    entries = []
+    offset = 0
+    for key, array in arrays.items():
+        entries.append((key, array.dtype.str, array.shape, offset))
+        offset += (array.nbytes + 7) // 8 * 8
+    block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for (key, _, _, start), array in zip(entries, arrays.values()):
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf, offset=start)[
+            ...
+        ] = array
+    return block, {
+        "columns": list(df.columns),
+        "encoded": encoded,
+        "entries": entries,
+    }
+
+
+def __run_shared(
+    block_name: str,
+    layout: Dict[str, Any],
+    model_type: str,
+    operation: str,
+    quality_metrics_overwrite: Optional[Dict[Tuple[str, str], Dict[str, float]]],
+) -> Any:
+    # the block is unlinked by the parent once the result is back
+    block = shared_memory.SharedMemory(name=block_name)
+    try:
+        arrays = {
+            key: np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf, offset=start)
+            for key, dtype, shape, start in layout["entries"]
+        }
+        data = {}
+        for column in layout["columns"]:
+            if column in layout["encoded"]:
+                data[column] = pd.Categorical.from_codes(
+                    arrays[column].copy(),
+                    categories=pd.Index(
+                        arrays[f"{column}.categories"].astype(object), dtype=object
+                    ),
+                )
+            else:
+                data[column] = arrays[column].copy()
+        del arrays
+        df = pd.DataFrame(data, columns=layout["columns"])
+    finally:
+        block.close()
+    return apply(build_model(df, model_type), operation, quality_metrics_overwrite)
@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+import pickle
+import struct
+import tempfile
+from typing import Any, Dict, Optional, Tuple
+import numpy as np
+
+from . import instrument
+
+EXPORT_DIR = os.getenv("WS_EXPORT_DIR", "/inference")
+# keeps writing the pickle next to the new format until all readers moved
+WRITE_LEGACY_PICKLE = os.getenv("WS_EXPORT_LEGACY_PICKLE", "true").lower() == "true"
+
+MAGIC = b"WSSTATS\0"
+FORMAT_VERSION = 2
+# magic, format version, header length
+__PREFIX = struct.Struct("<8sII")
+__ALIGNMENT = 64
+# key fields and the per-statistic presence flags come before the statistics
+__KEY_FIELDS = 3
+# exports get the mode a plain open would give them, the umask can only be
+# read by setting it
+__UMASK = os.umask(0)
+os.umask(__UMASK)
+__FILE_MODE = 0o666 & ~__UMASK
+
+
+def get_path(project_id: str, labeling_task_id: str) -> str:
+    return os.path.join(
+        EXPORT_DIR, project_id, f"weak-supervision-{labeling_task_id}.wsstats"
+    )
+
+
+def get_legacy_path(project_id: str, labeling_task_id: str) -> str:
+    return os.path.join(
+        EXPORT_DIR, project_id, f"weak-supervision-{labeling_task_id}.pkl"
+    )
+
+
+@instrument.timed("export")
+def write(
+    project_id: str,
+    labeling_task_id: str,
+    ws_stats: Dict[Tuple[str, str], Dict[str, Any]],
+) -> bool:
+    # False if the stored export already has the same content
+    records = to_records(ws_stats)
+    content_hash = __hash(records)
+    path = get_path(project_id, labeling_task_id)
+    legacy_path = get_legacy_path(project_id, labeling_task_id)
+    if read_hash(path) == content_hash and (
+        not WRITE_LEGACY_PICKLE or os.path.exists(legacy_path)
+    ):
+        return False
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    header = json.dumps(
+        {
+            "descr": records.dtype.descr,
+            "count": len(records),
+            "hash": content_hash,
+        }
+    ).encode()
+    # records start aligned so they can be mapped as they are
+    padding = -(__PREFIX.size + len(header)) % __ALIGNMENT
+    header += b" " * padding
+    __write_atomic(
+        path,
+        __PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)) + header,
+        records.tobytes(),
+    )
+    if WRITE_LEGACY_PICKLE:
+        __write_atomic(legacy_path, pickle.dumps(ws_stats))
+    return True
+
+
+def to_records(ws_stats: Dict[Tuple[str, str], Dict[str, Any]]) -> np.ndarray:
+    # structured array sorted by (heuristic, label), one field per statistic in
+    # the type of its values (bool, int, float or utf-8 str) and a presence
+    # flag per statistic, missing and NaN values stay apart. Statistics whose
+    # values don't share one of these types are only in the legacy pickle
+    keys = sorted(ws_stats)
+    kinds: Dict[str, set] = {}
+    for stats in ws_stats.values():
+        for name, value in stats.items():
+            kinds.setdefault(name, set()).add(__kind(value))
+    fields = sorted(
+        name
+        for name, kind in kinds.items()
+        if len(kind) == 1 and next(iter(kind)) is not None
+    )
+    encoded = [(str(source).encode(), str(label).encode()) for source, label in keys]
+    source_width = max([len(source) for source, _ in encoded], default=1)
+    label_width = max([len(label) for _, label in encoded], default=1)
+    field_types = []
+    for name in fields:
+        kind = next(iter(kinds[name]))
+        if kind == "S":
+            width = max(
+                len(stats[name].encode())
+                for stats in ws_stats.values()
+                if name in stats
+            )
+            kind = f"S{max(width, 1)}"
+        field_types.append((name, kind))
+    dtype = np.dtype(
+        [
+            ("heuristic_id", f"S{source_width}"),
+            ("label_id", f"S{label_width}"),
+            ("present", "?", (len(fields),)),
+        ]
+        + field_types
+    )
+    records = np.zeros(len(keys), dtype=dtype)
+    if keys:
+        records["heuristic_id"] = [source for source, _ in encoded]
+        records["label_id"] = [label for _, label in encoded]
+        for position, (name, kind) in enumerate(field_types):
+            present = [name in ws_stats[key] for key in keys]
+            records["present"][:, position] = present
+            values = [ws_stats[key].get(name) for key in keys]
+            if kind.startswith("S"):
+                values = [
+                    value.encode() if value is not None else b"" for value in values
+                ]
+            records[name] = [
+                value if value is not None else records.dtype[name].type()
+                for value in values
+            ]
+    return records
+
+
+def read_hash(path: str) -> Optional[str]:
+    # content hash from the header only, None if there is no valid export
+    try:
+        with open(path, "rb") as f:
+            header = __read_header(f)
+    except (OSError, ValueError):
+        return None
+    return header["hash"]
+
+
+def read(path: str) -> np.ndarray:
+    # memory mapped records, nothing is deserialized
+    with open(path, "rb") as f:
+        header = __read_header(f)
+        offset = f.tell()
+    dtype = np.dtype([tuple(field) for field in header["descr"]])
+    if header["count"] == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(
+        path, dtype=dtype, mode="r", offset=offset, shape=(header["count"],)
+    )
+
+
+def lookup(
+    records: np.ndarray, heuristic_id: str, label_id: str
+) -> Optional[Dict[str, Any]]:
+    # binary search on the sorted (heuristic, label) keys
+    source = heuristic_id.encode()
+    start = np.searchsorted(records["heuristic_id"], source, side="left")
+    end = np.searchsorted(records["heuristic_id"], source, side="right")
+    label = label_id.encode()
+    position = start + np.searchsorted(records["label_id"][start:end], label)
+    if position >= end or records["label_id"][position] != label:
+        return None
+    return __statistics(records, records[position])
+
+
+def load(
+    project_id: str, labeling_task_id: str
+) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    # full mapping from the new format, falls back to the legacy pickle
+    path = get_path(project_id, labeling_task_id)
+    if read_hash(path) is None:
+        with open(get_legacy_path(project_id, labeling_task_id), "rb") as f:
+            return pickle.load(f)
+    records = read(path)
+    return {
+        (row["heuristic_id"].decode(), row["label_id"].decode()): __statistics(
+            records, row
+        )
+        for row in records
+    }
+
+
+def __kind(value: Any) -> Optional[str]:
+    if isinstance(value, (bool, np.bool_)):
+        return "?"
+    if isinstance(value, (int, np.integer)):
+        return "<i8"
+    if isinstance(value, (float, np.floating)):
+        return "<f8"
+    if isinstance(value, str):
+        return "S"
+    return None
+
+
+def __statistics(records: np.ndarray, row: np.void) -> Dict[str, Any]:
+    statistics = {}
+    names = records.dtype.names[__KEY_FIELDS:]
+    for name, present in zip(names, row["present"]):
+        if present:
+            value = row[name]
+            if isinstance(value, bytes):
+                statistics[name] = value.decode()
+            else:
+                statistics[name] = value.item()
+    return statistics
+
+
+def __hash(records: np.ndarray) -> str:
+    content = hashlib.sha256(json.dumps(records.dtype.descr).encode())
+    content.update(records.tobytes())
+    return content.hexdigest()
+
+
+def __read_header(f) -> Dict[str, Any]:
+    prefix = f.read(__PREFIX.size)
+    if len(prefix) != __PREFIX.size:
+        raise ValueError("Truncated export")
+    magic, version, header_length = __PREFIX.unpack(prefix)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError("Unknown export format")
+    return json.loads(f.read(header_length))
+
+
+def __write_atomic(path: str, *parts: bytes) -> None:
+    # readers either see the previous or the complete new file
+    directory = os.path.dirname(path)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        # mkstemp creates the file with 0600
+        os.chmod(temp_path, __FILE_MODE)
+        with os.fdopen(fd, "wb") as f:
+            for part in parts:
+                f.write(part)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
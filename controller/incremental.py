@@ -0,0 +1,283 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+from . import metrics, util
+
+# the deltas are checked against a full recompute in tests/test_incremental.py,
+# the state of the least recently used tasks is dropped past either limit
+INCREMENTAL_STATS = os.getenv("WS_INCREMENTAL_STATS", "true").lower() == "true"
+MAX_TRACKED_TASKS = int(os.getenv("WS_INCREMENTAL_MAX_TASKS", "16"))
+MAX_TRACKED_BYTES = int(os.getenv("WS_INCREMENTAL_MAX_BYTES", str(256 * 2**20)))
+
+QUANTITY_KEYS = metrics.QUANTITY_KEYS
+
+
+class RecordIndex:
+    # deduplicated (record, source, label) hits of all heuristics of a task,
+    # sorted by record with an additional per-source ordering
+    def __init__(self, df: pd.DataFrame):
+        noisy = df.loc[df["source_id"].notna()]
+        record_codes, self.record_ids = util.sorted_codes(noisy["record_id"])
+        source_codes, self.source_ids = util.sorted_codes(noisy["source_id"])
+        label_codes, self.label_ids = util.sorted_codes(noisy["label_id"])
+
+        order = np.lexsort((label_codes, source_codes, record_codes))
+        records = record_codes[order]
+        sources = source_codes[order]
+        labels = label_codes[order]
+        unique = np.ones(len(order), dtype=bool)
+        unique[1:] = (
+            (records[1:] != records[:-1])
+            | (sources[1:] != sources[:-1])
+            | (labels[1:] != labels[:-1])
+        )
+        self.records = records[unique].astype(np.int32)
+        self.sources = sources[unique].astype(np.int32)
+        self.labels = labels[unique].astype(np.int32)
+        self.record_offsets = np.searchsorted(
+            self.records, np.arange(len(self.record_ids) + 1)
+        )
+        self.source_order = np.argsort(self.sources, kind="stable").astype(np.int32)
+        self.source_offsets = np.searchsorted(
+            self.sources[self.source_order], np.arange(len(self.source_ids) + 1)
+        )
+        self.nbytes = sum(
+            array.nbytes
+            for array in (
+                self.records,
+                self.sources,
+                self.labels,
+                self.record_offsets,
+                self.source_order,
+                self.source_offsets,
+            )
+        ) + sum(
+            ids.nbytes + sum(sys.getsizeof(value) for value in ids)
+            for ids in (self.record_ids, self.source_ids, self.label_ids)
+        )
+
+    def source_hits(self, source_id: str) -> pd.DataFrame:
+        source_code = self.__find(self.source_ids, source_id)
+        if source_code is None:
+            return self.__frame(np.empty(0, dtype=np.intp))
+        positions = self.source_order[
+            self.source_offsets[source_code] : self.source_offsets[source_code + 1]
+        ]
+        return self.__frame(positions)
+
+    def record_hits(self, record_ids: np.ndarray) -> pd.DataFrame:
+        # all hits on the given records, gathered through the record offsets
+        codes = np.searchsorted(self.record_ids, record_ids)
+        found = codes < len(self.record_ids)
+        codes = codes[found]
+        codes = codes[self.record_ids[codes] == record_ids[found]]
+        starts = self.record_offsets[codes]
+        lengths = self.record_offsets[codes + 1] - starts
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        positions += np.arange(lengths.sum())
+        return self.__frame(positions)
+
+    def __frame(self, positions: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame(
+            {
+                "record_id": self.record_ids[self.records[positions]],
+                "source_id": self.source_ids[self.sources[positions]],
+                "label_id": self.label_ids[self.labels[positions]],
+            }
+        )
+
+    @staticmethod
+    def __find(values: np.ndarray, value: str) -> Optional[int]:
+        position = int(np.searchsorted(values, value))
+        if position < len(values) and values[position] == value:
+            return position
+        return None
+
+
+__lock = threading.Lock()
+__states: "OrderedDict[Tuple[str, str], Dict]" = OrderedDict()
+
+
+def remember(
+    project_id: str,
+    labeling_task_id: str,
+    source_versions: Optional[Dict[str, str]],
+    df: pd.DataFrame,
+    statistics: Dict[str, Dict[str, Dict[str, int]]],
+) -> None:
+    if not INCREMENTAL_STATS or source_versions is None:
+        return
+    __store(
+        project_id,
+        labeling_task_id,
+        {
+            "versions": source_versions,
+            "index": RecordIndex(df),
+            "overrides": {},
+            "statistics": statistics,
+        },
+    )
+
+
+def forget(
+    project_id: Optional[str] = None, labeling_task_id: Optional[str] = None
+) -> int:
+    # drops the state of the given task or project, all without ids
+    with __lock:
+        keys = [
+            key
+            for key in __states
+            if project_id in (None, key[0]) and labeling_task_id in (None, key[1])
+        ]
+        for key in keys:
+            del __states[key]
+    return len(keys)
+
+
+def get_counters() -> Dict[str, int]:
+    with __lock:
+        return {
+            "tasks": len(__states),
+            "bytes": sum(state["nbytes"] for state in __states.values()),
+        }
+
+
+def classification_quantity_delta(
+    project_id: str,
+    labeling_task_id: str,
+    source_versions: Optional[Dict[str, str]],
+    source_id: str,
+    df: pd.DataFrame,
+) -> Optional[Dict[str, Dict[str, Dict[str, int]]]]:
+    # statistics rows that changed because only source_id was re-run, None if
+    # the previous state can't be used and everything needs to be recomputed
+    if not INCREMENTAL_STATS or source_versions is None:
+        return None
+    with __lock:
+        state = __states.get((project_id, labeling_task_id))
+    if state is None or not __only_source_changed(
+        state["versions"], source_versions, source_id
+    ):
+        return None
+
+    df_source = df.loc[df["source_id"] == source_id]
+    old_hits = __source_hits(state, source_id)
+    new_hits = pd.DataFrame(
+        {
+            "record_id": df_source["record_id"].to_numpy(dtype=object),
+            "source_id": source_id,
+            "label_id": df_source["label_id"].to_numpy(dtype=object),
+        }
+    ).drop_duplicates()
+
+    affected_record_ids = np.unique(
+        np.concatenate(
+            [
+                old_hits["record_id"].to_numpy(dtype=object),
+                new_hits["record_id"].to_numpy(dtype=object),
+            ]
+        )
+    )
+    other_hits = __record_hits(state, affected_record_ids)
+    other_hits = other_hits.loc[other_hits["source_id"] != source_id]
+
+    old_counts = metrics.classification_quantity_counts(
+        pd.concat([other_hits, old_hits])
+    )
+    new_counts = metrics.classification_quantity_counts(
+        pd.concat([other_hits, new_hits])
+    )
+    delta = new_counts.drop(index=source_id, level="source_id", errors="ignore").sub(
+        old_counts.drop(index=source_id, level="source_id", errors="ignore"),
+        fill_value=0,
+    )
+    delta = delta.loc[(delta != 0).any(axis=1)]
+
+    previous = state["statistics"]
+    changed = {}
+    if source_id in new_counts.index.get_level_values("source_id"):
+        changed[source_id] = {
+            label_id: {key: int(value) for key, value in row.items()}
+            for label_id, row in new_counts.loc[source_id].to_dict("index").items()
+        }
+    for (other_source_id, label_id), row in delta.to_dict("index").items():
+        stats_item = previous.get(other_source_id, {}).get(label_id)
+        if stats_item is None:
+            return None
+        changed.setdefault(other_source_id, {})[label_id] = {
+            key: int(stats_item[key] + row[key]) for key in QUANTITY_KEYS
+        }
+
+    statistics = {
+        other_source_id: dict(labels)
+        for other_source_id, labels in previous.items()
+        if other_source_id != source_id
+    }
+    for changed_source_id, labels in changed.items():
+        statistics.setdefault(changed_source_id, {}).update(labels)
+    # the base index stays, the re-run source is tracked as an override
+    __store(
+        project_id,
+        labeling_task_id,
+        {
+            "versions": source_versions,
+            "index": state["index"],
+            "overrides": {**state["overrides"], source_id: new_hits},
+            "statistics": statistics,
+        },
+    )
+    return changed
+
+
+def __store(project_id: str, labeling_task_id: str, state: Dict) -> None:
+    state["nbytes"] = state["index"].nbytes + sum(
+        int(override.memory_usage(deep=True).sum())
+        for override in state["overrides"].values()
+    )
+    key = (project_id, labeling_task_id)
+    with __lock:
+        __states.pop(key, None)
+        if state["nbytes"] > MAX_TRACKED_BYTES:
+            # too large to keep, the task is recomputed in full
+            return
+        __states[key] = state
+        tracked_bytes = sum(tracked["nbytes"] for tracked in __states.values())
+        while len(__states) > MAX_TRACKED_TASKS or tracked_bytes > MAX_TRACKED_BYTES:
+            _, dropped = __states.popitem(last=False)
+            tracked_bytes -= dropped["nbytes"]
+
+
+def __source_hits(state: Dict, source_id: str) -> pd.DataFrame:
+    if source_id in state["overrides"]:
+        return state["overrides"][source_id]
+    return state["index"].source_hits(source_id)
+
+
+def __record_hits(state: Dict, record_ids: np.ndarray) -> pd.DataFrame:
+    hits = state["index"].record_hits(record_ids)
+    overrides = state["overrides"]
+    if not overrides:
+        return hits
+    hits = hits.loc[~hits["source_id"].isin(list(overrides))]
+    return pd.concat(
+        [hits]
+        + [
+            override.loc[override["record_id"].isin(record_ids)]
+            for override in overrides.values()
+        ]
+    )
+
+
+def __only_source_changed(
+    previous: Dict[str, str], current: Dict[str, str], source_id: str
+) -> bool:
+    # manual labels don't influence the quantity statistics
+    ignored = {source_id, util.MANUAL_SOURCE_ID}
+    return {key: value for key, value in previous.items() if key not in ignored} == {
+        key: value for key, value in current.items() if key not in ignored
+    }
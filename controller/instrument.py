@@ -0,0 +1,297 @@
+import contextvars
+import functools
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import pandas as pd
+
+INSTRUMENTATION_ENABLED = os.getenv("WS_INSTRUMENTATION", "true").lower() == "true"
+
+LABEL_NAMES = ("endpoint", "task_type")
+DURATION_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+ROW_BUCKETS = (10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+BYTE_BUCKETS = tuple(1024**2 * 4**exponent for exponent in range(8))
+RSS_SAMPLE_SECONDS = float(os.getenv("WS_RSS_SAMPLE_SECONDS", "0.05"))
+
+__labels: contextvars.ContextVar[Optional[Dict[str, str]]] = contextvars.ContextVar(
+    "ws_instrument_labels", default=None
+)
+
+
+def format_labels(items: Tuple[Tuple[str, Any], ...]) -> str:
+    if not items:
+        return ""
+    rendered = ",".join(f'{key}="{escape_label(str(value))}"' for key, value in items)
+    return "{" + rendered + "}"
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_bound(bound: Any) -> str:
+    return bound if isinstance(bound, str) else repr(float(bound))
+
+
+class Histogram:
+    # cumulative buckets per label set, rendered in the Prometheus text format
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float]):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.__lock = threading.Lock()
+        self.__series: Dict[Tuple[Tuple[str, str], ...], List[float]] = {}
+
+    def observe(self, labels: Dict[str, str], value: float) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.__lock:
+            series = self.__series.get(key)
+            if series is None:
+                # bucket counts, +Inf count, sum
+                series = self.__series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[position] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self.__lock:
+            series = {key: list(values) for key, values in self.__series.items()}
+        for key, values in sorted(series.items()):
+            for bound, count in zip(self.buckets + ("+Inf",), values[:-1]):
+                labels = format_labels(key + (("le", format_bound(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = format_labels(key)
+            lines.append(f"{self.name}_sum{labels} {values[-1]}")
+            lines.append(f"{self.name}_count{labels} {values[-2]}")
+        return lines
+
+
+class Gauge:
+    # keeps the last value per label set
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.__lock = threading.Lock()
+        self.__series: Dict[Tuple[Tuple[str, str], ...], float] = defaultdict(float)
+
+    def set(self, labels: Dict[str, str], value: float) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.__lock:
+            self.__series[key] = value
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} gauge",
+        ]
+        with self.__lock:
+            series = dict(self.__series)
+        for key, value in sorted(series.items()):
+            lines.append(f"{self.name}{format_labels(key)} {value}")
+        return lines
+
+
+class Counter:
+    # running total per label set
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.__lock = threading.Lock()
+        self.__series: Dict[Tuple[Tuple[str, str], ...], float] = defaultdict(float)
+
+    def inc(self, labels: Dict[str, str], value: float = 1) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.__lock:
+            self.__series[key] += value
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self.__lock:
+            series = dict(self.__series)
+        for key, value in sorted(series.items()):
+            lines.append(f"{self.name}{format_labels(key)} {value}")
+        return lines
+
+
+class RssSampler:
+    # peak resident memory of the process while phases are running. One
+    # thread samples for all running phases and exits when none is left
+    PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self.__lock = threading.Lock()
+        self.__peaks: Dict[int, int] = {}
+        self.__next_token = 0
+        self.__thread: Optional[threading.Thread] = None
+
+    def start(self) -> Optional[int]:
+        rss = self.read()
+        if rss is None:
+            return None
+        with self.__lock:
+            token = self.__next_token
+            self.__next_token += 1
+            self.__peaks[token] = rss
+            if self.__thread is None:
+                self.__thread = threading.Thread(
+                    target=self.__sample, name="ws-rss-sampler", daemon=True
+                )
+                self.__thread.start()
+        return token
+
+    def stop(self, token: Optional[int]) -> Optional[int]:
+        if token is None:
+            return None
+        rss = self.read()
+        with self.__lock:
+            peak = self.__peaks.pop(token)
+        return max(peak, rss or 0)
+
+    def __sample(self) -> None:
+        while True:
+            time.sleep(self.interval_seconds)
+            rss = self.read()
+            with self.__lock:
+                if not self.__peaks or rss is None:
+                    self.__thread = None
+                    return
+                for token, peak in self.__peaks.items():
+                    if rss > peak:
+                        self.__peaks[token] = rss
+
+    @staticmethod
+    def read() -> Optional[int]:
+        # current resident memory, ru_maxrss would only report the peak of the
+        # process lifetime. None where /proc isn't available
+        try:
+            with open("/proc/self/statm") as f:
+                resident_pages = int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            return None
+        return resident_pages * RssSampler.PAGE_SIZE
+
+
+request_seconds = Histogram(
+    "ws_request_duration_seconds", "Wall time per request or job", DURATION_BUCKETS
+)
+phase_seconds = Histogram(
+    "ws_phase_duration_seconds", "Wall time per phase", DURATION_BUCKETS
+)
+phase_rows = Histogram("ws_phase_rows", "Rows handled per phase", ROW_BUCKETS)
+phase_frame_bytes = Histogram(
+    "ws_phase_frame_bytes", "Memory of the DataFrames built per phase", BYTE_BUCKETS
+)
+phase_peak_rss = Gauge(
+    "ws_phase_peak_rss_bytes",
+    "Peak resident memory of the process during the last run of a phase, "
+    "sampled every WS_RSS_SAMPLE_SECONDS",
+)
+rss_sampler = RssSampler(RSS_SAMPLE_SECONDS)
+weak_nlp_fallbacks = Counter(
+    "ws_weak_nlp_fallbacks_total",
+    "Extraction tasks the numpy engines left to weak_nlp because of spans "
+    "without a beginning token",
+)
+METRICS = [
+    request_seconds,
+    phase_seconds,
+    phase_rows,
+    phase_frame_bytes,
+    phase_peak_rss,
+    weak_nlp_fallbacks,
+]
+
+
+@contextmanager
+def request(endpoint: str, **labels: str) -> Iterator[None]:
+    # labels all phases inside, also in functions called from here
+    token = __labels.set({"endpoint": endpoint, "task_type": "", **labels})
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if INSTRUMENTATION_ENABLED:
+            request_seconds.observe(__labels.get(), time.perf_counter() - start)
+        __labels.reset(token)
+
+
+def set_task_type(task_type: str) -> None:
+    # the task type is only known once the task is loaded
+    labels = __labels.get()
+    if labels is not None:
+        labels["task_type"] = task_type
+
+
+@contextmanager
+def phase(name: str) -> Iterator[Dict[str, Any]]:
+    # the yielded dict takes optional "rows" and "frame" of the phase
+    observed: Dict[str, Any] = {}
+    start = time.perf_counter()
+    token = rss_sampler.start() if INSTRUMENTATION_ENABLED else None
+    try:
+        yield observed
+    finally:
+        if INSTRUMENTATION_ENABLED:
+            observed["peak_rss"] = rss_sampler.stop(token)
+            __observe(name, time.perf_counter() - start, observed)
+
+
+def timed(name: str) -> Callable:
+    # phase around a function, rows and memory are taken from a returned
+    # DataFrame or sized result
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with phase(name) as observed:
+                value = fn(*args, **kwargs)
+                observe_result(observed, value)
+                return value
+
+        return wrapper
+
+    return decorator
+
+
+def observe_result(observed: Dict[str, Any], value: Any) -> None:
+    if isinstance(value, tuple):
+        value = next((item for item in value if isinstance(item, pd.DataFrame)), None)
+    if isinstance(value, pd.DataFrame):
+        observed["frame"] = value
+    elif hasattr(value, "__len__") and not isinstance(value, str):
+        observed["rows"] = len(value)
+
+
+def render() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def __observe(name: str, duration: float, observed: Dict[str, Any]) -> None:
+    labels = {key: "" for key in LABEL_NAMES}
+    labels.update(__labels.get() or {})
+    labels["phase"] = name
+    phase_seconds.observe(labels, duration)
+    frame = observed.get("frame")
+    if frame is not None:
+        phase_rows.observe(labels, len(frame))
+        # shallow, categorical ids are counted by their codes and categories
+        phase_frame_bytes.observe(labels, int(frame.memory_usage(index=True).sum()))
+    elif observed.get("rows") is not None:
+        phase_rows.observe(labels, observed["rows"])
+    if observed.get("peak_rss") is not None:
+        phase_peak_rss.set(labels, observed["peak_rss"])
@@ -1,25 +1,28 @@
-import os
-from typing import Any, Dict, List, Tuple, Optional, Union
+from typing import Any, Dict, List, Sequence, Tuple, Optional, Union
 import traceback
 import pandas as pd
-import pickle
-from collections import defaultdict
 
-from submodules.model.models import (
-    LabelingTask,
-    LabelingTaskLabel,
-    RecordLabelAssociation,
-    RecordLabelAssociationToken,
+from . import (
+    admission,
+    cache,
+    coalesce,
+    compute,
+    export,
+    instrument,
+    jobs,
+    loader,
+    metadata,
+    profiling,
+    results,
+    span_vote,
+    streaming,
+    weighted_vote,
 )
-from . import util
 from submodules.model import enums
 from submodules.model.business_objects import (
     general,
-    labeling_task,
     record_label_association,
     weak_supervision,
-    labeling_task_label,
-    information_source,
 )
 
 NO_LABEL_WS_PRECISION = 0.8
@@ -32,30 +35,154 @@ def __create_quality_metrics(
 ) -> Dict[Tuple[str, str], Dict[str, float]]:
     if isinstance(overwrite_weak_supervision, float):
         ws_weights = {}
-        for heuristic_id in information_source.get_all_ids_by_labeling_task_id(
-            project_id, labeling_task_id
+        # sources and labels decide the weights, a heuristic created within
+        # the cache ttl must not be missing
+        for heuristic_id in metadata.get_source_ids(
+            project_id, labeling_task_id, refresh=True
         ):
-            ws_weights[str(heuristic_id)] = overwrite_weak_supervision
+            ws_weights[heuristic_id] = overwrite_weak_supervision
     else:
         ws_weights = overwrite_weak_supervision
 
     ws_stats = {}
+    label_ids = metadata.get_label_ids(project_id, labeling_task_id, refresh=True)
     for heuristic_id in ws_weights:
-        label_ids = labeling_task_label.get_all_ids(project_id, labeling_task_id)
-        for (label_id,) in label_ids:
-            ws_stats[(heuristic_id, str(label_id))] = {
+        for label_id in label_ids:
+            ws_stats[(heuristic_id, label_id)] = {
                 "precision": ws_weights[heuristic_id]
             }
     return ws_stats
 
 
+def submit_fit_predict(
+    project_id: str,
+    labeling_task_id: str,
+    user_id: str,
+    weak_supervision_task_id: str,
+    overwrite_weak_supervision: Optional[Union[float, Dict[str, float]]] = None,
+    engine: Optional[str] = None,
+) -> bool:
+    request = {
+        "project_id": project_id,
+        "labeling_task_id": labeling_task_id,
+        "user_id": user_id,
+        "weak_supervision_task_id": weak_supervision_task_id,
+        "overwrite_weak_supervision": overwrite_weak_supervision,
+        "engine": engine,
+        "superseded_ids": [],
+    }
+    # estimated before loading anything, the job waits until it fits in memory
+    estimate = admission.estimate_task(project_id, labeling_task_id)
+    key = (project_id, labeling_task_id, "fit_predict")
+    if not coalesce.flights.enqueue(key, request, __supersede):
+        # runs once the current job for the task is done
+        jobs.register(weak_supervision_task_id)
+        return True
+
+    if jobs.submit(
+        weak_supervision_task_id,
+        __run_fit_predict_chain,
+        key,
+        request,
+        project_id=project_id,
+        estimate=estimate,
+    ):
+        return True
+    while request is not None:
+        for failed_id in [request["weak_supervision_task_id"]] + request[
+            "superseded_ids"
+        ]:
+            weak_supervision.update_state(
+                project_id,
+                failed_id,
+                enums.PayloadState.FAILED.value,
+                with_commit=True,
+            )
+        request = coalesce.flights.complete(key)
+    return False
+
+
+def __supersede(queued: Dict[str, Any], request: Dict[str, Any]) -> Dict[str, Any]:
+    # the newer request replaces the queued one, whose payload is finished with it
+    request["superseded_ids"] = queued["superseded_ids"] + [
+        queued["weak_supervision_task_id"]
+    ]
+    return request
+
+
+def __run_fit_predict_chain(key: Tuple[str, str, str], request: Dict[str, Any]):
+    while request is not None:
+        jobs.set_state(request["weak_supervision_task_id"], jobs.RUNNING)
+        try:
+            state = __run_fit_predict(
+                request["project_id"],
+                request["labeling_task_id"],
+                request["user_id"],
+                request["weak_supervision_task_id"],
+                request["overwrite_weak_supervision"],
+                request["engine"],
+            )
+        except Exception:
+            print(traceback.format_exc(), flush=True)
+            state = enums.PayloadState.FAILED.value
+        for superseded_id in request["superseded_ids"]:
+            weak_supervision.update_state(
+                request["project_id"], superseded_id, state, with_commit=True
+            )
+            jobs.set_state(superseded_id, jobs.DONE)
+        jobs.set_state(
+            request["weak_supervision_task_id"],
+            jobs.DONE if state == enums.PayloadState.FINISHED.value else jobs.ERROR,
+        )
+        request = coalesce.flights.complete(key)
+
+
+def __run_fit_predict(
+    project_id: str,
+    labeling_task_id: str,
+    user_id: str,
+    weak_supervision_task_id: str,
+    overwrite_weak_supervision: Optional[Union[float, Dict[str, float]]] = None,
+    engine: Optional[str] = None,
+) -> str:
+    weak_supervision.update_state(
+        project_id,
+        weak_supervision_task_id,
+        enums.PayloadState.STARTED.value,
+        with_commit=True,
+    )
+    try:
+        with instrument.request("fit_predict"), profiling.capture(
+            project_id, labeling_task_id, "fit_predict"
+        ):
+            return fit_predict(
+                project_id,
+                labeling_task_id,
+                user_id,
+                weak_supervision_task_id,
+                overwrite_weak_supervision,
+                engine,
+            )
+    except Exception:
+        # fit_predict itself only guards the integration, not the data loading
+        general.rollback()
+        weak_supervision.update_state(
+            project_id,
+            weak_supervision_task_id,
+            enums.PayloadState.FAILED.value,
+            with_commit=True,
+        )
+        raise
+
+
 def fit_predict(
     project_id: str,
     labeling_task_id: str,
     user_id: str,
     weak_supervision_task_id: str,
     overwrite_weak_supervision: Optional[Union[float, Dict[str, float]]] = None,
-):
+    engine: Optional[str] = None,
+) -> str:
     quality_metrics_overwrite = None
     if overwrite_weak_supervision is not None:
         quality_metrics_overwrite = __create_quality_metrics(
@@ -68,33 +195,88 @@ def fit_predict(
             project_id, labeling_task_id, NO_LABEL_WS_PRECISION
         )
 
+    # a new run picks up changed heuristic selections right away
+    task_info = metadata.get_task(project_id, labeling_task_id, refresh=True)
+    task_type = task_info.task_type
+    instrument.set_task_type(task_type)
+    engine = weighted_vote.get_engine(
+        engine,
+        compute.CLASSIFICATION
+        if task_type == enums.LabelingTaskType.CLASSIFICATION.value
+        else compute.EXTRACTION,
+    )
+    selected_source_ids = task_info.selected_source_ids
+    if streaming.should_stream(
+        project_id, labeling_task_id, task_type, selected_source_ids
+    ):
+        if quality_metrics_overwrite is None:
+            quality_metrics_overwrite = streaming.get_quality_metrics(
+                project_id, labeling_task_id, task_type, selected_source_ids
+            )
+        # without quality metrics weak_nlp would derive them per shard
+        if quality_metrics_overwrite is not None:
+            try:
+                streaming.fit_predict_classification(
+                    project_id,
+                    labeling_task_id,
+                    user_id,
+                    weak_supervision_task_id,
+                    task_type,
+                    selected_source_ids,
+                    quality_metrics_overwrite,
+                    engine,
+                )
+                return enums.PayloadState.FINISHED.value
+            except Exception:
+                print(traceback.format_exc(), flush=True)
+                return __fail(project_id, weak_supervision_task_id)
+
     task_type, df = collect_data(project_id, labeling_task_id, True)
     if len(df.index) == 0:
         #nothing to calculate no values are present (e.g. source run through but didn't hit anything)
-        return
-    try:
-        if task_type == enums.LabelingTaskType.CLASSIFICATION.value:
-            results = integrate_classification(df, quality_metrics_overwrite)
-        else:
-            results = integrate_extraction(df, quality_metrics_overwrite)
-        weak_supervision.store_data(
+        # the payload was set to STARTED, it has to be finished here as well
+        weak_supervision.update_state(
             project_id,
-            labeling_task_id,
-            user_id,
-            results,
-            task_type,
             weak_supervision_task_id,
+            enums.PayloadState.FINISHED.value,
             with_commit=True,
         )
+        return enums.PayloadState.FINISHED.value
+    try:
+        if task_type == enums.LabelingTaskType.CLASSIFICATION.value:
+            results_by_record = integrate_classification(
+                df, quality_metrics_overwrite, engine
+            )
+        else:
+            results_by_record = integrate_extraction(
+                df, quality_metrics_overwrite, engine
+            )
+        with instrument.phase("store_results") as observed:
+            observed["rows"] = len(results_by_record)
+            weak_supervision.store_data(
+                project_id,
+                labeling_task_id,
+                user_id,
+                results_by_record,
+                task_type,
+                weak_supervision_task_id,
+                with_commit=True,
+            )
+        return enums.PayloadState.FINISHED.value
     except Exception:
         print(traceback.format_exc(), flush=True)
-        general.rollback()
-        weak_supervision.update_state(
-            project_id,
-            weak_supervision_task_id,
-            enums.PayloadState.FAILED.value,
-            with_commit=True,
-        )
+        return __fail(project_id, weak_supervision_task_id)
+
+
+def __fail(project_id: str, weak_supervision_task_id: str) -> str:
+    general.rollback()
+    weak_supervision.update_state(
+        project_id,
+        weak_supervision_task_id,
+        enums.PayloadState.FAILED.value,
+        with_commit=True,
+    )
+    return enums.PayloadState.FAILED.value
 
 
 def export_weak_supervision_stats(
@@ -116,11 +298,11 @@ def export_weak_supervision_stats(
         task_type, df = collect_data(project_id, labeling_task_id, False)
         try:
             if task_type == enums.LabelingTaskType.CLASSIFICATION.value:
-                cnlm = util.get_cnlm_from_df(df)
-                stats_df = cnlm.quality_metrics()
+                stats_df = compute.run(
+                    df, compute.CLASSIFICATION, compute.QUALITY_METRICS
+                )
             elif task_type == enums.LabelingTaskType.INFORMATION_EXTRACTION.value:
-                enlm = util.get_enlm_from_df(df)
-                stats_df = enlm.quality_metrics()
+                stats_df = compute.run(df, compute.EXTRACTION, compute.QUALITY_METRICS)
             else:
                 return 404, f"Task type {task_type} not implemented"
 
@@ -136,150 +318,74 @@ def export_weak_supervision_stats(
             general.rollback()
             return 500, "Internal server error"
 
-    os.makedirs(os.path.join("/inference", project_id), exist_ok=True)
-    with open(
-        os.path.join(
-            "/inference", project_id, f"weak-supervision-{labeling_task_id}.pkl"
-        ),
-        "wb",
-    ) as f:
-        pickle.dump(ws_stats, f)
-
+    export.write(project_id, labeling_task_id, ws_stats)
     return 200, "OK"
 
 
 def integrate_classification(
     df: pd.DataFrame,
     quality_metrics_overwrite: Optional[Dict[Tuple[str, str], Dict[str, float]]] = None,
-):
-    cnlm = util.get_cnlm_from_df(df)
-    weak_supervision_results = cnlm.weakly_supervise(quality_metrics_overwrite)
-    return_values = defaultdict(list)
-    for record_id, (
-        label_id,
-        confidence,
-    ) in weak_supervision_results.dropna().items():
-        return_values[record_id].append(
-            {"label_id": label_id, "confidence": confidence}
-        )
-    return return_values
+    engine: str = weighted_vote.WEAK_NLP,
+) -> Dict[str, List[Dict[str, Any]]]:
+    if engine == weighted_vote.NUMPY:
+        return weighted_vote.weakly_supervise(df, quality_metrics_overwrite).to_dict()
+    weak_supervision_results = compute.run(
+        df, compute.CLASSIFICATION, compute.WEAKLY_SUPERVISE, quality_metrics_overwrite
+    )
+    return results.classification_to_dict(weak_supervision_results)
 
 
 def integrate_extraction(
     df: pd.DataFrame,
     quality_metrics_overwrite: Optional[Dict[Tuple[str, str], Dict[str, float]]] = None,
-):
-    enlm = util.get_enlm_from_df(df)
-    weak_supervision_results = enlm.weakly_supervise(quality_metrics_overwrite)
-    return_values = defaultdict(list)
-    for record_id, preds in weak_supervision_results.items():
-        for pred in preds:
-            label, confidence, token_min, token_max = pred
-            return_values[record_id].append(
-                {
-                    "label_id": label,
-                    "confidence": confidence,
-                    "token_index_start": token_min,
-                    "token_index_end": token_max,
-                }
-            )
-    return dict(return_values)
+    engine: str = weighted_vote.WEAK_NLP,
+) -> Dict[str, List[Dict[str, Any]]]:
+    if engine == weighted_vote.NUMPY:
+        return span_vote.weakly_supervise(df, quality_metrics_overwrite).to_dict()
+    weak_supervision_results = compute.run(
+        df, compute.EXTRACTION, compute.WEAKLY_SUPERVISE, quality_metrics_overwrite
+    )
+    return results.extraction_to_dict(weak_supervision_results)
 
 
+@instrument.timed("collect_data")
 def collect_data(
-    project_id: str, labeling_task_id: str, only_selected: bool
+    project_id: str,
+    labeling_task_id: str,
+    only_selected: bool,
+    exclusion_ids: Optional[Sequence[str]] = None,
+    manual_df: Optional[pd.DataFrame] = None,
 ) -> Tuple[str, pd.DataFrame]:
-    labeling_task_item = labeling_task.get(project_id, labeling_task_id)
-
-    query_results = []
-    if labeling_task_item.task_type == enums.LabelingTaskType.CLASSIFICATION.value:
-        for information_source_item in labeling_task_item.information_sources:
-            if only_selected and not information_source_item.is_selected:
-                continue
-            results = (
-                record_label_association.get_all_classifications_for_information_source(
-                    project_id, information_source_item.id
-                )
-            )
-            query_results.extend(results)
-
-        request_body = __jsonize_classification_associations(query_results)
-
-        records_manual = record_label_association.get_manual_classifications_for_labeling_task_as_json(
-            project_id, labeling_task_id
-        )
-        request_body.extend(records_manual)
-
-    elif (
-        labeling_task_item.task_type
-        == enums.LabelingTaskType.INFORMATION_EXTRACTION.value
-    ):
-        for information_source_item in labeling_task_item.information_sources:
-            if only_selected and not information_source_item.is_selected:
-                continue
-            results = record_label_association.get_all_extraction_tokens_for_information_source(
-                project_id, information_source_item.id
-            )
-            query_results.extend(results)
-
-        request_body = __jsonize_extraction_token_associations(query_results)
-        records_manual = record_label_association.get_manual_extraction_tokens_for_labeling_task_as_json(
-            project_id, labeling_task_id
-        )
-        request_body.extend(records_manual)
-    return labeling_task_item.task_type, pd.DataFrame(request_body).drop_duplicates()
-
-
-def __jsonize_extraction_token_associations(
-    association_tuples: List[
-        Tuple[
-            RecordLabelAssociation,
-            RecordLabelAssociationToken,
-            LabelingTask,
-            LabelingTaskLabel,
-        ]
-    ]
-) -> List[Dict[str, Any]]:
-    statistics_request_body = []
-    for tuple in association_tuples:
-        association, token, labeling_task, label = tuple
-        source_id = None
-        if association.source_id is not None:
-            source_id = str(association.source_id)
-        statistics_request_body.append(
-            {
-                "record_id": str(association.record_id),
-                "source_id": source_id,
-                "source_type": association.source_type,
-                "confidence": association.confidence,
-                "label_id": str(label.id),
-                "token_index": token.token_index,
-                "is_beginning_token": token.is_beginning_token,
-            }
-        )
-    return statistics_request_body
-
-
-def __jsonize_classification_associations(
-    association_tuples: Tuple[
-        RecordLabelAssociation,
-        LabelingTask,
-        LabelingTaskLabel,
-    ]
-) -> List[Dict[str, Any]]:
-    statistics_request_body = []
-    for tuple in association_tuples:
-        association, labeling_task, label = tuple
-        source_id = None
-        if association.source_id is not None:
-            source_id = str(association.source_id)
-        statistics_request_body.append(
-            {
-                "record_id": str(association.record_id),
-                "source_id": source_id,
-                "source_type": association.source_type,
-                "confidence": association.confidence,
-                "label_id": str(label.id),
-            }
+    # the source list decides what is loaded, it is always read fresh.
+    # manual_df are the task's manual rows from loader.load_manual_labels,
+    # the cache keeps its own copy of them
+    task_info = metadata.get_task(project_id, labeling_task_id, refresh=True)
+    instrument.set_task_type(task_info.task_type)
+    if only_selected:
+        selected_source_ids = task_info.selected_source_ids
+    else:
+        selected_source_ids = task_info.source_ids
+    if manual_df is not None and not cache.CACHE_ENABLED:
+        df = loader.concat_frames(
+            [
+                loader.load_associations(
+                    project_id,
+                    labeling_task_id,
+                    task_info.task_type,
+                    selected_source_ids,
+                    include_manual=False,
+                    exclusion_ids=exclusion_ids,
+                ),
+                loader.exclude_records(manual_df, exclusion_ids),
+            ]
         )
-    return statistics_request_body
+        return task_info.task_type, df
+    df = cache.load_associations(
+        project_id,
+        labeling_task_id,
+        task_info.task_type,
+        task_info.source_ids,
+        selected_source_ids,
+        exclusion_ids,
+    )
+    return task_info.task_type, df
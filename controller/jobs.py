@@ -0,0 +1,140 @@
+import contextvars
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from . import admission
+from submodules.model.business_objects import general
+
+JOB_WORKERS = int(os.getenv("WS_JOB_WORKERS", "2"))
+MAX_QUEUED_JOBS = int(os.getenv("WS_MAX_QUEUED_JOBS", "32"))
+MAX_TRACKED_JOBS = 1000
+
+QUEUED = "QUEUED"
+RUNNING = "RUNNING"
+DONE = "DONE"
+ERROR = "ERROR"
+
+__executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="ws-job")
+__lock = threading.Lock()
+__admitted = threading.Condition(__lock)
+__jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+__accepting = True
+# jobs waiting for memory, they only reach the pool once admitted
+__awaiting_admission = 0
+
+
+def submit(
+    job_id: str,
+    fn: Callable,
+    *args: Any,
+    project_id: Optional[str] = None,
+    estimate: int = 0,
+) -> bool:
+    # False if the job can't be accepted (queue full or shutting down). Jobs of
+    # a project wait for estimate bytes of the admission budget first
+    global __awaiting_admission
+    with __lock:
+        if not __accepting or __open_jobs() >= MAX_QUEUED_JOBS + JOB_WORKERS:
+            return False
+        __jobs[job_id] = {"state": QUEUED, "queued_at": time.time()}
+        __jobs.move_to_end(job_id)
+        while len(__jobs) > MAX_TRACKED_JOBS:
+            oldest = next(iter(__jobs))
+            if __jobs[oldest]["state"] not in (DONE, ERROR):
+                break
+            __jobs.popitem(last=False)
+        if project_id is not None:
+            __awaiting_admission += 1
+    # the job sees the context of the submitting request (e.g. profiling)
+    context = contextvars.copy_context()
+    if project_id is None:
+        __executor.submit(context.run, __run, job_id, fn, args, None)
+    else:
+        admission.scheduler.enqueue(
+            project_id,
+            estimate,
+            lambda ticket: __start(context, job_id, fn, args, ticket),
+        )
+    return True
+
+
+def register(job_id: str) -> None:
+    # tracks a job that is queued outside of the pool (e.g. a coalesced rerun)
+    with __lock:
+        __jobs[job_id] = {"state": QUEUED, "queued_at": time.time()}
+        __jobs.move_to_end(job_id)
+
+
+def get_status(job_id: str) -> Optional[Dict[str, Any]]:
+    with __lock:
+        job = __jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+
+def get_counts() -> Dict[str, int]:
+    with __lock:
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, ERROR: 0}
+        for job in __jobs.values():
+            counts[job["state"]] += 1
+        return counts
+
+
+def set_state(job_id: str, state: str, **values: Any) -> None:
+    with __lock:
+        if job_id in __jobs:
+            __jobs[job_id].update(state=state, **values)
+
+
+def shutdown() -> None:
+    # stops accepting new jobs and waits for queued and running ones
+    global __accepting
+    with __lock:
+        __accepting = False
+        # admitted jobs still need the pool
+        __admitted.wait_for(lambda: __awaiting_admission == 0)
+    __executor.shutdown(wait=True)
+
+
+def __open_jobs() -> int:
+    return sum(1 for job in __jobs.values() if job["state"] in (QUEUED, RUNNING))
+
+
+def __start(
+    context: contextvars.Context,
+    job_id: str,
+    fn: Callable,
+    args: tuple,
+    ticket: admission.Ticket,
+) -> None:
+    global __awaiting_admission
+    __executor.submit(context.run, __run, job_id, fn, args, ticket)
+    with __lock:
+        __awaiting_admission -= 1
+        __admitted.notify_all()
+
+
+def __run(
+    job_id: str, fn: Callable, args: tuple, ticket: Optional[admission.Ticket]
+) -> None:
+    set_state(job_id, RUNNING, started_at=time.time())
+    session_token = general.get_ctx_token()
+    try:
+        fn(*args)
+        with __lock:
+            # the job may have reported its own final state already
+            if __jobs.get(job_id, {}).get("state") == RUNNING:
+                __jobs[job_id]["state"] = DONE
+            if job_id in __jobs:
+                __jobs[job_id]["finished_at"] = time.time()
+    except Exception:
+        print(traceback.format_exc(), flush=True)
+        set_state(job_id, ERROR, finished_at=time.time())
+    finally:
+        general.remove_and_refresh_session(session_token)
+        if ticket is not None:
+            admission.scheduler.release(ticket)
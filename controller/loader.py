@@ -0,0 +1,395 @@
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from sqlalchemy import text
+
+from . import instrument
+from submodules.model import enums
+from submodules.model.business_objects import general
+
+FETCH_CHUNK_SIZE = int(os.getenv("WS_FETCH_CHUNK_SIZE", "50000"))
+
+CLASSIFICATION_COLUMNS = [
+    "record_id",
+    "source_id",
+    "source_type",
+    "confidence",
+    "label_id",
+]
+EXTRACTION_COLUMNS = CLASSIFICATION_COLUMNS + ["token_index", "is_beginning_token"]
+
+# ids are dictionary encoded (categorical), the remaining columns get compact dtypes
+ENCODED_COLUMNS = ["record_id", "source_id", "source_type", "label_id"]
+COLUMN_DTYPES = {
+    "confidence": np.float32,
+    "token_index": np.int32,
+    "is_beginning_token": np.bool_,
+}
+
+__CLASSIFICATION_QUERY = """
+SELECT DISTINCT rla.record_id::TEXT, rla.source_id::TEXT, rla.source_type, rla.confidence, rla.labeling_task_label_id::TEXT
+FROM record_label_association rla
+INNER JOIN labeling_task_label ltl
+    ON rla.labeling_task_label_id = ltl.id AND rla.project_id = ltl.project_id
+WHERE rla.project_id = :project_id
+AND ltl.labeling_task_id = :labeling_task_id
+AND rla.source_id = ANY(CAST(:source_ids AS UUID[]))
+{record_filter}
+UNION ALL
+SELECT DISTINCT rla.record_id::TEXT, NULL::TEXT, rla.source_type, rla.confidence, rla.labeling_task_label_id::TEXT
+FROM record_label_association rla
+INNER JOIN labeling_task_label ltl
+    ON rla.labeling_task_label_id = ltl.id AND rla.project_id = ltl.project_id
+WHERE rla.project_id = :project_id
+AND ltl.labeling_task_id = :labeling_task_id
+AND rla.source_type = :manual_source_type
+AND rla.is_valid_manual_label
+AND :include_manual
+{record_filter}
+"""
+
+__EXTRACTION_QUERY = """
+SELECT DISTINCT rla.record_id::TEXT, rla.source_id::TEXT, rla.source_type, rla.confidence, rla.labeling_task_label_id::TEXT, rlat.token_index, rlat.is_beginning_token
+FROM record_label_association rla
+INNER JOIN labeling_task_label ltl
+    ON rla.labeling_task_label_id = ltl.id AND rla.project_id = ltl.project_id
+INNER JOIN record_label_association_token rlat
+    ON rlat.record_label_association_id = rla.id AND rlat.project_id = rla.project_id
+WHERE rla.project_id = :project_id
+AND ltl.labeling_task_id = :labeling_task_id
+AND rla.source_id = ANY(CAST(:source_ids AS UUID[]))
+{record_filter}
+UNION ALL
+SELECT DISTINCT rla.record_id::TEXT, NULL::TEXT, rla.source_type, rla.confidence, rla.labeling_task_label_id::TEXT, rlat.token_index, rlat.is_beginning_token
+FROM record_label_association rla
+INNER JOIN labeling_task_label ltl
+    ON rla.labeling_task_label_id = ltl.id AND rla.project_id = ltl.project_id
+INNER JOIN record_label_association_token rlat
+    ON rlat.record_label_association_id = rla.id AND rlat.project_id = rla.project_id
+WHERE rla.project_id = :project_id
+AND ltl.labeling_task_id = :labeling_task_id
+AND rla.source_type = :manual_source_type
+AND rla.is_valid_manual_label
+AND :include_manual
+{record_filter}
+"""
+
+__MANUAL_LABELS_QUERY = """
+SELECT DISTINCT ltl.labeling_task_id::TEXT, rla.record_id::TEXT, NULL::TEXT, rla.source_type, rla.confidence, rla.labeling_task_label_id::TEXT{token_columns}
+FROM record_label_association rla
+INNER JOIN labeling_task_label ltl
+    ON rla.labeling_task_label_id = ltl.id AND rla.project_id = ltl.project_id
+{token_join}
+WHERE rla.project_id = :project_id
+AND ltl.labeling_task_id = ANY(CAST(:labeling_task_ids AS UUID[]))
+AND rla.source_type = :manual_source_type
+AND rla.is_valid_manual_label
+"""
+
+__RECORD_RANGE_FILTER = """
+AND rla.record_id >= CAST(:record_from AS UUID)
+AND (CAST(:record_to AS UUID) IS NULL OR rla.record_id < CAST(:record_to AS UUID))
+"""
+
+__EXCLUDED_RECORDS_FILTER = """
+AND NOT rla.record_id = ANY(CAST(:exclusion_ids AS UUID[]))
+"""
+
+__LABELED_RECORDS_FILTER = """
+AND rla.record_id IN (
+    SELECT mrla.record_id
+    FROM record_label_association mrla
+    INNER JOIN labeling_task_label mltl
+        ON mrla.labeling_task_label_id = mltl.id AND mrla.project_id = mltl.project_id
+    WHERE mrla.project_id = :project_id
+    AND mltl.labeling_task_id = :labeling_task_id
+    AND mrla.source_type = :manual_source_type
+    AND mrla.is_valid_manual_label
+)
+"""
+
+# first record id of every shard, in uuid order
+__RECORD_SHARD_QUERY = """
+SELECT record_id::TEXT
+FROM (
+    SELECT record_id, ROW_NUMBER() OVER (ORDER BY record_id) AS position
+    FROM (
+        SELECT DISTINCT rla.record_id
+        FROM record_label_association rla
+        INNER JOIN labeling_task_label ltl
+            ON rla.labeling_task_label_id = ltl.id AND rla.project_id = ltl.project_id
+        WHERE rla.project_id = :project_id
+        AND ltl.labeling_task_id = :labeling_task_id
+        AND (
+            rla.source_id = ANY(CAST(:source_ids AS UUID[]))
+            OR (rla.source_type = :manual_source_type AND rla.is_valid_manual_label)
+        )
+    ) records
+) numbered
+WHERE position % :shard_size = 1
+ORDER BY record_id
+"""
+
+# the manual labels are edited in place (e.g. is_valid_manual_label flips on
+# gold star or majority changes), their version includes a checksum over the
+# valid associations and their labels
+__SOURCE_VERSION_QUERY = """
+SELECT rla.source_id::TEXT, COUNT(*), MAX(rla.created_at)::TEXT, SUM(
+    CASE WHEN rla.source_type = :manual_source_type
+    THEN hashtext(rla.id::TEXT || ':' || rla.labeling_task_label_id::TEXT)
+    END
+)::TEXT
+FROM record_label_association rla
+INNER JOIN labeling_task_label ltl
+    ON rla.labeling_task_label_id = ltl.id AND rla.project_id = ltl.project_id
+WHERE rla.project_id = :project_id
+AND ltl.labeling_task_id = :labeling_task_id
+AND (
+    rla.source_id = ANY(CAST(:source_ids AS UUID[]))
+    OR (rla.source_type = :manual_source_type AND rla.is_valid_manual_label)
+)
+GROUP BY rla.source_id
+"""
+
+
+__ROW_COUNT_QUERY = """
+SELECT COUNT(*)
+FROM record_label_association rla
+INNER JOIN labeling_task_label ltl
+    ON rla.labeling_task_label_id = ltl.id AND rla.project_id = ltl.project_id
+{token_join}
+WHERE rla.project_id = :project_id
+AND ltl.labeling_task_id = :labeling_task_id
+AND (
+    rla.source_id = ANY(CAST(:source_ids AS UUID[]))
+    OR (rla.source_type = :manual_source_type AND rla.is_valid_manual_label)
+)
+"""
+
+
+__TOKEN_JOIN = """
+INNER JOIN record_label_association_token rlat
+    ON rlat.record_label_association_id = rla.id AND rlat.project_id = rla.project_id
+"""
+
+@instrument.timed("load_associations")
+def load_associations(
+    project_id: str,
+    labeling_task_id: str,
+    task_type: str,
+    source_ids: Sequence[str],
+    include_manual: bool = True,
+    record_range: Optional[Tuple[str, Optional[str]]] = None,
+    labeled_only: bool = False,
+    exclusion_ids: Optional[Sequence[str]] = None,
+) -> pd.DataFrame:
+    # record_range (first id, exclusive end or None) restricts the rows to one
+    # shard, labeled_only to records with a valid manual label of the task.
+    # Rows of the excluded records and duplicates are dropped by the query
+    if task_type == enums.LabelingTaskType.CLASSIFICATION.value:
+        query, columns = __CLASSIFICATION_QUERY, CLASSIFICATION_COLUMNS
+    elif task_type == enums.LabelingTaskType.INFORMATION_EXTRACTION.value:
+        query, columns = __EXTRACTION_QUERY, EXTRACTION_COLUMNS
+    else:
+        raise ValueError(f"Task type {task_type} not implemented")
+
+    params = {
+        "project_id": project_id,
+        "labeling_task_id": labeling_task_id,
+        "source_ids": list(source_ids),
+        "manual_source_type": enums.LabelSource.MANUAL.value,
+        "include_manual": include_manual,
+    }
+    record_filter = ""
+    if record_range is not None:
+        record_filter += __RECORD_RANGE_FILTER
+        params["record_from"], params["record_to"] = record_range
+    if labeled_only:
+        record_filter += __LABELED_RECORDS_FILTER
+    if exclusion_ids:
+        record_filter += __EXCLUDED_RECORDS_FILTER
+        params["exclusion_ids"] = list(exclusion_ids)
+    query = query.format(record_filter=record_filter)
+    return build_frame(__stream_rows(query, params), columns)
+
+
+def load_manual_labels(
+    project_id: str, task_types: Dict[str, str]
+) -> Dict[str, pd.DataFrame]:
+    # {labeling_task_id: task_type} to the manual rows load_associations returns
+    # for each task, one query per task type instead of one per task
+    manual_dfs = {}
+    for task_type in set(task_types.values()):
+        if task_type == enums.LabelingTaskType.CLASSIFICATION.value:
+            columns, token_columns, token_join = CLASSIFICATION_COLUMNS, "", ""
+        elif task_type == enums.LabelingTaskType.INFORMATION_EXTRACTION.value:
+            columns = EXTRACTION_COLUMNS
+            token_columns = ", rlat.token_index, rlat.is_beginning_token"
+            token_join = __TOKEN_JOIN
+        else:
+            raise ValueError(f"Task type {task_type} not implemented")
+        labeling_task_ids = [
+            labeling_task_id
+            for labeling_task_id, other_type in task_types.items()
+            if other_type == task_type
+        ]
+        params = {
+            "project_id": project_id,
+            "labeling_task_ids": labeling_task_ids,
+            "manual_source_type": enums.LabelSource.MANUAL.value,
+        }
+        query = __MANUAL_LABELS_QUERY.format(
+            token_columns=token_columns, token_join=token_join
+        )
+        rows_by_task = {labeling_task_id: [] for labeling_task_id in labeling_task_ids}
+        for rows in __stream_rows(query, params):
+            for row in rows:
+                rows_by_task[row[0]].append(row[1:])
+        for labeling_task_id, rows in rows_by_task.items():
+            manual_dfs[labeling_task_id] = build_frame(iter([rows]), columns)
+    return manual_dfs
+
+
+def get_record_shards(
+    project_id: str, labeling_task_id: str, source_ids: Sequence[str], shard_size: int
+) -> List[Tuple[str, Optional[str]]]:
+    # consecutive record id ranges with at most shard_size records each
+    params = {
+        "project_id": project_id,
+        "labeling_task_id": labeling_task_id,
+        "source_ids": list(source_ids),
+        "manual_source_type": enums.LabelSource.MANUAL.value,
+        "shard_size": shard_size,
+    }
+    statement = text(__RECORD_SHARD_QUERY)
+    starts = [record_id for (record_id,) in general.execute_all(statement, params)]
+    return list(zip(starts, starts[1:] + [None]))
+
+
+def get_source_versions(
+    project_id: str, labeling_task_id: str, source_ids: Sequence[str]
+) -> Dict[str, str]:
+    # cheap fingerprint per source (and for the manual labels under None)
+    params = {
+        "project_id": project_id,
+        "labeling_task_id": labeling_task_id,
+        "source_ids": list(source_ids),
+        "manual_source_type": enums.LabelSource.MANUAL.value,
+    }
+    statement = text(__SOURCE_VERSION_QUERY)
+    return {
+        source_id: f"{count}:{last_created_at}:{checksum or ''}"
+        for source_id, count, last_created_at, checksum in general.execute_all(
+            statement, params
+        )
+    }
+
+
+def count_rows(
+    project_id: str, labeling_task_id: str, task_type: str, source_ids: Sequence[str]
+) -> int:
+    # rows load_associations would return, without loading them. Extraction
+    # tasks have one row per token
+    token_join = ""
+    if task_type == enums.LabelingTaskType.INFORMATION_EXTRACTION.value:
+        token_join = __TOKEN_JOIN
+    params = {
+        "project_id": project_id,
+        "labeling_task_id": labeling_task_id,
+        "source_ids": list(source_ids),
+        "manual_source_type": enums.LabelSource.MANUAL.value,
+    }
+    statement = text(__ROW_COUNT_QUERY.format(token_join=token_join))
+    return int(general.execute_first(statement, params)[0] or 0)
+
+
+def exclude_records(
+    df: pd.DataFrame, exclusion_ids: Optional[Iterable[str]]
+) -> pd.DataFrame:
+    # for frames that were loaded without the exclusions, e.g. cached ones.
+    # Compares the dictionary codes instead of the id strings
+    if not exclusion_ids or len(df.index) == 0:
+        return df
+    record_ids = df["record_id"].array
+    excluded_codes = record_ids.categories.get_indexer(list(exclusion_ids))
+    excluded_codes = excluded_codes[excluded_codes >= 0]
+    if len(excluded_codes) == 0:
+        return df
+    return df.loc[~np.isin(record_ids.codes, excluded_codes)]
+
+
+def concat_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    # concatenation that keeps the id columns dictionary encoded
+    if len(frames) == 1:
+        return frames[0]
+    data = {}
+    for column in frames[0].columns:
+        if column in ENCODED_COLUMNS:
+            data[column] = union_categoricals(
+                [frame[column].array for frame in frames], ignore_order=True
+            )
+        else:
+            data[column] = np.concatenate(
+                [frame[column].to_numpy() for frame in frames]
+            )
+    return pd.DataFrame(data, columns=frames[0].columns)
+
+
+def build_frame(chunks: Iterator[List[Any]], columns: List[str]) -> pd.DataFrame:
+    lookups = {column: {} for column in columns if column in ENCODED_COLUMNS}
+    parts = {column: [] for column in columns}
+    for rows in chunks:
+        if not rows:
+            continue
+        for column, values in zip(columns, zip(*rows)):
+            if column in lookups:
+                parts[column].append(__encode(values, lookups[column]))
+            else:
+                parts[column].append(np.asarray(values, dtype=COLUMN_DTYPES[column]))
+
+    data = {}
+    for column in columns:
+        if column in lookups:
+            codes = (
+                np.concatenate(parts[column])
+                if parts[column]
+                else np.empty(0, dtype=np.int32)
+            )
+            data[column] = pd.Categorical.from_codes(
+                codes, categories=pd.Index(list(lookups[column]), dtype=object)
+            )
+        else:
+            dtype = COLUMN_DTYPES[column]
+            data[column] = (
+                np.concatenate(parts[column])
+                if parts[column]
+                else np.empty(0, dtype=dtype)
+            )
+    # duplicates are already dropped by the queries
+    return pd.DataFrame(data, columns=columns)
+
+
+def __encode(values: Sequence[Any], lookup: Dict[Any, int]) -> np.ndarray:
+    # maps the chunk onto the shared lookup, missing values (manual source) become -1
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    if len(uniques) == 0:
+        return np.full(len(codes), -1, dtype=np.int32)
+    unique_codes = np.fromiter(
+        (lookup.setdefault(value, len(lookup)) for value in uniques),
+        dtype=np.int32,
+        count=len(uniques),
+    )
+    return np.where(codes >= 0, unique_codes[codes], -1).astype(np.int32)
+
+
+def __stream_rows(query: str, params: Dict[str, Any]) -> Iterator[List[Any]]:
+    # server-side cursor, rows are only transferred chunk by chunk
+    statement = text(query).execution_options(stream_results=True)
+    result = general.execute(statement, params)
+    try:
+        for rows in result.partitions(FETCH_CHUNK_SIZE):
+            yield rows
+    finally:
+        result.close()
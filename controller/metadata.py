@@ -0,0 +1,243 @@
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+)
+from submodules.model.business_objects import (
+    information_source,
+    labeling_task,
+    labeling_task_label,
+    project,
+    user,
+)
+from submodules.model.business_objects.organization import get_organization_id
+
+METADATA_CACHE_ENABLED = os.getenv("WS_METADATA_CACHE", "true").lower() == "true"
+METADATA_TTL_SECONDS = float(os.getenv("WS_METADATA_TTL_SECONDS", "30"))
+METADATA_MAX_ENTRIES = int(os.getenv("WS_METADATA_MAX_ENTRIES", "4096"))
+
+
+class TaskInfo(NamedTuple):
+    # plain values of a labeling task, ORM objects don't outlive their session
+    id: str
+    project_id: str
+    task_type: str
+    source_ids: List[str]
+    selected_source_ids: List[str]
+
+
+class TtlCache:
+    # Small in-process cache with a time to live per entry. Every entry is
+    # tagged with the ids it depends on (project, task, source or user ids) so
+    # it can be invalidated explicitly when the underlying rows change.
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.__lock = threading.Lock()
+        self.__ttl_seconds = ttl_seconds
+        self.__max_entries = max_entries
+        self.__entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.__counters: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {"hits": 0, "misses": 0, "invalidations": 0}
+        )
+
+    def get(
+        self,
+        key: tuple,
+        load: Callable[[], Any],
+        tags: Callable[[Any], Iterable[str]],
+        refresh: bool = False,
+    ) -> Any:
+        # key[0] names the lookup for the counters, refresh skips a cached value
+        # and tags get the loaded value
+        now = time.monotonic()
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and not refresh and entry[0] > now:
+                self.__entries.move_to_end(key)
+                self.__counters[key[0]]["hits"] += 1
+                return entry[1]
+            self.__counters[key[0]]["misses"] += 1
+
+        value = load()
+        if self.__ttl_seconds <= 0:
+            return value
+        with self.__lock:
+            self.__entries[key] = (
+                now + self.__ttl_seconds,
+                value,
+                frozenset(tags(value)),
+            )
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__max_entries:
+                self.__entries.popitem(last=False)
+        return value
+
+    def invalidate(self, *tags: Optional[str]) -> int:
+        # drops every entry tagged with any of the given ids, all without ids
+        wanted = {tag for tag in tags if tag}
+        with self.__lock:
+            keys = [
+                key
+                for key, (_, _, entry_tags) in self.__entries.items()
+                if not wanted or entry_tags & wanted
+            ]
+            for key in keys:
+                del self.__entries[key]
+                self.__counters[key[0]]["invalidations"] += 1
+        return len(keys)
+
+    def get_counters(self) -> Dict[str, Dict[str, int]]:
+        with self.__lock:
+            return {
+                lookup: dict(counters) for lookup, counters in self.__counters.items()
+            }
+
+
+entries = TtlCache(
+    METADATA_TTL_SECONDS if METADATA_CACHE_ENABLED else 0, METADATA_MAX_ENTRIES
+)
+
+
+def get_task(
+    project_id: str, labeling_task_id: str, refresh: bool = False
+) -> TaskInfo:
+    return entries.get(
+        ("task", project_id, labeling_task_id),
+        lambda: __to_task_info(labeling_task.get(project_id, labeling_task_id)),
+        __task_tags,
+        refresh,
+    )
+
+
+def get_tasks(project_id: str) -> List[TaskInfo]:
+    # all tasks of the project in one query, also answers get_task for them
+    task_infos = entries.get(
+        ("tasks", project_id),
+        lambda: [__to_task_info(item) for item in labeling_task.get_all(project_id)],
+        lambda task_infos: [
+            project_id,
+            *(tag for task_info in task_infos for tag in __task_tags(task_info)),
+        ],
+    )
+    for task_info in task_infos:
+        entries.get(
+            ("task", project_id, task_info.id), lambda: task_info, __task_tags
+        )
+    return task_infos
+
+
+def get_task_by_id(labeling_task_id: str) -> TaskInfo:
+    return entries.get(
+        ("task_by_id", labeling_task_id),
+        lambda: __to_task_info(
+            labeling_task.get_labeling_task_by_id_only(labeling_task_id)
+        ),
+        __task_tags,
+    )
+
+
+def get_task_by_source(source_id: str) -> TaskInfo:
+    task_info = entries.get(
+        ("task_by_source", source_id),
+        lambda: __to_task_info(labeling_task.get_labeling_task_by_source_id(source_id)),
+        lambda task_info: [source_id, *__task_tags(task_info)],
+    )
+    # the task entry may be older than the source, its source list is reloaded
+    # then instead of loading the task without the source
+    task_info = get_task(task_info.project_id, task_info.id)
+    if source_id not in task_info.source_ids:
+        task_info = get_task(task_info.project_id, task_info.id, refresh=True)
+    return task_info
+
+
+def get_label_ids(
+    project_id: str, labeling_task_id: str, refresh: bool = False
+) -> List[str]:
+    return entries.get(
+        ("label_ids", project_id, labeling_task_id),
+        lambda: [
+            str(label_id)
+            for (label_id,) in labeling_task_label.get_all_ids(
+                project_id, labeling_task_id
+            )
+        ],
+        lambda _: [project_id, labeling_task_id],
+        refresh,
+    )
+
+
+def get_source_ids(
+    project_id: str, labeling_task_id: str, refresh: bool = False
+) -> List[str]:
+    return entries.get(
+        ("source_ids", project_id, labeling_task_id),
+        lambda: [
+            str(source_id)
+            for source_id in information_source.get_all_ids_by_labeling_task_id(
+                project_id, labeling_task_id
+            )
+        ],
+        lambda source_ids: [project_id, labeling_task_id, *source_ids],
+        refresh,
+    )
+
+
+def get_user_role(user_id: str) -> Optional[str]:
+    return entries.get(
+        ("user_role", user_id), lambda: user.get(user_id).role, lambda _: [user_id]
+    )
+
+
+def get_user_organization_id(project_id: str, user_id: str) -> Optional[str]:
+    return entries.get(
+        ("user_organization", project_id, user_id),
+        lambda: get_organization_id(project_id, user_id),
+        lambda _: [project_id, user_id],
+    )
+
+
+def get_project_organization_id(project_id: str) -> str:
+    return entries.get(
+        ("project_organization", project_id),
+        lambda: str(project.get(project_id).organization_id),
+        lambda _: [project_id],
+    )
+
+
+def invalidate(
+    project_id: Optional[str] = None,
+    labeling_task_id: Optional[str] = None,
+    source_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+) -> int:
+    # the most specific ids win, nothing given clears the whole cache
+    if labeling_task_id or source_id or user_id:
+        return entries.invalidate(labeling_task_id, source_id, user_id)
+    return entries.invalidate(project_id)
+
+
+def get_counters() -> Dict[str, Dict[str, int]]:
+    return entries.get_counters()
+
+
+def __task_tags(task_info: TaskInfo) -> List[str]:
+    return [task_info.project_id, task_info.id, *task_info.source_ids]
+
+
+def __to_task_info(labeling_task_item: Any) -> TaskInfo:
+    information_sources = list(labeling_task_item.information_sources)
+    return TaskInfo(
+        str(labeling_task_item.id),
+        str(labeling_task_item.project_id),
+        labeling_task_item.task_type,
+        [str(item.id) for item in information_sources],
+        [str(item.id) for item in information_sources if item.is_selected],
+    )
@@ -0,0 +1,311 @@
+import os
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+import weak_nlp
+
+from . import compute, instrument, util
+
+# "numpy" computes the statistics from the association frame, "weak_nlp"
+# builds the weak_nlp model for them. tests/test_metrics_parity.py compares
+# the two on randomized tasks
+METRICS_ENGINE = os.getenv("WS_METRICS_ENGINE", "numpy")
+
+QUALITY_KEYS = ["true_positives", "false_positives", "false_negatives"]
+QUANTITY_KEYS = ["record_coverage", "source_conflicts", "source_overlaps", "total_hits"]
+
+
+def uses_numpy() -> bool:
+    return METRICS_ENGINE == "numpy"
+
+
+def run(df: pd.DataFrame, model_type: str, operation: str) -> pd.DataFrame:
+    with instrument.phase(f"numpy_{operation}") as observed:
+        metrics_df = __run(df, model_type, operation)
+        observed["frame"] = metrics_df
+        return metrics_df
+
+
+def __run(df: pd.DataFrame, model_type: str, operation: str) -> pd.DataFrame:
+    # frames with the identifier/label_name layout of the weak_nlp metrics
+    if operation not in (compute.QUALITY_METRICS, compute.QUANTITY_METRICS):
+        raise ValueError(f"Unknown operation {operation}")
+    if model_type == compute.CLASSIFICATION:
+        if operation == compute.QUALITY_METRICS:
+            return classification_quality(df)
+        return classification_quantity(df)
+
+    spans = __spans(df)
+    if not spans["is_beginning"].all():
+        # weak_nlp gets no start for the span of a group without a beginning
+        # token, such tasks are left to it
+        print("Extraction spans without a beginning token, using weak_nlp", flush=True)
+        instrument.weak_nlp_fallbacks.inc({"engine": "metrics"})
+        return compute.run(df, model_type, operation)
+    if operation == compute.QUALITY_METRICS:
+        return extraction_quality(df, spans)
+    return extraction_quantity(df, spans)
+
+
+def to_statistics(
+    metrics_df: pd.DataFrame, columns: Dict[str, Optional[str]]
+) -> Dict[str, Dict[str, Dict[str, int]]]:
+    # {source: {label: {key: value}}} of the first row per (source, label),
+    # columns maps the keys to metrics frame columns (None for a constant 0)
+    with instrument.phase("statistics") as observed:
+        observed["rows"] = len(metrics_df)
+        return __to_statistics(metrics_df, columns)
+
+
+def __to_statistics(
+    metrics_df: pd.DataFrame, columns: Dict[str, Optional[str]]
+) -> Dict[str, Dict[str, Dict[str, int]]]:
+    if len(metrics_df) == 0:
+        return {}
+    rows = metrics_df.drop_duplicates(["identifier", "label_name"]).sort_values(
+        ["identifier", "label_name"], kind="stable"
+    )
+    values = [
+        rows[column].to_numpy(dtype=np.int64).tolist()
+        if column is not None
+        else [0] * len(rows)
+        for column in columns.values()
+    ]
+    statistics = {}
+    for source_id, label_id, *row in zip(
+        rows["identifier"].tolist(), rows["label_name"].tolist(), *values
+    ):
+        statistics.setdefault(source_id, {})[label_id] = dict(zip(columns, row))
+    return statistics
+
+
+def classification_quality(df: pd.DataFrame) -> pd.DataFrame:
+    # a hit on a manually labeled record is a true positive if the record has
+    # that manual label, otherwise a false positive
+    hits, reference = __split(df, ["record_id", "label_id"])
+    hits = hits.merge(
+        reference[["record_id"]].drop_duplicates(), on="record_id", how="inner"
+    )
+    matched = hits.merge(
+        reference.assign(is_match=True), on=["record_id", "label_id"], how="left"
+    )["is_match"].fillna(False).astype(bool)
+    return __quality_frame(hits, matched.to_numpy(), None)
+
+
+def extraction_quality(
+    df: pd.DataFrame, spans: Optional[pd.DataFrame] = None
+) -> pd.DataFrame:
+    # spans on manually labeled records, a true positive matches a manual span
+    # exactly, manual spans the heuristic misses are its false negatives
+    if spans is None:
+        spans = __spans(df)
+    hits, reference = __split(spans, ["record_id", "label_id", "start", "end"])
+    hits = hits.merge(
+        reference[["record_id"]].drop_duplicates(), on="record_id", how="inner"
+    )
+    matched = hits.merge(
+        reference.assign(is_match=True),
+        on=["record_id", "label_id", "start", "end"],
+        how="left",
+    )["is_match"].fillna(False).astype(bool)
+    reference_counts = reference.groupby("label_id").size()
+    return __quality_frame(hits, matched.to_numpy(), reference_counts)
+
+
+def classification_quantity(df: pd.DataFrame) -> pd.DataFrame:
+    hits = pd.DataFrame(
+        {
+            column: df.loc[df["source_id"].notna(), column].to_numpy(dtype=object)
+            for column in ["record_id", "source_id", "label_id"]
+        }
+    )
+    return __quantity_frame(classification_quantity_counts(hits))
+
+
+def classification_quantity_counts(hits: pd.DataFrame) -> pd.DataFrame:
+    # per (source, label): records hit, records where another heuristic hits as
+    # well (overlap) and records where another heuristic hits another label (conflict)
+    hits = hits.drop_duplicates()
+    by_record = hits.groupby("record_id")
+    sources_on_record = by_record["source_id"].transform("nunique")
+    pairs_on_record = by_record["source_id"].transform("size")
+    pairs_of_source = hits.groupby(["record_id", "source_id"])["label_id"].transform(
+        "size"
+    )
+    pairs_of_label = hits.groupby(["record_id", "label_id"])["source_id"].transform(
+        "size"
+    )
+    counts = pd.DataFrame(
+        {
+            "source_id": hits["source_id"],
+            "label_id": hits["label_id"],
+            "record_coverage": 1,
+            "source_conflicts": (
+                pairs_on_record - pairs_of_source - pairs_of_label + 1 > 0
+            ).astype(int),
+            "source_overlaps": (sources_on_record > 1).astype(int),
+            "total_hits": 1,
+        }
+    )
+    return counts.groupby(["source_id", "label_id"])[QUANTITY_KEYS].sum()
+
+
+def extraction_quantity(
+    df: pd.DataFrame, spans: Optional[pd.DataFrame] = None
+) -> pd.DataFrame:
+    # per (source, label): records hit, spans, and spans sharing a token with a
+    # span of another heuristic (overlap) or with one of another label (conflict)
+    if spans is None:
+        spans = __spans(df)
+    spans = spans.loc[spans["source_id"] != util.MANUAL_SOURCE_ID].reset_index(
+        drop=True
+    )
+    if len(spans) == 0:
+        return __quantity_frame(pd.DataFrame())
+
+    starts = spans["start"].to_numpy(dtype=np.int64)
+    lengths = np.maximum(spans["end"].to_numpy(dtype=np.int64) - starts + 1, 1)
+    span_positions = np.repeat(np.arange(len(spans)), lengths)
+    tokens = pd.DataFrame(
+        {
+            "span": span_positions,
+            "record_id": spans["record_id"].to_numpy(dtype=object)[span_positions],
+            "token": np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+            + np.arange(lengths.sum()),
+            "source_id": spans["source_id"].to_numpy(dtype=object)[span_positions],
+            "label_id": spans["label_id"].to_numpy(dtype=object)[span_positions],
+        }
+    )
+    cells = tokens.drop_duplicates(["record_id", "token", "source_id", "label_id"])
+    by_token = cells.groupby(["record_id", "token"])
+    cell_stats = pd.DataFrame(
+        {
+            "record_id": cells["record_id"],
+            "token": cells["token"],
+            "source_id": cells["source_id"],
+            "label_id": cells["label_id"],
+            "sources": by_token["source_id"].transform("nunique"),
+            "pairs": by_token["source_id"].transform("size"),
+            "pairs_of_source": cells.groupby(["record_id", "token", "source_id"])[
+                "label_id"
+            ].transform("size"),
+            "pairs_of_label": cells.groupby(["record_id", "token", "label_id"])[
+                "source_id"
+            ].transform("size"),
+        }
+    )
+    tokens = tokens.merge(
+        cell_stats, on=["record_id", "token", "source_id", "label_id"], how="left"
+    )
+    token_overlaps = (tokens["sources"] > 1).to_numpy(dtype=np.float64)
+    token_conflicts = (
+        tokens["pairs"] - tokens["pairs_of_source"] - tokens["pairs_of_label"] + 1 > 0
+    ).to_numpy(dtype=np.float64)
+    is_overlap = np.bincount(
+        tokens["span"], weights=token_overlaps, minlength=len(spans)
+    )
+    is_conflict = np.bincount(
+        tokens["span"], weights=token_conflicts, minlength=len(spans)
+    )
+    counts = pd.DataFrame(
+        {
+            "source_id": spans["source_id"],
+            "label_id": spans["label_id"],
+            "source_conflicts": (is_conflict > 0).astype(int),
+            "source_overlaps": (is_overlap > 0).astype(int),
+            "total_hits": 1,
+        }
+    ).groupby(["source_id", "label_id"])[
+        ["source_conflicts", "source_overlaps", "total_hits"]
+    ].sum()
+    counts["record_coverage"] = spans.groupby(["source_id", "label_id"])[
+        "record_id"
+    ].nunique()
+    return __quantity_frame(counts[QUANTITY_KEYS])
+
+
+def __split(
+    df: pd.DataFrame, reference_columns: List[str]
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    # heuristic rows and the distinct manual reference, raises like weak_nlp
+    # if nothing is labeled
+    is_manual = df["source_id"].isna() | (df["source_id"] == util.MANUAL_SOURCE_ID)
+    if not is_manual.any():
+        raise weak_nlp.shared.exceptions.MissingReferenceException(
+            "No manually labeled records"
+        )
+    hits = pd.DataFrame(
+        {
+            column: df.loc[~is_manual, column].to_numpy(dtype=object)
+            for column in ["source_id"] + reference_columns
+        }
+    ).drop_duplicates()
+    reference = pd.DataFrame(
+        {
+            column: df.loc[is_manual, column].to_numpy(dtype=object)
+            for column in reference_columns
+        }
+    ).drop_duplicates()
+    return hits, reference
+
+
+def __spans(df: pd.DataFrame) -> pd.DataFrame:
+    if len(df.index) == 0:
+        return pd.DataFrame(
+            columns=[
+                "source_id",
+                "record_id",
+                "label_id",
+                "start",
+                "end",
+                "is_beginning",
+            ]
+        )
+    spans = util.get_extraction_spans(df)
+    return pd.DataFrame(
+        {
+            "source_id": spans["source_ids"][spans["source_codes"]],
+            "record_id": spans["record_ids"][spans["record_codes"]],
+            "label_id": spans["label_ids"][spans["label_codes"]],
+            "start": spans["starts"],
+            "end": spans["ends"],
+            "is_beginning": spans["is_beginning"],
+        }
+    )
+
+
+def __quality_frame(
+    hits: pd.DataFrame, matched: np.ndarray, reference_counts: Optional[pd.Series]
+) -> pd.DataFrame:
+    counts = (
+        pd.DataFrame(
+            {
+                "identifier": hits["source_id"].to_numpy(dtype=object),
+                "label_name": hits["label_id"].to_numpy(dtype=object),
+                "true_positives": matched.astype(np.int64),
+                "false_positives": (~matched).astype(np.int64),
+            }
+        )
+        .groupby(["identifier", "label_name"], as_index=False)
+        .sum()
+    )
+    if reference_counts is None:
+        counts["false_negatives"] = 0
+    else:
+        counts["false_negatives"] = (
+            counts["label_name"].map(reference_counts).fillna(0).astype(np.int64)
+            - counts["true_positives"]
+        )
+    found = counts["true_positives"] + counts["false_positives"]
+    counts["precision"] = np.where(
+        found > 0, counts["true_positives"] / found.where(found > 0, 1), 0.0
+    )
+    return counts
+
+
+def __quantity_frame(counts: pd.DataFrame) -> pd.DataFrame:
+    if len(counts) == 0:
+        return pd.DataFrame(columns=["identifier", "label_name"] + QUANTITY_KEYS)
+    frame = counts.reset_index()
+    frame.columns = ["identifier", "label_name"] + list(frame.columns[2:])
+    return frame
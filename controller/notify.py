@@ -0,0 +1,220 @@
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import instrument
+
+NOTIFY_ENDPOINT = os.getenv("WS_NOTIFY_ENDPOINT")
+NOTIFY_MAX_QUEUED = int(os.getenv("WS_NOTIFY_MAX_QUEUED", "1000"))
+NOTIFY_COALESCE_SECONDS = float(os.getenv("WS_NOTIFY_COALESCE_SECONDS", "1"))
+NOTIFY_TIMEOUT_SECONDS = float(os.getenv("WS_NOTIFY_TIMEOUT_SECONDS", "5"))
+NOTIFY_RETRIES = int(os.getenv("WS_NOTIFY_RETRIES", "3"))
+NOTIFY_BACKOFF_SECONDS = float(os.getenv("WS_NOTIFY_BACKOFF_SECONDS", "0.2"))
+
+latency_seconds = instrument.Histogram(
+    "ws_notify_latency_seconds",
+    "Time between a notification being queued and delivered or given up",
+    instrument.DURATION_BUCKETS,
+)
+
+
+class Dispatcher:
+    # Delivers websocket notifications from one background thread over a
+    # persistent session. send never blocks: identical messages within the
+    # coalescing window are sent once and messages are dropped if the queue is
+    # full. Failed deliveries are retried with exponential backoff.
+    def __init__(
+        self,
+        endpoint: Optional[str],
+        max_queued: int = NOTIFY_MAX_QUEUED,
+        coalesce_seconds: float = NOTIFY_COALESCE_SECONDS,
+        timeout_seconds: float = NOTIFY_TIMEOUT_SECONDS,
+        retries: int = NOTIFY_RETRIES,
+        backoff_seconds: float = NOTIFY_BACKOFF_SECONDS,
+    ):
+        self.endpoint = endpoint
+        self.__coalesce_seconds = coalesce_seconds
+        self.__timeout_seconds = timeout_seconds
+        self.__retries = retries
+        self.__backoff_seconds = backoff_seconds
+        self.__queue: "queue.Queue[Optional[Tuple[str, str, float]]]" = queue.Queue(
+            max_queued
+        )
+        self.__lock = threading.Lock()
+        self.__last_accepted: Dict[Tuple[str, str], float] = {}
+        self.__counters: Dict[str, float] = defaultdict(float)
+        self.__thread: Optional[threading.Thread] = None
+        self.__session: Optional[requests.Session] = None
+        self.__stopping = threading.Event()
+
+    def send(self, organization_id: str, message: str) -> bool:
+        # False if the message was coalesced or dropped
+        key = (organization_id, message)
+        now = time.monotonic()
+        with self.__lock:
+            last_accepted = self.__last_accepted.get(key)
+            if (
+                last_accepted is not None
+                and now - last_accepted < self.__coalesce_seconds
+            ):
+                self.__counters["coalesced"] += 1
+                return False
+            try:
+                self.__queue.put_nowait((organization_id, message, now))
+            except queue.Full:
+                self.__counters["dropped"] += 1
+                print("Notification queue full, dropping update", flush=True)
+                return False
+            self.__last_accepted[key] = now
+            self.__counters["queued"] += 1
+            self.__prune(now)
+            self.__start()
+        return True
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        # delivers what is queued, then stops the worker. With a full queue
+        # the worker stops after the current delivery and drops the rest
+        with self.__lock:
+            thread = self.__thread
+            self.__thread = None
+        if thread is None:
+            return
+        try:
+            self.__queue.put_nowait(None)
+        except queue.Full:
+            self.__stopping.set()
+        thread.join(timeout)
+
+    def get_counters(self) -> Dict[str, Any]:
+        with self.__lock:
+            counters = {
+                key: int(self.__counters[key])
+                for key in (
+                    "queued",
+                    "coalesced",
+                    "dropped",
+                    "sent",
+                    "failed",
+                    "retried",
+                )
+            }
+            counters["latency_seconds_sum"] = self.__counters["latency_seconds_sum"]
+            counters["latency_seconds_max"] = self.__counters["latency_seconds_max"]
+        counters["pending"] = self.__queue.qsize()
+        return counters
+
+    def __start(self) -> None:
+        if self.__thread is None:
+            self.__stopping.clear()
+            self.__session = requests.Session()
+            self.__session.mount("http://", HTTPAdapter(pool_maxsize=1))
+            self.__session.mount("https://", HTTPAdapter(pool_maxsize=1))
+            self.__thread = threading.Thread(
+                target=self.__work, name="ws-notify", daemon=True
+            )
+            self.__thread.start()
+
+    def __work(self) -> None:
+        session = self.__session
+        while True:
+            item = self.__queue.get()
+            if item is None or self.__stopping.is_set():
+                self.__drop_queued(item)
+                session.close()
+                return
+            organization_id, message, queued_at = item
+            delivered = self.__deliver(session, organization_id, message)
+            latency = time.monotonic() - queued_at
+            with self.__lock:
+                if delivered:
+                    self.__counters["sent"] += 1
+                else:
+                    self.__counters["failed"] += 1
+                self.__counters["latency_seconds_sum"] += latency
+                self.__counters["latency_seconds_max"] = max(
+                    self.__counters["latency_seconds_max"], latency
+                )
+            if instrument.INSTRUMENTATION_ENABLED:
+                latency_seconds.observe({}, latency)
+
+    def __drop_queued(self, item: Optional[Tuple[str, str, float]]) -> None:
+        # what is left after a shutdown, starting with the taken item
+        while True:
+            if item is not None:
+                with self.__lock:
+                    self.__counters["dropped"] += 1
+            try:
+                item = self.__queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def __deliver(
+        self, session: requests.Session, organization_id: str, message: str
+    ) -> bool:
+        for attempt in range(self.__retries + 1):
+            if attempt > 0:
+                with self.__lock:
+                    self.__counters["retried"] += 1
+                time.sleep(self.__backoff_seconds * 2 ** (attempt - 1))
+            try:
+                response = session.post(
+                    f"{self.endpoint}/notify",
+                    json={"organization": organization_id, "message": message},
+                    timeout=self.__timeout_seconds,
+                )
+            except requests.RequestException as e:
+                print(f"Notification attempt {attempt + 1} failed: {e}", flush=True)
+                continue
+            if response.status_code == 200:
+                return True
+            # client errors won't change on a retry
+            if response.status_code < 500:
+                break
+        print("Could not send notification update", flush=True)
+        return False
+
+    def __prune(self, now: float) -> None:
+        if len(self.__last_accepted) > 10 * self.__queue.maxsize:
+            self.__last_accepted = {
+                key: accepted_at
+                for key, accepted_at in self.__last_accepted.items()
+                if now - accepted_at < self.__coalesce_seconds
+            }
+
+
+class DispatcherCounters:
+    # delivery counters of the dispatcher, read when the metrics are rendered
+    COUNTERS = [
+        ("queued", "Notifications accepted for delivery"),
+        ("coalesced", "Notifications skipped as duplicates"),
+        ("dropped", "Notifications dropped because the queue was full"),
+        ("sent", "Notifications delivered"),
+        ("failed", "Notifications given up after all attempts"),
+        ("retried", "Repeated delivery attempts"),
+    ]
+    GAUGES = [("pending", "Notifications waiting in the queue")]
+
+    def __init__(self, dispatcher: Dispatcher):
+        self.dispatcher = dispatcher
+
+    def render(self) -> List[str]:
+        counters = self.dispatcher.get_counters()
+        lines = []
+        for name, help_text in self.COUNTERS:
+            lines.append(f"# HELP ws_notify_{name}_total {help_text}")
+            lines.append(f"# TYPE ws_notify_{name}_total counter")
+            lines.append(f"ws_notify_{name}_total {counters[name]}")
+        for name, help_text in self.GAUGES:
+            lines.append(f"# HELP ws_notify_{name} {help_text}")
+            lines.append(f"# TYPE ws_notify_{name} gauge")
+            lines.append(f"ws_notify_{name} {counters[name]}")
+        return lines
+
+
+dispatcher = Dispatcher(NOTIFY_ENDPOINT)
+instrument.METRICS.extend([latency_seconds, DispatcherCounters(dispatcher)])
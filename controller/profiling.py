@@ -0,0 +1,151 @@
+import contextvars
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+PROFILE_DIR = os.getenv("WS_PROFILE_DIR", "/inference/ws-profiles")
+# requests with this header set to a true value are profiled
+PROFILE_HEADER = "x-ws-profile"
+PROFILE_HEADER_ENABLED = os.getenv("WS_PROFILE_HEADER", "true").lower() == "true"
+TRACEMALLOC_FRAMES = int(os.getenv("WS_PROFILE_TRACEMALLOC_FRAMES", "10"))
+SUMMARY_LINES = 40
+
+ALL_PROJECTS = "*"
+
+__requested: contextvars.ContextVar[bool] = contextvars.ContextVar(
+    "ws_profile_requested", default=False
+)
+__lock = threading.Lock()
+# admin toggle: number of upcoming requests to profile per project
+__armed: Dict[str, int] = {}
+__tracing = 0
+__owns_trace = False
+
+
+def request_started(header_value: Optional[str]) -> Optional[contextvars.Token]:
+    if not PROFILE_HEADER_ENABLED or not header_value:
+        return None
+    if header_value.lower() not in ("1", "true", "yes"):
+        return None
+    return __requested.set(True)
+
+
+def request_finished(token: Optional[contextvars.Token]) -> None:
+    if token is not None:
+        __requested.reset(token)
+
+
+def arm(project_id: Optional[str], count: int) -> Dict[str, int]:
+    # profiles the next count requests of the project (of any without one)
+    with __lock:
+        key = project_id or ALL_PROJECTS
+        if count > 0:
+            __armed[key] = count
+        else:
+            __armed.pop(key, None)
+        return dict(__armed)
+
+
+def get_armed() -> Dict[str, int]:
+    with __lock:
+        return dict(__armed)
+
+
+@contextmanager
+def capture(project_id: str, task_id: Optional[str], name: str) -> Iterator[None]:
+    # CPU profile of the current thread plus an allocation snapshot, only if the
+    # request asked for it or profiling was armed for the project
+    if not __requested.get() and not (__armed and __take_armed(project_id)):
+        yield
+        return
+
+    __start_tracing()
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        duration = time.perf_counter() - start
+        snapshot = tracemalloc.take_snapshot()
+        __stop_tracing()
+        try:
+            path = __write(project_id, task_id, name, profiler, snapshot, duration)
+            print(f"Profile written to {path}", flush=True)
+        except OSError as e:
+            print(f"Could not write profile: {e}", flush=True)
+
+
+def __take_armed(project_id: str) -> bool:
+    with __lock:
+        for key in (project_id, ALL_PROJECTS):
+            if __armed.get(key, 0) > 0:
+                __armed[key] -= 1
+                if __armed[key] == 0:
+                    del __armed[key]
+                return True
+    return False
+
+
+def __start_tracing() -> None:
+    # tracemalloc is process wide, concurrent captures share one trace (and
+    # see each other's allocations). A trace started elsewhere is left running
+    global __tracing, __owns_trace
+    with __lock:
+        __tracing += 1
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            __owns_trace = True
+
+
+def __stop_tracing() -> None:
+    global __tracing, __owns_trace
+    with __lock:
+        __tracing -= 1
+        if __tracing == 0 and __owns_trace:
+            tracemalloc.stop()
+            __owns_trace = False
+
+
+def __write(
+    project_id: str,
+    task_id: Optional[str],
+    name: str,
+    profiler: cProfile.Profile,
+    snapshot: tracemalloc.Snapshot,
+    duration: float,
+) -> str:
+    directory = os.path.join(PROFILE_DIR, __safe(project_id))
+    os.makedirs(directory, exist_ok=True)
+    stamp = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    prefix = os.path.join(
+        directory, f"{__safe(task_id or 'none')}-{__safe(name)}-{stamp}"
+    )
+    # load with pstats.Stats and tracemalloc.Snapshot.load
+    profiler.dump_stats(f"{prefix}.prof")
+    snapshot.dump(f"{prefix}.tracemalloc")
+
+    summary = io.StringIO()
+    summary.write(f"{name} project={project_id} task={task_id} {duration:.3f}s\n\n")
+    pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(
+        SUMMARY_LINES
+    )
+    summary.write("allocations by line\n")
+    for statistic in snapshot.statistics("lineno")[:SUMMARY_LINES]:
+        summary.write(f"{statistic}\n")
+    with open(f"{prefix}.txt", "w") as f:
+        f.write(summary.getvalue())
+    return prefix
+
+
+def __safe(value: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", str(value))
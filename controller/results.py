@@ -0,0 +1,111 @@
+from typing import Any, Dict, List, Optional
+import numpy as np
+import pandas as pd
+
+
+class IntegrationResults:
+    # output of the numpy engines as parallel arrays, token bounds are only set
+    # for extraction tasks
+    def __init__(
+        self,
+        record_ids: np.ndarray,
+        label_ids: pd.Categorical,
+        confidences: np.ndarray,
+        token_starts: Optional[np.ndarray] = None,
+        token_ends: Optional[np.ndarray] = None,
+    ):
+        self.record_ids = record_ids
+        self.label_ids = label_ids
+        self.confidences = confidences
+        self.token_starts = token_starts
+        self.token_ends = token_ends
+
+    def __len__(self) -> int:
+        return len(self.record_ids)
+
+    @property
+    def is_extraction(self) -> bool:
+        return self.token_starts is not None
+
+    @classmethod
+    def from_classification(cls, weak_supervision_results: pd.Series):
+        predictions = weak_supervision_results.dropna()
+        if len(predictions) == 0:
+            return cls(
+                np.empty(0, dtype=object),
+                pd.Categorical([]),
+                np.empty(0, dtype=np.float64),
+            )
+        label_ids, confidences = zip(*predictions.to_numpy())
+        return cls(
+            predictions.index.to_numpy(dtype=object),
+            pd.Categorical(label_ids),
+            np.asarray(confidences, dtype=np.float64),
+        )
+
+    @classmethod
+    def from_extraction(cls, weak_supervision_results: Dict[str, List[Any]]):
+        record_ids = []
+        label_ids = []
+        confidences = []
+        token_starts = []
+        token_ends = []
+        for record_id, predictions in weak_supervision_results.items():
+            for label_id, confidence, token_min, token_max in predictions:
+                record_ids.append(record_id)
+                label_ids.append(label_id)
+                confidences.append(confidence)
+                token_starts.append(token_min)
+                token_ends.append(token_max)
+        return cls(
+            np.asarray(record_ids, dtype=object),
+            pd.Categorical(label_ids),
+            np.asarray(confidences, dtype=np.float64),
+            np.asarray(token_starts, dtype=np.int32),
+            np.asarray(token_ends, dtype=np.int32),
+        )
+
+    def to_dict(self) -> Dict[str, List[Dict[str, Any]]]:
+        # per-record format of weak_supervision.store_data
+        return_values = {}
+        label_ids = np.asarray(self.label_ids, dtype=object)
+        for position, record_id in enumerate(self.record_ids):
+            prediction = {
+                "label_id": label_ids[position],
+                "confidence": float(self.confidences[position]),
+            }
+            if self.is_extraction:
+                prediction["token_index_start"] = int(self.token_starts[position])
+                prediction["token_index_end"] = int(self.token_ends[position])
+            return_values.setdefault(record_id, []).append(prediction)
+        return return_values
+
+
+def classification_to_dict(
+    weak_supervision_results: pd.Series,
+) -> Dict[str, List[Dict[str, Any]]]:
+    # weak_nlp's output straight into the per-record format of
+    # weak_supervision.store_data
+    return_values = {}
+    for record_id, (label_id, confidence) in weak_supervision_results.dropna().items():
+        return_values.setdefault(record_id, []).append(
+            {"label_id": label_id, "confidence": confidence}
+        )
+    return return_values
+
+
+def extraction_to_dict(
+    weak_supervision_results: Dict[str, List[Any]],
+) -> Dict[str, List[Dict[str, Any]]]:
+    return_values = {}
+    for record_id, predictions in weak_supervision_results.items():
+        for label_id, confidence, token_min, token_max in predictions:
+            return_values.setdefault(record_id, []).append(
+                {
+                    "label_id": label_id,
+                    "confidence": confidence,
+                    "token_index_start": token_min,
+                    "token_index_end": token_max,
+                }
+            )
+    return return_values
@@ -0,0 +1,136 @@
+from typing import Dict, FrozenSet, Iterable, Optional, Sequence, Tuple, Union
+import pandas as pd
+import weak_nlp
+
+from . import cache, compute, incremental, integration, loader, metadata, metrics
+from . import util
+from submodules.model import enums
+
+
+class TaskSnapshot:
+    # loaded associations of one labeling task plus the weak_nlp models and
+    # metrics computed from them, shared by all statistics of one request
+    def __init__(
+        self,
+        project_id: str,
+        labeling_task_id: str,
+        task_type: str,
+        df: pd.DataFrame,
+        source_versions: Optional[Dict[str, str]] = None,
+        exclusion_ids: Optional[Iterable[str]] = None,
+    ):
+        self.project_id = project_id
+        self.labeling_task_id = labeling_task_id
+        self.task_type = task_type
+        self.df = df
+        self.source_versions = source_versions
+        # records excluded while loading, df doesn't contain them at all
+        self.exclusion_ids = frozenset(exclusion_ids or ())
+        self.models: Dict[
+            Optional[FrozenSet[str]], Union[weak_nlp.CNLM, weak_nlp.ENLM]
+        ] = {}
+        self.metrics: Dict[Tuple[str, Optional[FrozenSet[str]]], pd.DataFrame] = {}
+
+    @property
+    def is_classification(self) -> bool:
+        return self.task_type == enums.LabelingTaskType.CLASSIFICATION.value
+
+    def get_df(self, exclusion_ids: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        if not exclusion_ids:
+            return self.df
+        remaining = set(exclusion_ids) - self.exclusion_ids
+        return loader.exclude_records(self.df, remaining)
+
+    @property
+    def model_type(self) -> str:
+        if self.is_classification:
+            return compute.CLASSIFICATION
+        return compute.EXTRACTION
+
+    def get_model(
+        self, exclusion_ids: Optional[Iterable[str]] = None
+    ) -> Union[weak_nlp.CNLM, weak_nlp.ENLM]:
+        df, key = self.__filtered(exclusion_ids)
+        if key not in self.models:
+            self.models[key] = compute.build_model(df, self.model_type)
+        return self.models[key]
+
+    def get_metrics(
+        self, operation: str, exclusion_ids: Optional[Iterable[str]] = None
+    ) -> pd.DataFrame:
+        df, key = self.__filtered(exclusion_ids)
+        if (operation, key) not in self.metrics:
+            if metrics.uses_numpy():
+                self.metrics[(operation, key)] = metrics.run(
+                    df, self.model_type, operation
+                )
+                return self.metrics[(operation, key)]
+            # with a process pool the model is built in the worker instead
+            model = None if compute.uses_pool() else self.get_model(exclusion_ids)
+            self.metrics[(operation, key)] = compute.run(
+                df, self.model_type, operation, model=model
+            )
+        return self.metrics[(operation, key)]
+
+    def __filtered(
+        self, exclusion_ids: Optional[Iterable[str]]
+    ) -> Tuple[pd.DataFrame, Optional[FrozenSet[str]]]:
+        df = self.get_df(exclusion_ids)
+        # exclusions that don't remove anything share the unfiltered model
+        key = None
+        if len(df.index) != len(self.df.index):
+            key = frozenset(str(record_id) for record_id in exclusion_ids)
+        return df, key
+
+
+def load(
+    project_id: str,
+    labeling_task_id: str,
+    exclusion_ids: Optional[Sequence[str]] = None,
+    with_versions: bool = False,
+    manual_df: Optional[pd.DataFrame] = None,
+) -> TaskSnapshot:
+    # a snapshot loaded with exclusions only serves statistics that exclude
+    # (at least) the same records. with_versions fingerprints the sources for
+    # the incremental statistics, read before the rows so that a concurrent
+    # change leads to a recompute instead of a stale delta
+    source_versions = None
+    if with_versions and not cache.CACHE_ENABLED and incremental.INCREMENTAL_STATS:
+        task_info = metadata.get_task(project_id, labeling_task_id)
+        if task_info.task_type == enums.LabelingTaskType.CLASSIFICATION.value:
+            source_versions = {
+                source_id or util.MANUAL_SOURCE_ID: version
+                for source_id, version in loader.get_source_versions(
+                    project_id, labeling_task_id, task_info.source_ids
+                ).items()
+            }
+    task_type, df = integration.collect_data(
+        project_id, labeling_task_id, False, exclusion_ids, manual_df
+    )
+    if cache.CACHE_ENABLED:
+        # versions of the cached frame, read while loading anyway
+        source_versions = cache.get_source_versions(project_id, labeling_task_id)
+    return TaskSnapshot(
+        project_id,
+        labeling_task_id,
+        task_type,
+        df,
+        source_versions,
+        exclusion_ids,
+    )
+
+
+def load_for_task(
+    labeling_task_id: str,
+    exclusion_ids: Optional[Sequence[str]] = None,
+    manual_df: Optional[pd.DataFrame] = None,
+) -> TaskSnapshot:
+    task_info = metadata.get_task_by_id(labeling_task_id)
+    return load(
+        task_info.project_id, task_info.id, exclusion_ids, manual_df=manual_df
+    )
+
+
+def load_for_source(source_id: str) -> TaskSnapshot:
+    task_info = metadata.get_task_by_source(source_id)
+    return load(task_info.project_id, task_info.id, with_versions=True)
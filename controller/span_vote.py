@@ -0,0 +1,112 @@
+from typing import Dict, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+from . import compute, instrument, results, util, weighted_vote
+
+
+@instrument.timed("numpy_weakly_supervise")
+def weakly_supervise(
+    df: pd.DataFrame,
+    quality_metrics_overwrite: Optional[Dict[Tuple[str, str], Dict[str, float]]] = None,
+) -> results.IntegrationResults:
+    # every heuristic span votes with precision * confidence for its label on
+    # each token it covers. A token goes to the label with the highest sum,
+    # consecutive tokens of one label form a span whose confidence is the mean
+    # share of the winning label on its tokens
+    votes = df.loc[df["source_id"].notna()]
+    if len(votes.index) == 0:
+        return __empty_results()
+    spans = util.get_extraction_spans(votes)
+    if not spans["is_beginning"].all():
+        # weak_nlp gets no start for the span of a group without a beginning
+        # token, the vote below can't reproduce that so the task is left to it
+        print("Extraction spans without a beginning token, using weak_nlp", flush=True)
+        instrument.weak_nlp_fallbacks.inc({"engine": "span_vote"})
+        return results.IntegrationResults.from_extraction(
+            compute.run(
+                df,
+                compute.EXTRACTION,
+                compute.WEAKLY_SUPERVISE,
+                quality_metrics_overwrite,
+            )
+        )
+
+    if quality_metrics_overwrite is None:
+        quality_metrics_overwrite = weighted_vote.get_quality_metrics(
+            df, compute.EXTRACTION
+        )
+    precision = weighted_vote.precision_matrix(
+        spans["source_ids"], spans["label_ids"], quality_metrics_overwrite
+    )
+    weights = (
+        precision[spans["source_codes"], spans["label_codes"]] * spans["confidences"]
+    )
+
+    # project the spans onto the token grid of their record, spans whose last
+    # token lies in front of the first one cover nothing
+    starts = spans["starts"].astype(np.int64)
+    lengths = np.maximum(spans["ends"].astype(np.int64) - starts + 1, 0)
+    if lengths.sum() == 0:
+        return __empty_results()
+    tokens = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    tokens += np.arange(lengths.sum())
+    token_count = int(tokens.max()) + 1
+    label_count = len(spans["label_ids"])
+    cells = (
+        np.repeat(spans["record_codes"].astype(np.int64), lengths) * token_count
+        + tokens
+    ) * label_count + np.repeat(spans["label_codes"], lengths)
+    keys, key_codes = np.unique(cells, return_inverse=True)
+    scores = np.bincount(
+        key_codes.ravel(), weights=np.repeat(weights, lengths), minlength=len(keys)
+    )
+    key_tokens = keys // label_count
+    key_labels = keys % label_count
+    token_keys, token_codes = np.unique(key_tokens, return_inverse=True)
+    token_codes = token_codes.ravel()
+    totals = np.bincount(token_codes, weights=scores, minlength=len(token_keys))
+
+    # winning label per (record, token), ties go to the lower label id
+    order = np.lexsort((key_labels, -scores, token_codes))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = token_codes[order][1:] != token_codes[order][:-1]
+    best = order[first]
+    best = best[totals[token_codes[best]] > 0]
+    if len(best) == 0:
+        return __empty_results()
+    best_records = key_tokens[best] // token_count
+    best_tokens = key_tokens[best] % token_count
+    best_labels = key_labels[best]
+    shares = scores[best] / totals[token_codes[best]]
+
+    # best is ordered by record and token, a new span starts wherever the
+    # record or label changes or a token is skipped
+    is_span_start = np.ones(len(best), dtype=bool)
+    is_span_start[1:] = (
+        (best_records[1:] != best_records[:-1])
+        | (best_labels[1:] != best_labels[:-1])
+        | (best_tokens[1:] != best_tokens[:-1] + 1)
+    )
+    span_first = np.flatnonzero(is_span_start)
+    span_last = np.append(span_first[1:], len(best)) - 1
+    confidences = np.add.reduceat(shares, span_first) / (span_last - span_first + 1)
+    return results.IntegrationResults(
+        spans["record_ids"][best_records[span_first]],
+        pd.Categorical.from_codes(
+            best_labels[span_first], categories=pd.Index(spans["label_ids"])
+        ),
+        confidences,
+        best_tokens[span_first].astype(np.int32),
+        best_tokens[span_last].astype(np.int32),
+    )
+
+
+def __empty_results() -> results.IntegrationResults:
+    return results.IntegrationResults(
+        np.empty(0, dtype=object),
+        pd.Categorical([]),
+        np.empty(0, dtype=np.float64),
+        np.empty(0, dtype=np.int32),
+        np.empty(0, dtype=np.int32),
+    )
@@ -1,21 +1,15 @@
-import os
 from typing import Dict, Optional
 import pandas as pd
-import requests
-from submodules.model.business_objects.organization import get_organization_id
-from . import util
-from controller import integration
+from . import compute
+from . import incremental, metadata, metrics, notify, snapshot, stats_writer
 from submodules.model import enums
 from submodules.model.business_objects import (
     information_source,
-    labeling_task,
     notification,
-    project,
-    user,
 )
 import weak_nlp
 
-WEBSOCKET_ENDPOINT = os.getenv("WS_NOTIFY_ENDPOINT")
+WEBSOCKET_ENDPOINT = notify.NOTIFY_ENDPOINT
 
 
 def send_organization_update(
@@ -36,18 +30,9 @@ def send_organization_update(
     else:
         message = f"{project_id}:{message}"
     if not organization_id:
-        project_item = project.get(project_id)
-        organization_id = str(project_item.organization_id)
-
-    req = requests.post(
-        f"{WEBSOCKET_ENDPOINT}/notify",
-        json={
-            "organization": organization_id,
-            "message": message,
-        },
-    )
-    if req.status_code != 200:
-        print("Could not send notification update", flush=True)
+        organization_id = metadata.get_project_organization_id(project_id)
+
+    notify.dispatcher.send(organization_id, message)
 
 
 def send_warning_no_reference_data(project_id: str, user_id: str):
@@ -60,7 +45,7 @@ def send_warning_no_reference_data(project_id: str, user_id: str):
             enums.NotificationType.MISSING_REFERENCE_DATA.value,
             with_commit=True,
         )
-        organization_id = get_organization_id(project_id, user_id)
+        organization_id = metadata.get_user_organization_id(project_id, user_id)
         if organization_id:
             send_organization_update(
                 project_id, f"notification_created:{user_id}", True, organization_id
@@ -77,7 +62,7 @@ def send_warning_no_coverage_data(project_id: str, user_id: str):
             enums.NotificationType.MISSING_REFERENCE_DATA.value,
             with_commit=True,
         )
-        organization_id = get_organization_id(project_id, user_id)
+        organization_id = metadata.get_user_organization_id(project_id, user_id)
         if organization_id:
             send_organization_update(
                 project_id, f"notification_created:{user_id}", True, organization_id
@@ -85,162 +70,165 @@ def send_warning_no_coverage_data(project_id: str, user_id: str):
 
 
 def check_user_can_receive_notifications(user_id: str) -> bool:
-    user_item = user.get(user_id)
-    if user_item.role == enums.UserRoles.ENGINEER.value:
+    if metadata.get_user_role(user_id) == enums.UserRoles.ENGINEER.value:
         return True
     return False
 
 
 def calculate_quality_statistics_for_labeling_task(
-    project_id: str, task_id: str, user_id: str
+    project_id: str,
+    task_id: str,
+    user_id: str,
+    task_snapshot: Optional[snapshot.TaskSnapshot] = None,
+    manual_df: Optional[pd.DataFrame] = None,
 ):
-    labeling_task_item = labeling_task.get_labeling_task_by_id_only(task_id)
-    _, df = integration.collect_data(
-        labeling_task_item.project_id, labeling_task_item.id, False
-    )
     exclusion_ids = information_source.get_exclusion_record_ids_for_task(task_id)
-    df = df.loc[~df["record_id"].isin(exclusion_ids)]
+    if task_snapshot is None:
+        # the excluded records aren't loaded in the first place
+        task_snapshot = snapshot.load_for_task(task_id, exclusion_ids, manual_df)
+    df = task_snapshot.get_df(exclusion_ids)
     try:
-        if labeling_task_item.task_type == enums.LabelingTaskType.CLASSIFICATION.value:
-            statistics = classification_quality(df)
+        quality_df = task_snapshot.get_metrics(compute.QUALITY_METRICS, exclusion_ids)
+        if task_snapshot.is_classification:
+            statistics = classification_quality(df, quality_df)
         else:
-            statistics = extraction_quality(df)
-        for source_id, statistics_item in statistics.items():
-            information_source.update_quality_stats(
-                labeling_task_item.project_id,
-                source_id,
-                statistics_item,
-                with_commit=True,
-            )
+            statistics = extraction_quality(df, quality_df)
+        stats_writer.store_quality(task_snapshot.project_id, statistics)
     except weak_nlp.shared.exceptions.MissingReferenceException:
         send_warning_no_reference_data(project_id, user_id)
 
 
 def calculate_quality_statistics_for_source(
-    project_id: str, source_id: str, user_id: str
+    project_id: str,
+    source_id: str,
+    user_id: str,
+    task_snapshot: Optional[snapshot.TaskSnapshot] = None,
 ):
-    labeling_task_item = labeling_task.get_labeling_task_by_source_id(source_id)
-    _, df = integration.collect_data(
-        labeling_task_item.project_id, labeling_task_item.id, False
-    )
+    if task_snapshot is None:
+        task_snapshot = snapshot.load_for_source(source_id)
     exclusion_ids = information_source.get_exclusion_record_ids(source_id)
-    df = df.loc[~df["record_id"].isin(exclusion_ids)]
+    df = task_snapshot.get_df(exclusion_ids)
     try:
-        if labeling_task_item.task_type == enums.LabelingTaskType.CLASSIFICATION.value:
-            statistics = classification_quality(df)
+        quality_df = task_snapshot.get_metrics(compute.QUALITY_METRICS, exclusion_ids)
+        if task_snapshot.is_classification:
+            statistics = classification_quality(df, quality_df)
         else:
-            statistics = extraction_quality(df)
+            statistics = extraction_quality(df, quality_df)
         stats = statistics.get(source_id)
         if stats is not None:
-            information_source.update_quality_stats(
-                labeling_task_item.project_id, source_id, stats, with_commit=True
-            )
+            stats_writer.store_quality(task_snapshot.project_id, {source_id: stats})
     except weak_nlp.shared.exceptions.MissingReferenceException:
         send_warning_no_reference_data(project_id, user_id)
 
 
 def calculate_quantity_statistics_for_labeling_task_from_source(
-    project_id: str, source_id: str, user_id: str
+    project_id: str,
+    source_id: str,
+    user_id: str,
+    task_snapshot: Optional[snapshot.TaskSnapshot] = None,
 ) -> bool:
-    labeling_task_item = labeling_task.get_labeling_task_by_source_id(source_id)
-    _, df = integration.collect_data(
-        labeling_task_item.project_id, labeling_task_item.id, False
-    )
+    if task_snapshot is None:
+        task_snapshot = snapshot.load_for_source(source_id)
+    df = task_snapshot.get_df()
     if len(df.index) == 0:
         #nothing to calculate if the source didn't hit anything
         return
-    if labeling_task_item.task_type == enums.LabelingTaskType.CLASSIFICATION.value:
-        statistics = classification_quantity(df)
+    if task_snapshot.is_classification:
+        statistics = incremental.classification_quantity_delta(
+            task_snapshot.project_id,
+            task_snapshot.labeling_task_id,
+            task_snapshot.source_versions,
+            source_id,
+            df,
+        )
+        if statistics is None:
+            statistics = classification_quantity(
+                df, task_snapshot.get_metrics(compute.QUANTITY_METRICS)
+            )
+            incremental.remember(
+                task_snapshot.project_id,
+                task_snapshot.labeling_task_id,
+                task_snapshot.source_versions,
+                df,
+                statistics,
+            )
     else:
-        statistics = extraction_quantity(df)
+        statistics = extraction_quantity(
+            df, task_snapshot.get_metrics(compute.QUANTITY_METRICS)
+        )
 
     if source_id not in statistics:
         send_warning_no_coverage_data(project_id, user_id)
         return False
-    information_source.delete_stats(labeling_task_item.project_id, source_id)
-    for source_id, statistics_item in statistics.items():
-        information_source.update_quantity_stats(
-            labeling_task_item.project_id, source_id, statistics_item, with_commit=True
-        )
+    stats_writer.store_quantity(
+        task_snapshot.project_id, statistics, reset_source_ids=[source_id]
+    )
     return True
 
 
-def classification_quantity(df: pd.DataFrame) -> Dict[str, Dict[str, Dict[str, int]]]:
-    cnlm = util.get_cnlm_from_df(df)
-    quantity_df = cnlm.quantity_metrics()
-
-    stats = {}
-    if len(quantity_df) > 0:
-        for source_id, quality_df_sub_source in quantity_df.groupby("identifier"):
-            stats[source_id] = {}
-            for label_id, quality_df_sub_source_label in quality_df_sub_source.groupby(
-                "label_name"
-            ):
-                row = quality_df_sub_source_label.iloc[0]
-                stats[source_id][label_id] = {
-                    "record_coverage": int(row["record_coverage"]),
-                    "source_conflicts": int(row["source_conflicts"]),
-                    "source_overlaps": int(row["source_overlaps"]),
-                    "total_hits": int(row["record_coverage"]),
-                }
-    return stats
-
-
-def extraction_quantity(df: pd.DataFrame) -> Dict[str, Dict[str, Dict[str, int]]]:
-    enlm = util.get_enlm_from_df(df)
-    quantity_df = enlm.quantity_metrics()
-
-    stats = {}
-    if len(quantity_df) > 0:
-        for source_id, quality_df_sub_source in quantity_df.groupby("identifier"):
-            stats[source_id] = {}
-            for label_id, quality_df_sub_source_label in quality_df_sub_source.groupby(
-                "label_name"
-            ):
-                row = quality_df_sub_source_label.iloc[0]
-                stats[source_id][label_id] = {
-                    "record_coverage": int(row["record_coverage"]),
-                    "source_conflicts": int(row["source_conflicts"]),
-                    "source_overlaps": int(row["source_overlaps"]),
-                    "total_hits": int(row["total_hits"]),
-                }
-    return stats
-
-
-def classification_quality(df: pd.DataFrame) -> Dict[str, Dict[str, Dict[str, int]]]:
-    cnlm = util.get_cnlm_from_df(df)
-    quality_df = cnlm.quality_metrics()
-    stats = {}
-    if len(quality_df) > 0:
-        for source_id, quality_df_sub_source in quality_df.groupby("identifier"):
-            stats[source_id] = {}
-            for label_id, quality_df_sub_source_label in quality_df_sub_source.groupby(
-                "label_name"
-            ):
-                row = quality_df_sub_source_label.iloc[0]
-                stats[source_id][label_id] = {
-                    "true_positives": int(row["true_positives"]),
-                    "false_positives": int(row["false_positives"]),
-                    "false_negatives": 0,
-                }
-    return stats
-
-
-def extraction_quality(df: pd.DataFrame) -> Dict[str, Dict[str, Dict[str, int]]]:
-
-    enlm = util.get_enlm_from_df(df)
-    quality_df = enlm.quality_metrics()
-    stats = {}
-    if len(quality_df) > 0:
-        for source_id, quality_df_sub_source in quality_df.groupby("identifier"):
-            stats[source_id] = {}
-            for label_id, quality_df_sub_source_label in quality_df_sub_source.groupby(
-                "label_name"
-            ):
-                row = quality_df_sub_source_label.iloc[0]
-                stats[source_id][label_id] = {
-                    "true_positives": int(row["true_positives"]),
-                    "false_positives": int(row["false_positives"]),
-                    "false_negatives": int(row["false_negatives"]),
-                }
-    return stats
+def classification_quantity(
+    df: pd.DataFrame, quantity_df: Optional[pd.DataFrame] = None
+) -> Dict[str, Dict[str, Dict[str, int]]]:
+    if quantity_df is None:
+        quantity_df = __metrics(df, compute.CLASSIFICATION, compute.QUANTITY_METRICS)
+    return metrics.to_statistics(
+        quantity_df,
+        {
+            "record_coverage": "record_coverage",
+            "source_conflicts": "source_conflicts",
+            "source_overlaps": "source_overlaps",
+            "total_hits": "record_coverage",
+        },
+    )
+
+
+def extraction_quantity(
+    df: pd.DataFrame, quantity_df: Optional[pd.DataFrame] = None
+) -> Dict[str, Dict[str, Dict[str, int]]]:
+    if quantity_df is None:
+        quantity_df = __metrics(df, compute.EXTRACTION, compute.QUANTITY_METRICS)
+    return metrics.to_statistics(
+        quantity_df,
+        {
+            "record_coverage": "record_coverage",
+            "source_conflicts": "source_conflicts",
+            "source_overlaps": "source_overlaps",
+            "total_hits": "total_hits",
+        },
+    )
+
+
+def classification_quality(
+    df: pd.DataFrame, quality_df: Optional[pd.DataFrame] = None
+) -> Dict[str, Dict[str, Dict[str, int]]]:
+    if quality_df is None:
+        quality_df = __metrics(df, compute.CLASSIFICATION, compute.QUALITY_METRICS)
+    return metrics.to_statistics(
+        quality_df,
+        {
+            "true_positives": "true_positives",
+            "false_positives": "false_positives",
+            "false_negatives": None,
+        },
+    )
+
+
+def extraction_quality(
+    df: pd.DataFrame, quality_df: Optional[pd.DataFrame] = None
+) -> Dict[str, Dict[str, Dict[str, int]]]:
+    if quality_df is None:
+        quality_df = __metrics(df, compute.EXTRACTION, compute.QUALITY_METRICS)
+    return metrics.to_statistics(
+        quality_df,
+        {
+            "true_positives": "true_positives",
+            "false_positives": "false_positives",
+            "false_negatives": "false_negatives",
+        },
+    )
+
+
+def __metrics(df: pd.DataFrame, model_type: str, operation: str) -> pd.DataFrame:
+    if metrics.uses_numpy():
+        return metrics.run(df, model_type, operation)
+    return compute.run(df, model_type, operation)
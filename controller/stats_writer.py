@@ -0,0 +1,193 @@
+import os
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import text
+
+from . import instrument
+from submodules.model.business_objects import general, information_source
+
+# "orm" writes through the information_source business objects, "sql" with
+# batched UPDATE/INSERT statements (raw SQL against
+# information_source_statistics, opt-in until it is verified against the
+# schema of the model package). Both commit once for all sources
+STATS_WRITER = os.getenv("WS_STATS_WRITER", "orm")
+
+QUALITY_COLUMNS = ["true_positives", "false_positives", "false_negatives"]
+QUANTITY_COLUMNS = [
+    "record_coverage",
+    "total_hits",
+    "source_conflicts",
+    "source_overlaps",
+]
+# keeps the statement below the postgres bind parameter limit
+ROWS_PER_STATEMENT = 1000
+
+__LOCK_QUERY = """
+SELECT pg_advisory_xact_lock(hashtext(:lock_key))
+"""
+
+__DELETE_QUERY = """
+DELETE FROM information_source_statistics
+WHERE project_id = :project_id
+AND source_id = ANY(CAST(:source_ids AS UUID[]))
+"""
+
+__UPDATE_QUERY = """
+UPDATE information_source_statistics iss
+SET {assignments}
+FROM (VALUES {values}) AS v (source_id, label_id, {columns})
+WHERE iss.project_id = :project_id
+AND iss.source_id = CAST(v.source_id AS UUID)
+AND iss.labeling_task_label_id = CAST(v.label_id AS UUID)
+"""
+
+__INSERT_QUERY = """
+INSERT INTO information_source_statistics (id, project_id, source_id, labeling_task_label_id, {columns})
+SELECT CAST(v.id AS UUID), CAST(:project_id AS UUID), CAST(v.source_id AS UUID), CAST(v.label_id AS UUID), {source_columns}
+FROM (VALUES {values}) AS v (id, source_id, label_id, {columns})
+WHERE NOT EXISTS (
+    SELECT 1
+    FROM information_source_statistics iss
+    WHERE iss.project_id = :project_id
+    AND iss.source_id = CAST(v.source_id AS UUID)
+    AND iss.labeling_task_label_id = CAST(v.label_id AS UUID)
+)
+"""
+
+
+def store_quality(
+    project_id: str, statistics: Dict[str, Dict[str, Dict[str, int]]]
+) -> None:
+    if STATS_WRITER == "sql":
+        store(project_id, statistics, QUALITY_COLUMNS)
+    else:
+        store_orm(project_id, statistics, information_source.update_quality_stats)
+
+
+def store_quantity(
+    project_id: str,
+    statistics: Dict[str, Dict[str, Dict[str, int]]],
+    reset_source_ids: Optional[Iterable[str]] = None,
+) -> None:
+    if STATS_WRITER == "sql":
+        store(project_id, statistics, QUANTITY_COLUMNS, reset_source_ids)
+    else:
+        store_orm(
+            project_id,
+            statistics,
+            information_source.update_quantity_stats,
+            reset_source_ids,
+        )
+
+
+def store(
+    project_id: str,
+    statistics: Dict[str, Dict[str, Dict[str, int]]],
+    columns: List[str],
+    reset_source_ids: Optional[Iterable[str]] = None,
+) -> None:
+    # writes {source_id: {label_id: stats}} in one transaction, readers see
+    # either the previous or the new statistics of all sources
+    rows = [
+        [source_id, label_id] + [int(stats[column]) for column in columns]
+        for source_id, label_stats in statistics.items()
+        for label_id, stats in label_stats.items()
+    ]
+    with instrument.phase("store_statistics") as observed:
+        observed["rows"] = len(rows)
+        __write(project_id, rows, columns, reset_source_ids)
+
+
+def store_orm(
+    project_id: str,
+    statistics: Dict[str, Dict[str, Dict[str, int]]],
+    update: Callable[..., Any],
+    reset_source_ids: Optional[Iterable[str]] = None,
+) -> None:
+    # same writes as before, committed once instead of once per source
+    with instrument.phase("store_statistics") as observed:
+        observed["rows"] = sum(len(label_stats) for label_stats in statistics.values())
+        try:
+            for source_id in reset_source_ids or []:
+                information_source.delete_stats(project_id, source_id)
+            for source_id, label_stats in statistics.items():
+                update(project_id, source_id, label_stats, with_commit=False)
+            general.commit()
+        except Exception:
+            general.rollback()
+            raise
+
+
+def __write(
+    project_id: str,
+    rows: List[List[Any]],
+    columns: List[str],
+    reset_source_ids: Optional[Iterable[str]],
+) -> None:
+    try:
+        # serializes concurrent writers of a project, otherwise both could
+        # insert the same missing row
+        general.execute(
+            text(__LOCK_QUERY),
+            {"lock_key": f"information_source_statistics:{project_id}"},
+        )
+        reset_source_ids = list(reset_source_ids or [])
+        if reset_source_ids:
+            general.execute(
+                text(__DELETE_QUERY),
+                {"project_id": project_id, "source_ids": reset_source_ids},
+            )
+        for start in range(0, len(rows), ROWS_PER_STATEMENT):
+            chunk = rows[start : start + ROWS_PER_STATEMENT]
+            __update(project_id, chunk, columns)
+            __insert(project_id, chunk, columns)
+        general.commit()
+    except Exception:
+        general.rollback()
+        raise
+
+
+def __update(project_id: str, rows: List[List[Any]], columns: List[str]) -> None:
+    values, params = __values(rows, ["source_id", "label_id"] + columns)
+    assignments = ", ".join(f"{column} = v.{column}" for column in columns)
+    general.execute(
+        text(
+            __UPDATE_QUERY.format(
+                assignments=assignments, values=values, columns=", ".join(columns)
+            )
+        ),
+        {"project_id": project_id, **params},
+    )
+
+
+def __insert(project_id: str, rows: List[List[Any]], columns: List[str]) -> None:
+    values, params = __values(
+        [[str(uuid.uuid4())] + row for row in rows],
+        ["id", "source_id", "label_id"] + columns,
+    )
+    general.execute(
+        text(
+            __INSERT_QUERY.format(
+                columns=", ".join(columns),
+                source_columns=", ".join(f"v.{column}" for column in columns),
+                values=values,
+            )
+        ),
+        {"project_id": project_id, **params},
+    )
+
+
+def __values(
+    rows: List[List[Any]], names: List[str]
+) -> Tuple[str, Dict[str, Any]]:
+    # numbered bind parameters for a VALUES list, e.g. (:source_id_0, :label_id_0, ...)
+    params = {}
+    tuples = []
+    for position, row in enumerate(rows):
+        keys = []
+        for name, value in zip(names, row):
+            key = f"{name}_{position}"
+            params[key] = value
+            keys.append(f":{key}")
+        tuples.append(f"({', '.join(keys)})")
+    return ", ".join(tuples), params
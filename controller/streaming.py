@@ -0,0 +1,135 @@
+import os
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import pandas as pd
+
+from . import compute, instrument, loader, results, weighted_vote
+from submodules.model import enums
+from submodules.model.business_objects import weak_supervision
+
+# "memory" loads the whole task, "streaming" integrates record shards one by
+# one, "auto" streams classification tasks above STREAMING_THRESHOLD associations.
+# Extraction tasks are always integrated in memory
+FIT_PREDICT_MODE = os.getenv("WS_FIT_PREDICT_MODE", "auto")
+STREAMING_THRESHOLD = int(os.getenv("WS_STREAMING_THRESHOLD", "5000000"))
+SHARD_RECORDS = int(os.getenv("WS_STREAMING_SHARD_RECORDS", "100000"))
+
+
+def should_stream(
+    project_id: str, labeling_task_id: str, task_type: str, source_ids: Sequence[str]
+) -> bool:
+    # the ENLM hasn't been shown to integrate the records of a shard the same
+    # way as within the whole task, extraction isn't streamed
+    if task_type != enums.LabelingTaskType.CLASSIFICATION.value:
+        if FIT_PREDICT_MODE == "streaming":
+            print(
+                f"Streaming covers classification only, task {labeling_task_id} "
+                "is integrated in memory",
+                flush=True,
+            )
+        return False
+    if FIT_PREDICT_MODE == "streaming":
+        return True
+    if FIT_PREDICT_MODE != "auto":
+        return False
+    versions = loader.get_source_versions(project_id, labeling_task_id, source_ids)
+    association_count = sum(
+        int(version.split(":", 1)[0]) for version in versions.values()
+    )
+    return association_count > STREAMING_THRESHOLD
+
+
+def get_quality_metrics(
+    project_id: str, labeling_task_id: str, task_type: str, source_ids: Sequence[str]
+) -> Optional[Dict[Tuple[str, str], Dict[str, float]]]:
+    # first pass, precision only depends on the manually labeled records.
+    # None if there is nothing to compute it from
+    df = loader.load_associations(
+        project_id, labeling_task_id, task_type, source_ids, labeled_only=True
+    )
+    if len(df.index) == 0:
+        return None
+    return weighted_vote.get_quality_metrics(df) or None
+
+
+def fit_predict_classification(
+    project_id: str,
+    labeling_task_id: str,
+    user_id: str,
+    weak_supervision_task_id: str,
+    task_type: str,
+    source_ids: Sequence[str],
+    quality_metrics: Dict[Tuple[str, str], Dict[str, float]],
+    engine: str = weighted_vote.WEAK_NLP,
+) -> None:
+    # second pass, every shard is loaded, integrated and released before the
+    # next one is loaded. weak_supervision.store_data replaces the labels of
+    # the whole task, the per-record results of all shards are handed to it at
+    # once
+    record_ranges = loader.get_record_shards(
+        project_id, labeling_task_id, source_ids, SHARD_RECORDS
+    )
+    if not record_ranges:
+        # same as the in-memory path, nothing hit so nothing is replaced
+        weak_supervision.update_state(
+            project_id,
+            weak_supervision_task_id,
+            enums.PayloadState.FINISHED.value,
+            with_commit=True,
+        )
+        return
+    results_by_record = {}
+    for shard_results in __integrate_shards(
+        __load_shards(
+            project_id, labeling_task_id, task_type, source_ids, record_ranges
+        ),
+        quality_metrics,
+        engine,
+    ):
+        # the shards hold disjoint records
+        results_by_record.update(shard_results)
+    with instrument.phase("store_results") as observed:
+        observed["rows"] = len(results_by_record)
+        weak_supervision.store_data(
+            project_id,
+            labeling_task_id,
+            user_id,
+            results_by_record,
+            task_type,
+            weak_supervision_task_id,
+            with_commit=True,
+        )
+
+
+def __load_shards(
+    project_id: str,
+    labeling_task_id: str,
+    task_type: str,
+    source_ids: Sequence[str],
+    record_ranges: List[Tuple[str, Optional[str]]],
+) -> Iterator[pd.DataFrame]:
+    for record_range in record_ranges:
+        yield loader.load_associations(
+            project_id,
+            labeling_task_id,
+            task_type,
+            source_ids,
+            record_range=record_range,
+        )
+
+
+def __integrate_shards(
+    shards: Iterator[pd.DataFrame],
+    quality_metrics: Dict[Tuple[str, str], Dict[str, float]],
+    engine: str,
+) -> Iterator[Dict[str, List[Dict[str, Any]]]]:
+    for df in shards:
+        if len(df.index) == 0:
+            continue
+        if engine == weighted_vote.NUMPY:
+            yield weighted_vote.weakly_supervise(df, quality_metrics).to_dict()
+            continue
+        yield results.classification_to_dict(
+            compute.run(
+                df, compute.CLASSIFICATION, compute.WEAKLY_SUPERVISE, quality_metrics
+            )
+        )
@@ -1,61 +1,146 @@
+from typing import Dict, Optional, Tuple
 import weak_nlp
+import numpy as np
 import pandas as pd
 
+MANUAL_SOURCE_ID = "manual"
+
+
+def sorted_codes(
+    values: pd.Series, missing_value: Optional[str] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    # integer codes following the sorted order of the values, works on the
+    # categorical frame of the loader as well as on plain object columns
+    codes, uniques = pd.factorize(values)
+    uniques = np.asarray(uniques, dtype=object)
+    if missing_value is not None and (codes < 0).any():
+        codes = np.where(codes < 0, len(uniques), codes)
+        uniques = np.append(uniques, np.array([missing_value], dtype=object))
+    order = np.argsort(uniques, kind="stable")
+    ranks = np.empty(len(order), dtype=np.intp)
+    ranks[order] = np.arange(len(order))
+    if len(ranks) > 0:
+        codes = np.where(codes >= 0, ranks[codes], -1)
+    return codes, uniques[order]
+
 
 def get_cnlm_from_df(df: pd.DataFrame) -> weak_nlp.CNLM:
+    source_codes, source_ids = sorted_codes(df["source_id"], MANUAL_SOURCE_ID)
+    order = np.argsort(source_codes, kind="stable")
+    source_boundaries = np.searchsorted(
+        source_codes[order], np.arange(len(source_ids) + 1)
+    )
+    record_ids = df["record_id"].to_numpy(dtype=object)[order]
+    label_ids = df["label_id"].to_numpy(dtype=object)[order]
+    confidences = df["confidence"].to_numpy(dtype=np.float64)[order]
+
     vectors = []
-    for source_id, df_sub_source in df.fillna("manual").groupby("source_id"):
-        associations = []
-        for _, row in df_sub_source.iterrows():
-            associations.append(
-                weak_nlp.ClassificationAssociation(
-                    row.record_id, row.label_id, confidence=row.confidence
-                )
+    for source_code, source_id in enumerate(source_ids):
+        rows = slice(source_boundaries[source_code], source_boundaries[source_code + 1])
+        associations = [
+            weak_nlp.ClassificationAssociation(record_id, label_id, confidence=confidence)
+            for record_id, label_id, confidence in zip(
+                record_ids[rows].tolist(),
+                label_ids[rows].tolist(),
+                confidences[rows].tolist(),
             )
+        ]
         vectors.append(
-            weak_nlp.SourceVector(source_id, source_id == "manual", associations)
+            weak_nlp.SourceVector(
+                source_id, source_id == MANUAL_SOURCE_ID, associations
+            )
         )
     return weak_nlp.CNLM(vectors)
 
 
+def get_extraction_spans(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    # one entry per (source, record, label) span, ordered by source, record and
+    # label. Codes index into the sorted source_ids, record_ids and label_ids
+    source_codes, source_ids = sorted_codes(df["source_id"], MANUAL_SOURCE_ID)
+    record_codes, record_ids = sorted_codes(df["record_id"])
+    label_codes, label_ids = sorted_codes(df["label_id"])
+
+    # tokens of each (source, record, label) in token order, the rows don't
+    # come ordered from the database. Stable, so rows of the same token keep
+    # their order
+    token_indices = df["token_index"].to_numpy()
+    order = np.lexsort((token_indices, label_codes, record_codes, source_codes))
+    source_codes = source_codes[order]
+    record_codes = record_codes[order]
+    label_codes = label_codes[order]
+    is_beginning = df["is_beginning_token"].to_numpy(dtype=bool)[order]
+    token_indices = token_indices[order]
+    confidences = df["confidence"].to_numpy(dtype=np.float64)[order]
+
+    is_group_start = np.ones(len(order), dtype=bool)
+    is_group_start[1:] = (
+        (source_codes[1:] != source_codes[:-1])
+        | (record_codes[1:] != record_codes[:-1])
+        | (label_codes[1:] != label_codes[:-1])
+    )
+    group_ids = np.cumsum(is_group_start) - 1
+    group_first_rows = np.flatnonzero(is_group_start)
+    group_has_beginning = np.bincount(group_ids, weights=is_beginning) > 0
+
+    # a span starts at every beginning token; tokens in front of the first
+    # beginning token of a group are dropped unless the group has none at all
+    span_first_rows = np.flatnonzero(is_group_start | is_beginning)
+    span_last_rows = np.append(span_first_rows[1:], len(order)) - 1
+    span_groups = group_ids[span_first_rows]
+    keep = is_beginning[span_first_rows] | ~group_has_beginning[span_groups]
+    span_first_rows = span_first_rows[keep]
+    span_last_rows = span_last_rows[keep]
+    span_groups = span_groups[keep]
+
+    return {
+        "source_ids": source_ids,
+        "record_ids": record_ids,
+        "label_ids": label_ids,
+        "source_codes": source_codes[span_first_rows],
+        "record_codes": record_codes[span_first_rows],
+        "label_codes": label_codes[span_first_rows],
+        "is_beginning": is_beginning[span_first_rows],
+        "starts": token_indices[span_first_rows],
+        "ends": token_indices[span_last_rows],
+        "confidences": confidences[group_first_rows[span_groups]],
+    }
+
+
 def get_enlm_from_df(df: pd.DataFrame) -> weak_nlp.ENLM:
+    if len(df.index) == 0:
+        return weak_nlp.ENLM([])
+    spans = get_extraction_spans(df)
+    source_ids = spans["source_ids"]
+    span_sources = spans["source_codes"]
+    span_records = spans["record_ids"][spans["record_codes"]]
+    span_labels = spans["label_ids"][spans["label_codes"]]
+    span_starts = np.where(
+        spans["is_beginning"], spans["starts"].astype(object), None
+    )
+    span_ends = spans["ends"].astype(object)
+    span_confidences = spans["confidences"]
+
     vectors = []
-    for source_id, df_sub_source in df.fillna("manual").groupby("source_id"):
-        associations = []
-        for (
-            record_id,
-            label_id,
-        ), df_sub_source_record_label in df_sub_source.groupby(
-            ["record_id", "label_id"]
-        ):
-            chunk_start_idx = None
-            chunk_end_idx = None
-            for _, row in df_sub_source_record_label.iterrows():
-                if row.is_beginning_token:
-                    if chunk_start_idx is not None:
-                        associations.append(
-                            weak_nlp.ExtractionAssociation(
-                                record_id,
-                                label_id,
-                                chunk_start_idx,
-                                chunk_end_idx,
-                                confidence=df_sub_source_record_label.confidence.iloc[
-                                    0
-                                ],
-                            )
-                        )
-                    chunk_start_idx = row.token_index
-                chunk_end_idx = row.token_index
-            associations.append(
-                weak_nlp.ExtractionAssociation(
-                    record_id,
-                    label_id,
-                    chunk_start_idx,
-                    chunk_end_idx,
-                    confidence=df_sub_source_record_label.confidence.iloc[0],
-                )
+    source_boundaries = np.searchsorted(span_sources, np.arange(len(source_ids) + 1))
+    for source_code, source_id in enumerate(source_ids):
+        span_slice = slice(
+            source_boundaries[source_code], source_boundaries[source_code + 1]
+        )
+        associations = [
+            weak_nlp.ExtractionAssociation(
+                record_id, label_id, start, end, confidence=confidence
+            )
+            for record_id, label_id, start, end, confidence in zip(
+                span_records[span_slice].tolist(),
+                span_labels[span_slice].tolist(),
+                span_starts[span_slice].tolist(),
+                span_ends[span_slice].tolist(),
+                span_confidences[span_slice].tolist(),
             )
+        ]
         vectors.append(
-            weak_nlp.SourceVector(source_id, source_id == "manual", associations)
+            weak_nlp.SourceVector(
+                source_id, source_id == MANUAL_SOURCE_ID, associations
+            )
         )
     return weak_nlp.ENLM(vectors)
@@ -0,0 +1,130 @@
+import os
+from typing import Dict, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+from . import compute, instrument, results, util
+
+WEAK_NLP = "weak_nlp"
+NUMPY = "numpy"
+# default engines per task type, requests can pick one explicitly
+CLASSIFICATION_ENGINE = os.getenv("WS_CLASSIFICATION_ENGINE", WEAK_NLP)
+EXTRACTION_ENGINE = os.getenv("WS_EXTRACTION_ENGINE", WEAK_NLP)
+ENGINES = (WEAK_NLP, NUMPY)
+
+
+def get_engine(
+    engine: Optional[str] = None, model_type: str = compute.CLASSIFICATION
+) -> str:
+    if not engine:
+        if model_type == compute.CLASSIFICATION:
+            engine = CLASSIFICATION_ENGINE
+        else:
+            engine = EXTRACTION_ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown classification engine {engine}")
+    return engine
+
+
+@instrument.timed("numpy_weakly_supervise")
+def weakly_supervise(
+    df: pd.DataFrame,
+    quality_metrics_overwrite: Optional[Dict[Tuple[str, str], Dict[str, float]]] = None,
+) -> results.IntegrationResults:
+    # every heuristic hit votes for its label with precision * confidence. The
+    # label with the highest sum wins, its confidence is its share of all votes
+    # of the record. The (record, label) sums are kept sparse as flat keys
+    if quality_metrics_overwrite is None:
+        quality_metrics_overwrite = get_quality_metrics(df)
+
+    votes = df.loc[df["source_id"].notna()]
+    record_codes, record_ids = util.sorted_codes(votes["record_id"])
+    label_codes, label_ids = util.sorted_codes(votes["label_id"])
+    source_codes, source_ids = util.sorted_codes(votes["source_id"])
+    if len(record_ids) == 0:
+        return results.IntegrationResults(
+            np.empty(0, dtype=object),
+            pd.Categorical([]),
+            np.empty(0, dtype=np.float64),
+        )
+
+    precision = precision_matrix(source_ids, label_ids, quality_metrics_overwrite)
+    weights = precision[source_codes, label_codes] * votes["confidence"].to_numpy(
+        dtype=np.float64
+    )
+
+    label_count = len(label_ids)
+    keys, key_codes = np.unique(
+        record_codes.astype(np.int64) * label_count + label_codes, return_inverse=True
+    )
+    scores = np.bincount(key_codes.ravel(), weights=weights, minlength=len(keys))
+    key_records = keys // label_count
+    key_labels = keys % label_count
+    totals = np.bincount(key_records, weights=scores, minlength=len(record_ids))
+
+    # best label per record, ties go to the lower label id
+    order = np.lexsort((key_labels, -scores, key_records))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = key_records[order][1:] != key_records[order][:-1]
+    best = order[first]
+    best = best[totals[key_records[best]] > 0]
+    return __to_results(
+        record_ids,
+        label_ids,
+        key_records[best],
+        key_labels[best],
+        scores[best] / totals[key_records[best]],
+    )
+
+
+def get_quality_metrics(
+    df: pd.DataFrame, model_type: str = compute.CLASSIFICATION
+) -> Dict[Tuple[str, str], Dict[str, float]]:
+    # same lookup weak_nlp builds when no overwrite is given. Precision only
+    # depends on the manually labeled records, the model is built from their
+    # rows instead of the whole task
+    quality_df = compute.run(labeled_records(df), model_type, compute.QUALITY_METRICS)
+    if len(quality_df) == 0:
+        return {}
+    return quality_df.set_index(["identifier", "label_name"]).to_dict(orient="index")
+
+
+def labeled_records(df: pd.DataFrame) -> pd.DataFrame:
+    # all rows of the records with a manual label, the whole frame if there are
+    # none (weak_nlp reports the missing reference then)
+    record_ids = df["record_id"]
+    labeled = record_ids.loc[df["source_id"].isna()].unique()
+    if len(labeled) == 0:
+        return df
+    return df.loc[record_ids.isin(labeled)]
+
+
+def precision_matrix(
+    source_ids: np.ndarray,
+    label_ids: np.ndarray,
+    quality_metrics: Dict[Tuple[str, str], Dict[str, float]],
+) -> np.ndarray:
+    # unknown (source, label) pairs don't vote
+    source_lookup = {source_id: code for code, source_id in enumerate(source_ids)}
+    label_lookup = {label_id: code for code, label_id in enumerate(label_ids)}
+    precision = np.zeros((len(source_ids), len(label_ids)), dtype=np.float64)
+    for (source_id, label_id), metrics in quality_metrics.items():
+        source_code = source_lookup.get(source_id)
+        label_code = label_lookup.get(label_id)
+        if source_code is not None and label_code is not None:
+            precision[source_code, label_code] = metrics["precision"]
+    return precision
+
+
+def __to_results(
+    record_ids: np.ndarray,
+    label_ids: np.ndarray,
+    record_codes: np.ndarray,
+    label_codes: np.ndarray,
+    confidences: np.ndarray,
+) -> results.IntegrationResults:
+    return results.IntegrationResults(
+        record_ids[record_codes],
+        pd.Categorical.from_codes(label_codes, categories=pd.Index(label_ids)),
+        confidences,
+    )
@@ -0,0 +1,131 @@
+from typing import Any, Dict, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+from controller import compute, results, span_vote, weighted_vote
+
+# Randomized tasks and helpers to compare the numpy engines with weak_nlp,
+# shared by the parity tests and benchmark/weighted_vote_parity.py
+
+
+def random_task(rng: np.random.Generator, record_count: int) -> pd.DataFrame:
+    source_ids = [f"source-{i}" for i in range(rng.integers(1, 8))]
+    label_ids = [f"label-{i}" for i in range(rng.integers(2, 6))]
+    hit_count = int(record_count * rng.uniform(0.5, 3))
+    df = pd.DataFrame(
+        {
+            "record_id": rng.integers(0, record_count, hit_count).astype(str),
+            "source_id": rng.choice(source_ids, hit_count),
+            "source_type": "INFORMATION_SOURCE",
+            "confidence": rng.uniform(0.1, 1, hit_count).astype(np.float32),
+            "label_id": rng.choice(label_ids, hit_count),
+        }
+    ).drop_duplicates(["record_id", "source_id"])
+    labeled = rng.choice(record_count, record_count // 5, replace=False).astype(str)
+    manual = pd.DataFrame(
+        {
+            "record_id": labeled,
+            "source_id": None,
+            "source_type": "MANUAL",
+            "confidence": np.float32(1),
+            "label_id": rng.choice(label_ids, len(labeled)),
+        }
+    )
+    return pd.concat([df, manual], ignore_index=True)
+
+
+def random_extraction_task(
+    rng: np.random.Generator, record_count: int
+) -> pd.DataFrame:
+    # spans of up to four tokens, one row per token
+    source_ids = [f"source-{i}" for i in range(rng.integers(1, 8))]
+    label_ids = [f"label-{i}" for i in range(rng.integers(2, 6))]
+    span_count = int(record_count * rng.uniform(1, 4))
+    lengths = rng.integers(1, 5, span_count)
+    starts = rng.integers(0, 60, span_count)
+    span_sources = rng.choice(source_ids + [None], span_count)
+    df = pd.DataFrame(
+        {
+            "record_id": np.repeat(
+                rng.integers(0, record_count, span_count).astype(str), lengths
+            ),
+            "source_id": np.repeat(span_sources, lengths),
+            "source_type": np.repeat(
+                np.where(pd.isna(span_sources), "MANUAL", "INFORMATION_SOURCE"),
+                lengths,
+            ),
+            "confidence": np.repeat(
+                rng.uniform(0.1, 1, span_count).astype(np.float32), lengths
+            ),
+            "label_id": np.repeat(rng.choice(label_ids, span_count), lengths),
+            "token_index": np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+            + np.arange(lengths.sum()),
+            "is_beginning_token": np.arange(lengths.sum())
+            == np.repeat(np.cumsum(lengths) - lengths, lengths),
+        }
+    )
+    return df.drop_duplicates(["record_id", "source_id", "label_id", "token_index"])
+
+
+def overwrite_for(
+    rng: np.random.Generator, df: pd.DataFrame
+) -> Dict[Tuple[str, str], Dict[str, float]]:
+    # same structure as integration.__create_quality_metrics
+    return {
+        (source_id, label_id): {"precision": float(rng.uniform(0.1, 1))}
+        for source_id in df["source_id"].dropna().unique()
+        for label_id in df["label_id"].unique()
+    }
+
+
+def compare(
+    expected: results.IntegrationResults,
+    actual: results.IntegrationResults,
+    tolerance: float,
+) -> int:
+    # number of records whose predictions differ
+    expected, actual = expected.to_dict(), actual.to_dict()
+    mismatches = len(set(expected) ^ set(actual))
+    for record_id in set(expected) & set(actual):
+        left = sorted(expected[record_id], key=__prediction_key)
+        right = sorted(actual[record_id], key=__prediction_key)
+        if [__prediction_key(item) for item in left] != [
+            __prediction_key(item) for item in right
+        ] or any(
+            abs(left_item["confidence"] - right_item["confidence"]) > tolerance
+            for left_item, right_item in zip(left, right)
+        ):
+            mismatches += 1
+    return mismatches
+
+
+def __prediction_key(prediction: Dict[str, Any]) -> Tuple[Any, ...]:
+    return (
+        prediction.get("token_index_start", 0),
+        prediction.get("token_index_end", 0),
+        prediction["label_id"],
+    )
+
+
+def run_weak_nlp(
+    df: pd.DataFrame,
+    overwrite: Optional[Dict[Tuple[str, str], Dict[str, float]]],
+    extraction: bool,
+) -> results.IntegrationResults:
+    if extraction:
+        return results.IntegrationResults.from_extraction(
+            compute.run(df, compute.EXTRACTION, compute.WEAKLY_SUPERVISE, overwrite)
+        )
+    return results.IntegrationResults.from_classification(
+        compute.run(df, compute.CLASSIFICATION, compute.WEAKLY_SUPERVISE, overwrite)
+    )
+
+
+def run_numpy(
+    df: pd.DataFrame,
+    overwrite: Optional[Dict[Tuple[str, str], Dict[str, float]]],
+    extraction: bool,
+) -> results.IntegrationResults:
+    if extraction:
+        return span_vote.weakly_supervise(df, overwrite)
+    return weighted_vote.weakly_supervise(df, overwrite)
@@ -0,0 +1,97 @@
+import math
+import os
+import pickle
+from typing import Any, Dict, Tuple
+import numpy as np
+import pytest
+
+from controller import export
+
+# The memory mapped export has to give back what the legacy pickle holds, in
+# the same types.
+
+TASKS = 20
+
+Stats = Dict[Tuple[str, str], Dict[str, Any]]
+
+
+@pytest.fixture(autouse=True)
+def export_dir(monkeypatch: pytest.MonkeyPatch, tmp_path) -> None:
+    monkeypatch.setattr(export, "EXPORT_DIR", str(tmp_path))
+    monkeypatch.setattr(export, "WRITE_LEGACY_PICKLE", True)
+
+
+def random_stats(rng: np.random.Generator) -> Stats:
+    # quality metrics like weak_nlp's, with missing statistics and NaN values
+    ws_stats = {}
+    for source in range(rng.integers(0, 6)):
+        for label in range(rng.integers(1, 4)):
+            stats = {
+                "true_positives": int(rng.integers(0, 100)),
+                "false_positives": np.int64(rng.integers(0, 100)),
+                "precision": float(rng.random()),
+                "recall": float("nan") if rng.random() < 0.3 else float(rng.random()),
+                "label_name": f"label-{label}",
+                "is_selected": bool(rng.random() < 0.5),
+            }
+            ws_stats[(f"source-{source}", f"label-{label}")] = {
+                name: value for name, value in stats.items() if rng.random() < 0.8
+            }
+    return ws_stats
+
+
+def assert_same(actual: Stats, expected: Stats) -> None:
+    assert actual.keys() == expected.keys()
+    for key, stats in expected.items():
+        assert actual[key].keys() == stats.keys(), key
+        for name, value in stats.items():
+            if isinstance(value, np.generic):
+                value = value.item()
+            assert type(actual[key][name]) is type(value), (key, name)
+            if isinstance(value, float) and math.isnan(value):
+                assert math.isnan(actual[key][name]), (key, name)
+            else:
+                assert actual[key][name] == value, (key, name)
+
+
+@pytest.mark.parametrize("seed", range(TASKS))
+def test_round_trips_the_pickle(seed: int) -> None:
+    ws_stats = random_stats(np.random.default_rng(seed))
+    assert export.write("project", "task", ws_stats)
+    with open(export.get_legacy_path("project", "task"), "rb") as f:
+        pickled = pickle.load(f)
+    assert_same(export.load("project", "task"), pickled)
+
+    records = export.read(export.get_path("project", "task"))
+    for (heuristic_id, label_id), stats in pickled.items():
+        assert_same(
+            {"key": export.lookup(records, heuristic_id, label_id)}, {"key": stats}
+        )
+    assert export.lookup(records, "unknown", "label-0") is None
+
+
+def test_unchanged_export_is_skipped() -> None:
+    ws_stats = random_stats(np.random.default_rng(0))
+    assert export.write("project", "task", ws_stats)
+    assert not export.write("project", "task", dict(ws_stats))
+    ws_stats[("source-new", "label-0")] = {"precision": 0.5}
+    assert export.write("project", "task", ws_stats)
+
+
+def test_unsupported_values_stay_in_the_pickle() -> None:
+    ws_stats = {
+        ("source", "label"): {"precision": 0.5, "note": None, "count": 1},
+        ("other", "label"): {"precision": 1.0, "note": "text", "count": 1.5},
+    }
+    export.write("project", "task", ws_stats)
+    assert export.load("project", "task") == {
+        ("source", "label"): {"precision": 0.5},
+        ("other", "label"): {"precision": 1.0},
+    }
+
+
+def test_falls_back_to_the_pickle() -> None:
+    ws_stats = {("source", "label"): {"precision": 0.5}}
+    export.write("project", "task", ws_stats)
+    os.remove(export.get_path("project", "task"))
+    assert export.load("project", "task") == ws_stats
@@ -0,0 +1,103 @@
+from typing import Dict
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("weak_nlp")
+
+from controller import compute, incremental, metrics, stats  # noqa: E402
+from tests import tasks  # noqa: E402
+
+# The quantity statistics updated from the delta of a re-run source have to
+# equal those of a full recompute on the changed task.
+
+TASKS = 20
+RECORDS = 300
+RERUNS = 10
+
+
+@pytest.fixture(autouse=True)
+def tracked_state(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(incremental, "INCREMENTAL_STATS", True)
+    incremental.forget()
+    yield
+    incremental.forget()
+
+
+def full_statistics(df: pd.DataFrame) -> Dict[str, Dict[str, Dict[str, int]]]:
+    return stats.classification_quantity(
+        df, metrics.run(df, compute.CLASSIFICATION, compute.QUANTITY_METRICS)
+    )
+
+
+def rerun(rng: np.random.Generator, df: pd.DataFrame, source_id: str) -> pd.DataFrame:
+    # the hits of one source are replaced by those of a fresh random task
+    fresh = tasks.random_task(rng, RECORDS)
+    fresh = fresh.loc[fresh["source_id"].notna()].assign(source_id=source_id)
+    fresh = fresh.drop_duplicates(["record_id", "source_id"])
+    return pd.concat([df.loc[df["source_id"] != source_id], fresh], ignore_index=True)
+
+
+@pytest.mark.parametrize("seed", range(TASKS))
+def test_delta_equals_full_recompute(seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    df = tasks.random_task(rng, RECORDS)
+    source_ids = sorted(df["source_id"].dropna().unique())
+    versions = {source_id: "0" for source_id in source_ids}
+    statistics = full_statistics(df)
+    incremental.remember("project", "task", dict(versions), df, statistics)
+
+    for run in range(1, RERUNS + 1):
+        source_id = rng.choice(source_ids)
+        df = rerun(rng, df, source_id)
+        versions[source_id] = str(run)
+        changed = incremental.classification_quantity_delta(
+            "project", "task", dict(versions), source_id, df
+        )
+        assert changed is not None
+        # stored like stats_writer.store_quantity with the source reset
+        statistics.pop(source_id, None)
+        for changed_source_id, labels in changed.items():
+            statistics.setdefault(changed_source_id, {}).update(labels)
+        assert statistics == full_statistics(df), run
+
+
+def test_other_changes_need_a_full_recompute() -> None:
+    df = tasks.random_task(np.random.default_rng(0), RECORDS)
+    source_ids = sorted(df["source_id"].dropna().unique())
+    versions = {source_id: "0" for source_id in source_ids + ["other"]}
+    incremental.remember("project", "task", dict(versions), df, full_statistics(df))
+    changed_versions = {**versions, "other": "1"}
+    assert (
+        incremental.classification_quantity_delta(
+            "project", "task", changed_versions, source_ids[0], df
+        )
+        is None
+    )
+    assert (
+        incremental.classification_quantity_delta(
+            "project", "other_task", dict(versions), source_ids[0], df
+        )
+        is None
+    )
+
+
+def test_state_is_bounded(monkeypatch: pytest.MonkeyPatch) -> None:
+    df = tasks.random_task(np.random.default_rng(0), RECORDS)
+    versions = {source_id: "0" for source_id in df["source_id"].dropna().unique()}
+    statistics = full_statistics(df)
+    monkeypatch.setattr(incremental, "MAX_TRACKED_TASKS", 2)
+    for task in range(3):
+        incremental.remember("project", str(task), versions, df, statistics)
+    assert incremental.get_counters()["tasks"] == 2
+
+    index_bytes = incremental.RecordIndex(df).nbytes
+    monkeypatch.setattr(incremental, "MAX_TRACKED_BYTES", index_bytes)
+    incremental.remember("project", "3", versions, df, statistics)
+    assert incremental.get_counters() == {"tasks": 1, "bytes": index_bytes}
+
+    monkeypatch.setattr(incremental, "MAX_TRACKED_BYTES", index_bytes - 1)
+    incremental.remember("project", "4", versions, df, statistics)
+    assert incremental.get_counters()["tasks"] == 1
+    assert incremental.forget("project") == 1
+    assert incremental.get_counters()["tasks"] == 0
@@ -0,0 +1,58 @@
+import threading
+import time
+import numpy as np
+import pytest
+
+from controller import instrument
+
+# The phase gauges are read back from the rendered metrics.
+
+ALLOCATED_BYTES = 200 * 1024**2
+
+
+def gauge_value(name: str, phase: str) -> float:
+    for line in instrument.render().splitlines():
+        if line.startswith(f"{name}{{") and f'phase="{phase}"' in line:
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"{name} not rendered for {phase}")
+
+
+@pytest.mark.skipif(
+    instrument.RssSampler.read() is None, reason="needs /proc/self/statm"
+)
+def test_peak_rss_covers_memory_freed_within_the_phase(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(instrument, "INSTRUMENTATION_ENABLED", True)
+    with instrument.phase("test_peak_rss"):
+        before = instrument.RssSampler.read()
+        allocated = np.ones(ALLOCATED_BYTES // 8)
+        time.sleep(10 * instrument.rss_sampler.interval_seconds)
+        del allocated
+    after = instrument.RssSampler.read()
+    peak = gauge_value("ws_phase_peak_rss_bytes", "test_peak_rss")
+    assert peak >= before + ALLOCATED_BYTES * 0.9
+    assert peak > after + ALLOCATED_BYTES * 0.5
+
+
+def test_sampler_stops_without_phases() -> None:
+    sampler = instrument.RssSampler(0.01)
+    token = sampler.start()
+    if token is None:
+        pytest.skip("needs /proc/self/statm")
+    assert sampler.stop(token) > 0
+    time.sleep(0.1)
+    assert "ws-rss-sampler" not in [thread.name for thread in threading.enumerate()]
+
+
+def test_counter_renders_totals_per_label_set() -> None:
+    counter = instrument.Counter("ws_test_total", "Test counter")
+    counter.inc({"engine": "a"})
+    counter.inc({"engine": "a"}, 2)
+    counter.inc({"engine": "b"})
+    assert counter.render() == [
+        "# HELP ws_test_total Test counter",
+        "# TYPE ws_test_total counter",
+        'ws_test_total{engine="a"} 3.0',
+        'ws_test_total{engine="b"} 1.0',
+    ]
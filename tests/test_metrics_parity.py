@@ -0,0 +1,58 @@
+from typing import Dict
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("weak_nlp")
+
+from controller import compute, metrics, stats  # noqa: E402
+from tests import tasks  # noqa: E402
+
+# The statistics the numpy metrics engine stores are compared with those of
+# weak_nlp's CNLM and ENLM on randomized tasks.
+
+TASKS = 30
+RECORDS = 300
+
+
+def statistics_of(
+    df: pd.DataFrame, model_type: str, metrics_df: pd.DataFrame, operation: str
+) -> Dict[str, Dict[str, Dict[str, int]]]:
+    extraction = model_type == compute.EXTRACTION
+    if operation == compute.QUALITY_METRICS:
+        if extraction:
+            return stats.extraction_quality(df, metrics_df)
+        return stats.classification_quality(df, metrics_df)
+    if extraction:
+        return stats.extraction_quantity(df, metrics_df)
+    return stats.classification_quantity(df, metrics_df)
+
+
+def assert_same_statistics(df: pd.DataFrame, model_type: str) -> None:
+    for operation in (compute.QUALITY_METRICS, compute.QUANTITY_METRICS):
+        expected = statistics_of(
+            df, model_type, compute.run(df, model_type, operation), operation
+        )
+        actual = statistics_of(
+            df, model_type, metrics.run(df, model_type, operation), operation
+        )
+        assert actual == expected, operation
+
+
+@pytest.mark.parametrize("seed", range(TASKS))
+def test_classification_statistics_match_weak_nlp(seed: int) -> None:
+    df = tasks.random_task(np.random.default_rng(seed), RECORDS)
+    assert_same_statistics(df, compute.CLASSIFICATION)
+
+
+@pytest.mark.parametrize("seed", range(TASKS))
+@pytest.mark.parametrize("without_beginning", [False, True])
+def test_extraction_statistics_match_weak_nlp(
+    seed: int, without_beginning: bool
+) -> None:
+    rng = np.random.default_rng(seed)
+    df = tasks.random_extraction_task(rng, RECORDS)
+    if without_beginning:
+        # groups without a beginning token are left to weak_nlp
+        df["is_beginning_token"] &= rng.random(len(df.index)) > 0.3
+    assert_same_statistics(df, compute.EXTRACTION)
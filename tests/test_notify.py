@@ -0,0 +1,193 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List
+import pytest
+
+from controller import instrument, notify
+
+# The dispatcher is run against a stand-in of the websocket service on
+# localhost that records the notifications and answers with scripted status
+# codes.
+
+BACKOFF_SECONDS = 0.05
+
+
+class StandIn(ThreadingHTTPServer):
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.received: List[Dict[str, Any]] = []
+        self.received_at: List[float] = []
+        # status codes of the next responses, 200 once they are used up
+        self.statuses: List[int] = []
+        self.delay_seconds = 0.0
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(self.server.delay_seconds)
+        self.server.received.append(json.loads(body))
+        self.server.received_at.append(time.monotonic())
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def stand_in() -> Iterator[StandIn]:
+    server = StandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def dispatcher_for(stand_in: StandIn, **kwargs: Any) -> notify.Dispatcher:
+    options = {
+        "coalesce_seconds": 60,
+        "timeout_seconds": 2,
+        "retries": 3,
+        "backoff_seconds": BACKOFF_SECONDS,
+    }
+    options.update(kwargs)
+    return notify.Dispatcher(stand_in.endpoint, **options)
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def done(dispatcher: notify.Dispatcher, count: int) -> Callable[[], bool]:
+    def condition() -> bool:
+        counters = dispatcher.get_counters()
+        return counters["sent"] + counters["failed"] >= count
+
+    return condition
+
+
+def test_delivers_notifications(stand_in: StandIn) -> None:
+    dispatcher = dispatcher_for(stand_in)
+    assert dispatcher.send("organization", "project:message")
+    wait_for(done(dispatcher, 1))
+    dispatcher.shutdown(5)
+    assert stand_in.received == [
+        {"organization": "organization", "message": "project:message"}
+    ]
+    counters = dispatcher.get_counters()
+    assert counters["sent"] == 1
+    assert counters["failed"] == 0
+
+
+def test_coalesces_duplicates_within_the_window(stand_in: StandIn) -> None:
+    dispatcher = dispatcher_for(stand_in)
+    assert dispatcher.send("organization", "notification_created:user")
+    assert not dispatcher.send("organization", "notification_created:user")
+    assert dispatcher.send("organization", "notification_created:other")
+    assert dispatcher.send("other", "notification_created:user")
+    wait_for(done(dispatcher, 3))
+    dispatcher.shutdown(5)
+    assert len(stand_in.received) == 3
+    assert dispatcher.get_counters()["coalesced"] == 1
+
+
+def test_sends_again_after_the_window(stand_in: StandIn) -> None:
+    dispatcher = dispatcher_for(stand_in, coalesce_seconds=0.1)
+    assert dispatcher.send("organization", "message")
+    time.sleep(0.2)
+    assert dispatcher.send("organization", "message")
+    wait_for(done(dispatcher, 2))
+    dispatcher.shutdown(5)
+    assert len(stand_in.received) == 2
+
+
+def test_retries_server_errors_with_backoff(stand_in: StandIn) -> None:
+    stand_in.statuses = [503, 502]
+    dispatcher = dispatcher_for(stand_in)
+    dispatcher.send("organization", "message")
+    wait_for(done(dispatcher, 1))
+    dispatcher.shutdown(5)
+    assert len(stand_in.received) == 3
+    counters = dispatcher.get_counters()
+    assert counters["sent"] == 1
+    assert counters["retried"] == 2
+    first, second, third = stand_in.received_at
+    assert second - first >= BACKOFF_SECONDS
+    assert third - second >= 2 * BACKOFF_SECONDS
+
+
+def test_gives_up_after_all_attempts(stand_in: StandIn) -> None:
+    stand_in.statuses = [500] * 10
+    dispatcher = dispatcher_for(stand_in, retries=2)
+    dispatcher.send("organization", "message")
+    wait_for(done(dispatcher, 1))
+    dispatcher.shutdown(5)
+    assert len(stand_in.received) == 3
+    assert dispatcher.get_counters()["failed"] == 1
+
+
+def test_does_not_retry_client_errors(stand_in: StandIn) -> None:
+    stand_in.statuses = [400]
+    dispatcher = dispatcher_for(stand_in)
+    dispatcher.send("organization", "message")
+    wait_for(done(dispatcher, 1))
+    dispatcher.shutdown(5)
+    assert len(stand_in.received) == 1
+    counters = dispatcher.get_counters()
+    assert counters["failed"] == 1
+    assert counters["retried"] == 0
+
+
+def test_drops_when_the_queue_is_full(stand_in: StandIn) -> None:
+    stand_in.delay_seconds = 0.5
+    dispatcher = dispatcher_for(stand_in, max_queued=1)
+    assert dispatcher.send("organization", "first")
+    # the worker is busy with the first message, the second fills the queue
+    wait_for(lambda: dispatcher.get_counters()["pending"] == 0)
+    assert dispatcher.send("organization", "second")
+    assert not dispatcher.send("organization", "third")
+    assert dispatcher.get_counters()["dropped"] == 1
+    dispatcher.shutdown(5)
+
+
+def test_shutdown_with_a_full_queue_does_not_block(stand_in: StandIn) -> None:
+    stand_in.delay_seconds = 2
+    dispatcher = dispatcher_for(stand_in, max_queued=1, timeout_seconds=5)
+    dispatcher.send("organization", "first")
+    wait_for(lambda: dispatcher.get_counters()["pending"] == 0)
+    dispatcher.send("organization", "second")
+    start = time.monotonic()
+    dispatcher.shutdown(0.2)
+    assert time.monotonic() - start < 1
+    # the current delivery finishes, the queued one is dropped
+    wait_for(lambda: dispatcher.get_counters()["dropped"] == 1)
+    assert [item["message"] for item in stand_in.received] == ["first"]
+    assert dispatcher.get_counters()["sent"] == 1
+
+
+def test_counters_are_exported_with_the_metrics(stand_in: StandIn) -> None:
+    dispatcher = dispatcher_for(stand_in)
+    dispatcher.send("organization", "message")
+    wait_for(done(dispatcher, 1))
+    dispatcher.shutdown(5)
+    lines = notify.DispatcherCounters(dispatcher).render()
+    assert "ws_notify_sent_total 1" in lines
+    assert "ws_notify_pending 0" in lines
+    rendered = instrument.render()
+    assert "ws_notify_sent_total" in rendered
+    assert "ws_notify_latency_seconds_bucket" in rendered
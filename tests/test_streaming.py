@@ -0,0 +1,81 @@
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("weak_nlp")
+
+from controller import integration, loader, streaming, weighted_vote  # noqa: E402
+from submodules.model import enums  # noqa: E402
+from tests import tasks  # noqa: E402
+
+# Streaming fit_predict integrates record shards one by one, its results have
+# to equal those of the in-memory path on the whole task.
+
+TASKS = 20
+RECORDS = 300
+SHARD_RECORDS = 37
+
+
+def record_ranges(df: pd.DataFrame, shard_size: int) -> List[Tuple[str, Optional[str]]]:
+    # same ranges as loader.get_record_shards, in record id order
+    starts = sorted(df["record_id"].unique())[::shard_size]
+    return list(zip(starts, starts[1:] + [None]))
+
+
+def load_shard(
+    df: pd.DataFrame, record_range: Tuple[str, Optional[str]]
+) -> pd.DataFrame:
+    record_from, record_to = record_range
+    in_range = df["record_id"] >= record_from
+    if record_to is not None:
+        in_range &= df["record_id"] < record_to
+    return df.loc[in_range]
+
+
+@pytest.mark.parametrize("engine", weighted_vote.ENGINES)
+@pytest.mark.parametrize("seed", range(TASKS))
+def test_streamed_results_equal_in_memory(
+    monkeypatch: pytest.MonkeyPatch, seed: int, engine: str
+) -> None:
+    rng = np.random.default_rng(seed)
+    df = tasks.random_task(rng, RECORDS)
+    quality_metrics = tasks.overwrite_for(rng, df)
+    stored: Dict[str, Any] = {}
+
+    def store_data(
+        project_id: str,
+        labeling_task_id: str,
+        user_id: str,
+        results: Dict[str, List[Dict[str, Any]]],
+        *args: Any,
+        **kwargs: Any,
+    ) -> None:
+        stored.update(results)
+
+    monkeypatch.setattr(
+        loader,
+        "get_record_shards",
+        lambda *args: record_ranges(df, SHARD_RECORDS),
+    )
+    monkeypatch.setattr(
+        loader,
+        "load_associations",
+        lambda *args, record_range, **kwargs: load_shard(df, record_range),
+    )
+    monkeypatch.setattr(
+        streaming.weak_supervision, "store_data", store_data, raising=False
+    )
+
+    streaming.fit_predict_classification(
+        "project",
+        "labeling_task",
+        "user",
+        "weak_supervision_task",
+        enums.LabelingTaskType.CLASSIFICATION.value,
+        sorted(df["source_id"].dropna().unique()),
+        quality_metrics,
+        engine,
+    )
+    expected = integration.integrate_classification(df, quality_metrics, engine)
+    assert stored == expected
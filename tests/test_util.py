@@ -0,0 +1,199 @@
+from typing import Any
+import numpy as np
+import pandas as pd
+import pytest
+
+weak_nlp = pytest.importorskip("weak_nlp")
+
+from controller import util  # noqa: E402
+
+# The builders are compared with the row by row implementations they replace.
+# weak_nlp's classes are swapped for recorders, so the arguments every
+# association, source vector and model is built from are compared exactly.
+
+TASKS = 300
+
+
+class Recorder:
+    def __init__(self, *args: Any, **kwargs: Any):
+        self.args = args
+        self.kwargs = kwargs
+
+    def __eq__(self, other: Any) -> bool:
+        return (
+            type(self) is type(other)
+            and normalize(self.args) == normalize(other.args)
+            and normalize(sorted(self.kwargs.items()))
+            == normalize(sorted(other.kwargs.items()))
+        )
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}{self.args}{self.kwargs}"
+
+
+def normalize(value: Any) -> Any:
+    # numpy scalars and python values compare equal, None stays None
+    if isinstance(value, (list, tuple)):
+        return [normalize(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class ClassificationAssociation(Recorder):
+    pass
+
+
+class ExtractionAssociation(Recorder):
+    pass
+
+
+class SourceVector(Recorder):
+    pass
+
+
+class CNLM(Recorder):
+    pass
+
+
+class ENLM(Recorder):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def recorders(monkeypatch: pytest.MonkeyPatch) -> None:
+    for recorder in (
+        ClassificationAssociation,
+        ExtractionAssociation,
+        SourceVector,
+        CNLM,
+        ENLM,
+    ):
+        monkeypatch.setattr(weak_nlp, recorder.__name__, recorder)
+
+
+def baseline_cnlm(df: pd.DataFrame) -> Any:
+    vectors = []
+    for source_id, df_sub_source in df.fillna("manual").groupby("source_id"):
+        associations = []
+        for _, row in df_sub_source.iterrows():
+            associations.append(
+                weak_nlp.ClassificationAssociation(
+                    row.record_id, row.label_id, confidence=row.confidence
+                )
+            )
+        vectors.append(
+            weak_nlp.SourceVector(source_id, source_id == "manual", associations)
+        )
+    return weak_nlp.CNLM(vectors)
+
+
+def random_classification_frame(rng: np.random.Generator) -> pd.DataFrame:
+    row_count = int(rng.integers(0, 300))
+    source_ids = np.array([f"source-{i}" for i in range(rng.integers(1, 6))] + [None])
+    df = pd.DataFrame(
+        {
+            "record_id": rng.integers(0, 50, row_count).astype(str),
+            "source_id": rng.choice(source_ids, row_count),
+            "source_type": "INFORMATION_SOURCE",
+            "confidence": rng.uniform(0, 1, row_count).astype(np.float32),
+            "label_id": rng.choice(["a", "b", "c"], row_count),
+        }
+    )
+    df.loc[df["source_id"].isna(), "source_type"] = "MANUAL"
+    return df
+
+
+def as_categorical(df: pd.DataFrame) -> pd.DataFrame:
+    # the id columns as the loader encodes them
+    return df.astype(
+        {
+            column: "category"
+            for column in ["record_id", "source_id", "source_type", "label_id"]
+        }
+    )
+
+
+@pytest.mark.parametrize("categorical", [False, True])
+def test_cnlm_matches_row_by_row_builder(categorical: bool) -> None:
+    rng = np.random.default_rng(1)
+    for _ in range(TASKS):
+        df = random_classification_frame(rng)
+        frame = as_categorical(df) if categorical else df
+        assert util.get_cnlm_from_df(frame) == baseline_cnlm(df)
+
+
+def baseline_enlm(df: pd.DataFrame) -> Any:
+    vectors = []
+    for source_id, df_sub_source in df.fillna("manual").groupby("source_id"):
+        associations = []
+        for (
+            record_id,
+            label_id,
+        ), df_sub_source_record_label in df_sub_source.groupby(
+            ["record_id", "label_id"]
+        ):
+            chunk_start_idx = None
+            chunk_end_idx = None
+            for _, row in df_sub_source_record_label.iterrows():
+                if row.is_beginning_token:
+                    if chunk_start_idx is not None:
+                        associations.append(
+                            weak_nlp.ExtractionAssociation(
+                                record_id,
+                                label_id,
+                                chunk_start_idx,
+                                chunk_end_idx,
+                                confidence=df_sub_source_record_label.confidence.iloc[
+                                    0
+                                ],
+                            )
+                        )
+                    chunk_start_idx = row.token_index
+                chunk_end_idx = row.token_index
+            associations.append(
+                weak_nlp.ExtractionAssociation(
+                    record_id,
+                    label_id,
+                    chunk_start_idx,
+                    chunk_end_idx,
+                    confidence=df_sub_source_record_label.confidence.iloc[0],
+                )
+            )
+        vectors.append(
+            weak_nlp.SourceVector(source_id, source_id == "manual", associations)
+        )
+    return weak_nlp.ENLM(vectors)
+
+
+def random_extraction_frame(rng: np.random.Generator) -> pd.DataFrame:
+    # token rows in random order with random beginning flags, so there are
+    # groups without a beginning token and tokens in front of the first one.
+    # The row by row builder expects them in token order
+    df = random_classification_frame(rng)
+    df["token_index"] = rng.integers(0, 40, len(df.index)).astype(np.int32)
+    df["is_beginning_token"] = rng.random(len(df.index)) < 0.3
+    return df
+
+
+@pytest.mark.parametrize("categorical", [False, True])
+def test_enlm_matches_row_by_row_builder(categorical: bool) -> None:
+    rng = np.random.default_rng(2)
+    for _ in range(TASKS):
+        df = random_extraction_frame(rng)
+        frame = as_categorical(df) if categorical else df
+        expected = baseline_enlm(df.sort_values("token_index", kind="stable"))
+        assert util.get_enlm_from_df(frame) == expected
+
+
+def test_enlm_ignores_row_order() -> None:
+    rng = np.random.default_rng(3)
+    for _ in range(TASKS):
+        df = random_extraction_frame(rng).drop_duplicates(
+            ["source_id", "record_id", "label_id", "token_index"]
+        )
+        shuffled = df.sample(frac=1, random_state=rng.integers(1 << 31))
+        assert util.get_enlm_from_df(shuffled) == util.get_enlm_from_df(df)
+        assert util.get_enlm_from_df(shuffled) == baseline_enlm(
+            df.sort_values("token_index")
+        )
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("weak_nlp")
+
+from controller import compute, instrument, span_vote, weighted_vote  # noqa: E402
+from tests import tasks  # noqa: E402
+
+# The numpy weighted votes are compared with weak_nlp's CNLM and ENLM on
+# randomized tasks, with the quality metrics weak_nlp derives itself and with
+# an overwrite.
+
+TASKS = 30
+RECORDS = 300
+TOLERANCE = 1e-6
+
+
+@pytest.mark.parametrize("seed", range(TASKS))
+def test_weighted_vote_matches_cnlm(seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    df = tasks.random_task(rng, RECORDS)
+    for overwrite in (None, tasks.overwrite_for(rng, df)):
+        expected = tasks.run_weak_nlp(df, overwrite, extraction=False)
+        actual = tasks.run_numpy(df, overwrite, extraction=False)
+        assert tasks.compare(expected, actual, TOLERANCE) == 0
+
+
+@pytest.mark.parametrize("seed", range(TASKS))
+def test_quality_metrics_from_labeled_records(seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    df = tasks.random_task(rng, RECORDS)
+    expected_df = compute.run(df, compute.CLASSIFICATION, compute.QUALITY_METRICS)
+    expected = expected_df.set_index(["identifier", "label_name"]).to_dict(
+        orient="index"
+    )
+    assert weighted_vote.get_quality_metrics(df) == expected
+
+
+@pytest.mark.parametrize("seed", range(TASKS))
+@pytest.mark.parametrize("without_beginning", [False, True])
+def test_span_vote_matches_enlm(seed: int, without_beginning: bool) -> None:
+    rng = np.random.default_rng(seed)
+    df = tasks.random_extraction_task(rng, RECORDS)
+    if without_beginning:
+        # groups without a beginning token are left to weak_nlp
+        df["is_beginning_token"] &= rng.random(len(df.index)) > 0.3
+    for overwrite in (None, tasks.overwrite_for(rng, df)):
+        expected = tasks.run_weak_nlp(df, overwrite, extraction=True)
+        actual = tasks.run_numpy(df, overwrite, extraction=True)
+        assert tasks.compare(expected, actual, TOLERANCE) == 0
+
+
+def fallbacks(engine: str) -> float:
+    for line in instrument.weak_nlp_fallbacks.render():
+        if f'engine="{engine}"' in line:
+            return float(line.rsplit(" ", 1)[1])
+    return 0
+
+
+def test_span_vote_reports_the_weak_nlp_fallback(
+    monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture
+) -> None:
+    df = tasks.random_extraction_task(np.random.default_rng(0), RECORDS)
+    df["is_beginning_token"] = False
+    monkeypatch.setattr(span_vote.compute, "run", lambda *args: {})
+    before = fallbacks("span_vote")
+    assert len(span_vote.weakly_supervise(df)) == 0
+    assert "without a beginning token, using weak_nlp" in capsys.readouterr().out
+    assert fallbacks("span_vote") == before + 1